@@ -0,0 +1,117 @@
+# Columnar storage of the prod and reference data.
+# CSV files are converted to Parquet datasets partitioned by version (one directory per version, version=v1/...),
+# so the reporting code reads only the columns it needs (abstract, rating, version, without the article texts)
+# and only the versions it needs (the other partitions are not opened).
+#
+# python columnar.py convert --input /data/prod_data.csv --output /data/parquet/prod_data
+# python columnar.py convert --input /data/reporting/evaluated_ref_data_sample.csv --delimiter ';' --output /data/parquet/evaluated_ref_data_sample
+# python columnar.py export --input /data/parquet/prod_data --output /data/reporting/prod_data_v1.csv --version v1
+
+import argparse
+import os
+import shutil
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.csv as pv
+import pyarrow.dataset as ds
+
+PARQUET_DIR = "parquet"  # Datasets are stored in <workspace>/parquet/<name>
+PARTITION_COLUMN = "version"
+# Types of the known columns, the others are inferred
+COLUMN_TYPES = {"article": pa.string(), "abstract": pa.string(), "rating": pa.float64(), "version": pa.string()}
+CSV_BLOCK_SIZE = 16 * 1024 * 1024  # Bytes of CSV parsed at once
+
+
+def dataset_path(workspace, name):
+    return os.path.join(workspace, PARQUET_DIR, name)
+
+
+def convert_csv(csv_path, output_dir, delimiter=",", partition_by=PARTITION_COLUMN):
+    """
+    Convert a CSV file to a Parquet dataset, streaming it by blocks (the file is never loaded at once).
+    The dataset is written next to `output_dir` then swapped in, readers never see a half-written dataset.
+    Returns the number of rows.
+    """
+    reader = pv.open_csv(
+        csv_path,
+        read_options=pv.ReadOptions(block_size=CSV_BLOCK_SIZE),
+        parse_options=pv.ParseOptions(delimiter=delimiter, newlines_in_values=True),  # Articles span several lines
+        convert_options=pv.ConvertOptions(column_types=COLUMN_TYPES, strings_can_be_null=True),
+    )
+    schema = reader.schema
+    rows = 0
+
+    def batches():
+        nonlocal rows
+        for batch in reader:
+            rows += batch.num_rows
+            yield batch
+
+    tmp_dir = f"{output_dir}.tmp"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    partitioning = ds.partitioning(pa.schema([schema.field(partition_by)]), flavor="hive") if partition_by in schema.names else None
+    ds.write_dataset(batches(), tmp_dir, schema=schema, format="parquet", partitioning=partitioning,
+                     existing_data_behavior="overwrite_or_ignore")
+    old_dir = f"{output_dir}.old"
+    shutil.rmtree(old_dir, ignore_errors=True)
+    if os.path.exists(output_dir):
+        os.rename(output_dir, old_dir)
+    os.rename(tmp_dir, output_dir)
+    shutil.rmtree(old_dir, ignore_errors=True)
+    return rows
+
+
+def open_dataset(path):
+    return ds.dataset(path, format="parquet", partitioning="hive")
+
+
+def read_dataset(path, columns=None, versions=None):
+    """
+    Read a Parquet dataset as a DataFrame.
+    columns : only these columns are read from the files (None for all, the missing ones are skipped)
+    versions : only these partitions are read (None for all)
+    """
+    dataset = open_dataset(path)
+    if columns is not None:
+        columns = [column for column in columns if column in dataset.schema.names]
+    filter = ds.field(PARTITION_COLUMN).isin(list(versions)) if versions is not None else None
+    df = dataset.to_table(columns=columns, filter=filter).to_pandas()
+    if PARTITION_COLUMN in df.columns and isinstance(df[PARTITION_COLUMN].dtype, pd.CategoricalDtype):
+        df[PARTITION_COLUMN] = df[PARTITION_COLUMN].astype(str)  # Partition values come back as categories
+    return df
+
+
+def export_csv(path, csv_path, columns=None, versions=None, delimiter=","):
+    """ Write a Parquet dataset (or some of its columns/versions) back to CSV, one record batch at a time. """
+    dataset = open_dataset(path)
+    filter = ds.field(PARTITION_COLUMN).isin(list(versions)) if versions is not None else None
+    header = True
+    with open(csv_path, "w", newline="", encoding="utf-8") as f:
+        for batch in dataset.to_batches(columns=columns, filter=filter):
+            batch.to_pandas().to_csv(f, index=False, header=header, sep=delimiter)
+            header = False
+        if header:  # Empty dataset, header only
+            pd.DataFrame(columns=columns or dataset.schema.names).to_csv(f, index=False, sep=delimiter)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Convert CSV data to version-partitioned Parquet datasets, and back.")
+    parser.add_argument("command", choices=["convert", "export"])
+    parser.add_argument("--input", required=True, help="CSV file (convert) or Parquet dataset (export)")
+    parser.add_argument("--output", required=True, help="Parquet dataset (convert) or CSV file (export)")
+    parser.add_argument("--delimiter", default=",")
+    parser.add_argument("--columns", nargs="+", default=None, help="Columns to export")
+    parser.add_argument("--version", nargs="+", default=None, dest="versions", help="Versions to export")
+    args = parser.parse_args()
+
+    if args.command == "convert":
+        rows = convert_csv(args.input, args.output, delimiter=args.delimiter)
+        print(f"{rows} rows of {args.input} written to {args.output}")
+    else:
+        export_csv(args.input, args.output, columns=args.columns, versions=args.versions, delimiter=args.delimiter)
+        print(f"{args.input} exported to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
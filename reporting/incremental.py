@@ -0,0 +1,112 @@
+# Incremental reporting.
+# The derived features of the production data (summary_length, word_count) are kept per version in
+# <workspace>/reporting/features/prod_features_<version>.parquet, with a high-water mark (rows already processed)
+# and a fingerprint of these rows in <workspace>/reporting/features/state.json. Prod data is append only : a run
+# computes the features of the new rows only, and a version whose data didn't change since its last report is skipped.
+# If the processed rows changed (split rebuilt, prod_data.csv exported again), every feature is computed again.
+
+import hashlib
+import json
+import os
+
+import pandas as pd
+
+FEATURES_DIR = "reporting/features"
+SOURCE_COLUMNS = ["abstract", "rating", "version"]  # Kept with the features, the article texts are not
+
+
+def add_derived_features(df):
+    """ summary_length and word_count of the abstracts, vectorized (same values as len(x) and len(x.split())). """
+    df["summary_length"] = df["abstract"].str.len()
+    df["word_count"] = df["abstract"].str.split().str.len()
+    return df
+
+
+def source_signature(path):
+    """ Size and modification time of a file, or of every file of a directory (Parquet partition). """
+    if os.path.isdir(path):
+        files = sorted(os.path.join(root, name) for root, _, names in os.walk(path) for name in names)
+    else:
+        files = [path] if os.path.exists(path) else []
+    digest = hashlib.sha256()
+    for file in files:
+        stat = os.stat(file)
+        digest.update(f"{file}:{stat.st_size}:{stat.st_mtime_ns};".encode())
+    return digest.hexdigest()
+
+
+def prefix_fingerprints(data, columns, rows):
+    """ Fingerprints of the first `rows` rows and of every row of `data` (one vectorized hashing pass). """
+    # Same values, same hashes : a rating column read as int or as float (missing ratings) doesn't change them
+    values = data[columns].apply(lambda column: column.astype("float64") if pd.api.types.is_numeric_dtype(column)
+                                 else column.astype(object))
+    hashes = pd.util.hash_pandas_object(values, index=False).values
+    return (hashlib.sha256(hashes[:rows].tobytes()).hexdigest(), hashlib.sha256(hashes.tobytes()).hexdigest())
+
+
+def features_path(workspace, version):
+    return os.path.join(workspace, FEATURES_DIR, f"prod_features_{version}.parquet")
+
+
+def load_state(workspace):
+    path = os.path.join(workspace, FEATURES_DIR, "state.json")
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+def save_state(workspace, state):
+    path = os.path.join(workspace, FEATURES_DIR, "state.json")
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(f"{path}.tmp", "w") as f:
+        json.dump(state, f, indent=2)
+    os.replace(f"{path}.tmp", path)
+
+
+def update_features(workspace, version, source_path, read_rows, full=False):
+    """
+    Features of every prod row of `version`, computing only those of the rows added since the last report.
+    read_rows() returns the prod data of the version, source_path is where it is read from (change detection).
+    Returns (features, new state of the version), or (None, state) if the data didn't change since the last report
+    (state is None, or the new state to save if the file was rewritten without new rows).
+    The state is never saved here (this runs in the worker processes), only by mark_reported in the parent once the
+    reports are written.
+    """
+    entry = load_state(workspace).get(version)
+    signature = source_signature(source_path)
+    path = features_path(workspace, version)
+    if not full and entry is not None and entry["signature"] == signature and os.path.exists(path):
+        return None, None
+
+    data = read_rows()
+    columns = [column for column in SOURCE_COLUMNS if column in data.columns]
+    processed = 0
+    prefix, fingerprint = prefix_fingerprints(data, columns, entry["rows"] if entry is not None else 0)
+    if not full and entry is not None and os.path.exists(path) and entry["rows"] <= len(data):
+        if entry.get("fingerprint") == prefix:
+            processed = entry["rows"]
+        else:
+            print(f"{version}: the {entry['rows']} rows already processed changed, every row is processed again")
+    if entry is not None and processed == entry["rows"] == len(data):
+        # Rewritten without new rows, only the signature changes
+        return None, {"rows": len(data), "signature": signature, "fingerprint": fingerprint}
+
+    new_rows = add_derived_features(data.iloc[processed:][columns].copy())
+    if processed:
+        # Rows written by a run that failed before its reports are computed again
+        features = pd.concat([pd.read_parquet(path).iloc[:processed], new_rows], ignore_index=True)
+    else:
+        features = new_rows.reset_index(drop=True)
+    print(f"{version}: {len(new_rows)} new rows ({processed} already processed)")
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    features.to_parquet(f"{path}.tmp", index=False)
+    os.replace(f"{path}.tmp", path)
+    return features, {"rows": len(data), "signature": signature, "fingerprint": fingerprint}
+
+
+def mark_reported(workspace, version, version_state):
+    state = load_state(workspace)
+    state[version] = version_state
+    save_state(workspace, state)
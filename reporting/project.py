@@ -8,26 +8,44 @@ from evidently.metrics import (
     ColumnDriftMetric, DatasetDriftMetric
 )
 import datetime
-
-print("Starting project.py...")  # Add this line to verify the script is running
-
-# If ref_data_report does not exist, create it by predicting the target and adding the prediction column to the dataframe
-# We need the prediction our first model makes on our reference data to compare it with the predictions made on the production data
-# (It's not always going to be perfect, even on training data)
-if os.path.exists("/data/reporting/evaluated_ref_data_sample.csv"): 
-    ref_data = pd.read_csv("/data/reporting/evaluated_ref_data_sample.csv", delimiter=';')
-else:
-    # Error, you need to generate the prediction labels, needs to be done outside of this docker container
-    raise ValueError("evaluated_ref_data_sample.csv does not exist. Please generate it by running refdata_evaluating_sampling.py")
-
-# Print column names to verify
-print("Reference data columns:", ref_data.columns)
-
-# Add target and prediction columns if they do not exist
-if 'target' not in ref_data.columns:
-    ref_data['target'] = ref_data['rating']
-if 'prediction' not in ref_data.columns:
-    ref_data['prediction'] = ref_data['rating']  # Replace with actual predictions if available
+import multiprocessing
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import columnar
+import incremental
+
+REPORT_COLUMNS = ["abstract", "rating", "version"]  # Only columns used by the reports, article texts are not read
+# Rebuild every report and every feature, instead of only the versions with new prod rows
+REPORTING_FULL = os.getenv("REPORTING_FULL", "0") == "1"
+REPORTING_WORKERS = int(os.getenv("REPORTING_WORKERS", "1"))  # Versions processed in parallel (processes)
+
+def read_ref_data(workspace):
+    """ Evaluated reference sample, from its Parquet dataset if it was converted (see columnar.py). """
+    parquet_path = columnar.dataset_path(workspace, "evaluated_ref_data_sample")
+    if os.path.exists(parquet_path):
+        return columnar.read_dataset(parquet_path, columns=REPORT_COLUMNS)
+    # Same projection as the Parquet path : the missing columns are skipped, the article texts are not read
+    return pd.read_csv(os.path.join(workspace, 'reporting/evaluated_ref_data_sample.csv'), delimiter=';',
+                       usecols=lambda column: column in REPORT_COLUMNS)
+
+def read_prod_data(workspace, version):
+    """ Production data of a version : only its partition of the Parquet dataset if there is one, the split CSV otherwise. """
+    parquet_path = columnar.dataset_path(workspace, "prod_data")
+    if os.path.exists(parquet_path):
+        return columnar.read_dataset(parquet_path, columns=REPORT_COLUMNS, versions=[version])
+    prod_data_path = os.path.join(workspace, f'reporting/split_prod_data/prod_data_{version}.csv')
+    print(f"Checking if production data exists at: {prod_data_path}")
+    if not os.path.exists(prod_data_path):
+        raise ValueError(f"Production data for version {version} not found.")
+    return pd.read_csv(prod_data_path, usecols=lambda column: column in REPORT_COLUMNS)
+
+def prod_data_source(workspace, version):
+    """ File or directory read by read_prod_data, to detect changes. """
+    parquet_path = columnar.dataset_path(workspace, "prod_data")
+    if os.path.exists(parquet_path):
+        return os.path.join(parquet_path, f"{columnar.PARTITION_COLUMN}={version}")
+    return os.path.join(workspace, f'reporting/split_prod_data/prod_data_{version}.csv')
 
 datetime_stamp = datetime.datetime.now().strftime("%Y%m%d%H%M%S")
 
@@ -40,11 +58,11 @@ def create_report(version: str, ref_data, prod_data):
     print("Reference data columns:", ref_data.columns)
     print("Production data columns:", prod_data.columns)
 
-    # Calculate derived metrics
-    ref_data['summary_length'] = ref_data['abstract'].apply(len)
-    ref_data['word_count'] = ref_data['abstract'].apply(lambda x: len(x.split()))
-    prod_data['summary_length'] = prod_data['abstract'].apply(len)
-    prod_data['word_count'] = prod_data['abstract'].apply(lambda x: len(x.split()))
+    # Calculate derived metrics (already done for the prod data of the incremental reporting)
+    if 'summary_length' not in ref_data.columns:
+        incremental.add_derived_features(ref_data)
+    if 'summary_length' not in prod_data.columns:
+        incremental.add_derived_features(prod_data)
 
     # Add target and prediction columns if they do not exist
     if 'target' not in prod_data.columns:
@@ -80,63 +98,114 @@ def create_test_suite(i: int, ref_data, prod_data):
     data_test_suite.run(reference_data=ref_data, current_data=prod_data)
     return data_test_suite
 
+# Function to generate the report and test suite of one model version
+# Returns the time spent in each step, and the incremental state to save once every version is done
+def create_version_reports(workspace: str, version: str, ref_data):
+    timings = {"version": version}
+    started = time.perf_counter()
+
+    # Create a new project name for each model version
+    project_name = f"{BASE_PROJECT_NAME}_{version}"
+
+    # Load production data for the current version
+    # Only the rows added since the last report are processed, a version without new rows is skipped
+    prod_data, version_state = incremental.update_features(
+        workspace, version, prod_data_source(workspace, version), lambda: read_prod_data(workspace, version), full=REPORTING_FULL
+    )
+    timings["load"] = time.perf_counter() - started
+    if prod_data is None:
+        print(f"No new production data for {version}, reports are up to date.")
+        timings.update(skipped=True, total=timings["load"])
+        return timings, version_state  # Saved by the parent, a rewritten file without new rows only changes its signature
+
+    # Add target and prediction columns if they do not exist
+    if 'target' not in prod_data.columns:
+        prod_data['target'] = prod_data['rating']
+    if 'prediction' not in prod_data.columns:
+        prod_data['prediction'] = prod_data['rating']  # Replace with actual predictions if available
+
+    # Print column names to verify
+    print(f"Production data columns for {version}:", prod_data.columns)
+
+    # Create and run the report
+    step = time.perf_counter()
+    report = create_report(version, ref_data, prod_data)
+
+    # Save the report
+    artifact_folder = os.path.join(workspace, "artifacts/reports")
+    os.makedirs(artifact_folder, exist_ok=True)
+    report_name = f"{project_name}_report_{datetime.datetime.now().strftime('%Y%m%d%H%M%S')}.html"
+    report_path = os.path.join(artifact_folder, report_name)
+    report.save_html(report_path)
+    timings["report"] = time.perf_counter() - step
+
+    print(f"Report for {version} saved to {report_path}")
+
+    # Create and run the test suite
+    step = time.perf_counter()
+    test_suite = create_test_suite(i=0, ref_data=ref_data, prod_data=prod_data)
+    test_suite_path = os.path.join(artifact_folder, f"{project_name}_test_suite_{datetime.datetime.now().strftime('%Y%m%d%H%M%S')}.html")
+    test_suite.save_html(test_suite_path)
+    timings["test_suite"] = time.perf_counter() - step
+
+    print(f"Test suite for {version} saved to {test_suite_path}")
+    timings.update(skipped=False, rows=len(prod_data), total=time.perf_counter() - started)
+    return timings, version_state
+
+# Reference frame of the worker processes, inherited from the parent when they are forked (not pickled nor re-read)
+SHARED_REF_DATA = None
+
+def _create_version_reports_worker(workspace: str, version: str):
+    return create_version_reports(workspace, version, SHARED_REF_DATA)
+
 # Function to create projects and generate reports for each model version
-def create_all_projects(workspace: str):
+# workers > 1 : versions are processed in parallel by a pool of processes
+def create_all_projects(workspace: str, workers: int = REPORTING_WORKERS):
+    global SHARED_REF_DATA
     # Ensure split_prod_data.py has been run to get all datasets separately for comparison
     current_versions = ["v1", "v2", "v3", "v4", "v5"]
+    started = time.perf_counter()
 
     # Load reference data
+    # We need the prediction our first model makes on our reference data to compare it with the predictions made on the production data
+    # (It's not always going to be perfect, even on training data)
     ref_data_path = os.path.join(workspace, 'reporting/evaluated_ref_data_sample.csv')
     print(f"Checking if reference data exists at: {ref_data_path}")
-    if not os.path.exists(ref_data_path):
+    if not os.path.exists(ref_data_path) and not os.path.exists(columnar.dataset_path(workspace, "evaluated_ref_data_sample")):
         raise ValueError("Evaluated reference data not found. Please generate it first using refdata_evaluating_sampling.py.")
-    ref_data = pd.read_csv(ref_data_path, delimiter=';')
+    ref_data = read_ref_data(workspace)
 
     # Add target and prediction columns if they do not exist
     if 'target' not in ref_data.columns:
         ref_data['target'] = ref_data['rating']
     if 'prediction' not in ref_data.columns:
         ref_data['prediction'] = ref_data['rating']  # Replace with actual predictions if available
-
-    for version in current_versions:
-        # Create a new project name for each model version
-        project_name = f"{BASE_PROJECT_NAME}_{version}"
-        project_description = f"{BASE_PROJECT_DESCRIPTION} - {version}"
-
-        # Load production data for the current version
-        prod_data_path = os.path.join(workspace, f'reporting/split_prod_data/prod_data_{version}.csv')
-        print(f"Checking if production data exists at: {prod_data_path}")
-        if not os.path.exists(prod_data_path):
-            raise ValueError(f"Production data for version {version} not found.")
-        prod_data = pd.read_csv(prod_data_path)
-
-        # Add target and prediction columns if they do not exist
-        if 'target' not in prod_data.columns:
-            prod_data['target'] = prod_data['rating']
-        if 'prediction' not in prod_data.columns:
-            prod_data['prediction'] = prod_data['rating']  # Replace with actual predictions if available
-
-        # Print column names to verify
-        print(f"Production data columns for {version}:", prod_data.columns)
-
-        # Create and run the report
-        report = create_report(version, ref_data, prod_data)
-
-        # Save the report
-        artifact_folder = os.path.join(workspace, "artifacts/reports")
-        os.makedirs(artifact_folder, exist_ok=True)
-        report_name = f"{project_name}_report_{datetime.datetime.now().strftime('%Y%m%d%H%M%S')}.html"
-        report_path = os.path.join(artifact_folder, report_name)
-        report.save_html(report_path)
-
-        print(f"Report for {version} saved to {report_path}")
-
-        # Create and run the test suite
-        test_suite = create_test_suite(i=0, ref_data=ref_data, prod_data=prod_data)
-        test_suite_path = os.path.join(artifact_folder, f"{project_name}_test_suite_{datetime.datetime.now().strftime('%Y%m%d%H%M%S')}.html")
-        test_suite.save_html(test_suite_path)
-
-        print(f"Test suite for {version} saved to {test_suite_path}")
-
-# Example usage
-create_all_projects("/data")
\ No newline at end of file
+    # Complete once : the reference frame is then only read by the reports of every version
+    incremental.add_derived_features(ref_data)
+
+    results = {}
+    if workers > 1:
+        SHARED_REF_DATA = ref_data
+        pool = ProcessPoolExecutor(max_workers=min(workers, len(current_versions)), mp_context=multiprocessing.get_context("fork"))
+        with pool:
+            futures = {version: pool.submit(_create_version_reports_worker, workspace, version) for version in current_versions}
+            for version, future in futures.items():
+                results[version] = future.result()
+        SHARED_REF_DATA = None
+    else:
+        for version in current_versions:
+            results[version] = create_version_reports(workspace, version, ref_data)
+
+    # The incremental state is saved by the parent only, once the versions are done
+    for version, (_, version_state) in results.items():
+        if version_state is not None:
+            incremental.mark_reported(workspace, version, version_state)
+
+    timings = pd.DataFrame([version_timings for version_timings, _ in results.values()]).set_index("version")
+    print(f"Reports generated in {time.perf_counter() - started:.1f}s with {workers} worker(s):")
+    print(timings.round(2).to_string())
+    return timings
+
+if __name__ == "__main__":
+    print("Starting project.py...")  # Add this line to verify the script is running
+    create_all_projects("/data")
@@ -2,6 +2,7 @@ import pandas as pd
 import numpy as np
 import keras
 from keras import layers, models
+import joblib
 from joblib import dump
 from sklearn.preprocessing import OneHotEncoder
 from sklearn.preprocessing import StandardScaler
@@ -10,8 +11,38 @@ import matplotlib.pyplot as plt
 from sklearn.metrics import confusion_matrix, classification_report
 import seaborn as sns
 import dill
+import math
+import copy
+import json
+import tensorflow as tf
+import pyarrow.parquet as pq
 import librosa
 import os
+import functools
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from model_artifacts import (VERSIONS_DIR, read_version_index, save_versioned_artifacts, load_current_artifacts,
+                             load_artifacts)
+
+EXTRACTOR_PATH = "../artifacts/extract_features.pkl"
+EMBEDDING_SIZE = 162
+EMOTION_MAPPING = {
+    'C': 'Colère 😡​',   
+    'T': 'Tristesse 😢​',
+    'J': 'Joie 😁​',     
+    'P': 'Peur 😨​',     
+    'D': 'Dégoût ​☹️​',   
+    'S': 'Surprise ​​😮​', 
+    'N': 'Neutre 😐​'    
+}
+
+def read_data(path):
+    """
+    Charge un CSV, ou un dataset Parquet (dossier ou fichier .parquet, voir reporting/columnar.py)
+    """
+    if os.path.isdir(path) or path.endswith(".parquet"):
+        return pd.read_parquet(path)
+    return pd.read_csv(path)
 
 def preprocess_data(df):
     """
@@ -132,55 +163,133 @@ def show_conf_matrix(y_pred, y_test, encoder):
     plt.ylabel('Actual Labels', size=14)
     plt.show()
 
-def predict_on_audio(model, encoder, scaler, audio_data, sample_rate):
+@functools.lru_cache(maxsize=None)
+def load_feature_extractor(path=EXTRACTOR_PATH):
     """
-    Prédire l'émotion sur un fichier audio
+    Charge la fonction d'extraction des features (une seule fois par processus)
     """
-    embedding_size = 162
-    emotion_mapping = {
-        'C': 'Colère 😡​',   
-        'T': 'Tristesse 😢​',
-        'J': 'Joie 😁​',     
-        'P': 'Peur 😨​',     
-        'D': 'Dégoût ​☹️​',   
-        'S': 'Surprise ​​😮​', 
-        'N': 'Neutre 😐​'    
-    }
-
-    with open("../artifacts/extract_features.pkl", "rb") as f:
+    with open(path, "rb") as f:
         extract_features_test = dill.load(f)
         extract_features_test.__globals__["np"] = np
         extract_features_test.__globals__["librosa"] = librosa
+    return extract_features_test
+
+def predict_features(model, encoder, scaler, features, batch_size=64):
+    """
+    Prédire les émotions d'une matrice de features (une ligne par audio)
+    """
+    # Scale and reshape the features for the model
+    features_scaled = scaler.transform(np.asarray(features).reshape(len(features), -1))
+    features_reshaped = features_scaled.reshape(len(features), EMBEDDING_SIZE, 1)
 
+    # Predict the class probabilities
+    pred = model.predict(features_reshaped, batch_size=batch_size, verbose=0)
+    return [EMOTION_MAPPING[label] for label in encoder.inverse_transform(pred)[:, 0]]
+
+def predict_on_audio(model, encoder, scaler, audio_data, sample_rate):
+    """
+    Prédire l'émotion sur un fichier audio
+    """
     # Extract features using the pre-loaded function
     try:
-        features = extract_features_test(audio_data, sample_rate)
+        features = load_feature_extractor()(audio_data, sample_rate)
     except Exception as e:
         return {"error": f"Failed to extract features: {str(e)}"}
 
-    # Scale and reshape the features for the model
-    features_scaled = scaler.transform(features.reshape(1, -1))
-    features_reshaped = features_scaled.reshape(1, embedding_size, 1)
-
     # Predict the class probabilities
     try:
-        pred = model.predict(features_reshaped)
-        predicted_class_label = encoder.inverse_transform(pred)[0][0]
-        print
-        predicted_emotion = emotion_mapping[predicted_class_label]
+        predicted_emotion = predict_features(model, encoder, scaler, [features])[0]
     except Exception as e:
         return {"error": f"Prediction failed: {str(e)}"}
 
     # Return the predicted label
     return {"prediction": predicted_emotion}
 
-def train_save_model(ref_path, output_model_path, verbose=2, prod_path=None, always_save_model=True, current_acc=None):
+def _init_extraction_worker(extractor_path):
+    load_feature_extractor(extractor_path)
+
+def _extract_in_worker(extractor_path, audio):
+    """
+    Extraction des features d'un audio (audio_data, sample_rate) dans un processus du pool, l'erreur est renvoyée
+    """
+    audio_data, sample_rate = audio
+    try:
+        return load_feature_extractor(extractor_path)(audio_data, sample_rate), None
+    except Exception as e:
+        return None, f"Failed to extract features: {str(e)}"
+
+class InferenceSession:
     """
-    Entrainer un cnn sur les données du csv et sauvegarder le model, encoder, scaler
+    Extracteur de features, modèle, encoder et scaler chargés une seule fois et gardés en mémoire.
+    predict_many répartit l'extraction des features sur un pool de processus (workers > 0), puis prédit en un seul batch.
+
+    session = InferenceSession("../artifacts", workers=4)
+    session.predict_many([(audio_data, sample_rate), ...])
     """
-    data = pd.read_csv(ref_path)
+
+    def __init__(self, artifacts_dir="../artifacts", workers=0, batch_size=64):
+        self.extractor_path = os.path.join(artifacts_dir, "extract_features.pkl")
+        self.extractor = load_feature_extractor(self.extractor_path)
+        artifacts = load_artifacts(artifacts_dir)
+        if artifacts is None:
+            raise FileNotFoundError(f"No model in {artifacts_dir}")
+        self.model, self.encoder, self.scaler, self.version = artifacts
+        self.workers = workers
+        self.batch_size = batch_size
+        self._pool = None
+
+    @property
+    def pool(self):
+        # Processus lancés avec spawn : TensorFlow n'est pas fork-safe une fois initialisé
+        if self._pool is None and self.workers > 0:
+            self._pool = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context("spawn"),
+                                             initializer=_init_extraction_worker, initargs=(self.extractor_path,))
+        return self._pool
+
+    def predict(self, audio_data, sample_rate):
+        return predict_on_audio(self.model, self.encoder, self.scaler, audio_data, sample_rate)
+
+    def predict_many(self, audio_list):
+        """
+        Prédire l'émotion d'une liste de (audio_data, sample_rate), un résultat par audio dans le même ordre
+        """
+        if self.pool is not None:
+            extracted = list(self.pool.map(functools.partial(_extract_in_worker, self.extractor_path), audio_list,
+                                           chunksize=max(1, len(audio_list) // (4 * self.workers))))
+        else:
+            extracted = [_extract_in_worker(self.extractor_path, audio) for audio in audio_list]
+
+        results = [{"error": error} if error is not None else None for _, error in extracted]
+        valid = [i for i, (features, _) in enumerate(extracted) if features is not None]
+        if valid:
+            try:
+                emotions = predict_features(self.model, self.encoder, self.scaler,
+                                            [extracted[i][0] for i in valid], batch_size=self.batch_size)
+                for i, emotion in zip(valid, emotions):
+                    results[i] = {"prediction": emotion}
+            except Exception as e:
+                for i in valid:
+                    results[i] = {"error": f"Prediction failed: {str(e)}"}
+        return results
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None
+
+def train_save_model(ref_path, output_model_path, verbose=2, prod_path=None, always_save_model=True, current_acc=None,
+                     streaming=False, **streaming_kwargs):
+    """
+    Entrainer un cnn sur les données du csv et sauvegarder le model, encoder, scaler dans une nouvelle version
+    (save_versioned_artifacts). Elle devient la version courante si always_save_model ou si l'accuracy dépasse current_acc.
+    streaming=True : voir train_save_model_streaming (mémoire indépendante de la taille des données)
+    """
+    if streaming:
+        return train_save_model_streaming(ref_path, output_model_path, verbose=verbose, prod_path=prod_path,
+                                          always_save_model=always_save_model, current_acc=current_acc, **streaming_kwargs)
+    data = read_data(ref_path)
     if prod_path != None:
-        data2 = pd.read_csv(prod_path)
+        data2 = read_data(prod_path)
         data2 = data2.drop(columns=['prediction'])
         data = pd.concat([data, data2], ignore_index=True)
     X, Y, encoder, scaler = preprocess_data(data)
@@ -217,29 +326,148 @@ def train_save_model(ref_path, output_model_path, verbose=2, prod_path=None, alw
 
     new_accuracy = history.history['accuracy'][-1]
 
-    #on sauv l'encoder
-    dump(encoder, f'{output_model_path}/encoder.pkl')
-    #on sauv le scaler
-    dump(scaler, f'{output_model_path}/scaler.pkl')
-    #on sauv le modèle et la dernière accuracy si elle est supérieure à celle actuelle
-    model_data = {
-        'model': model_full,
-        'last_accuracy': new_accuracy
-    }
-    if always_save_model or (current_acc <= new_accuracy or current_acc == None):
-        print("Dump Model...")
-        dump(model_data, f'{output_model_path}/model.pkl')
+    #on sauv le modèle, l'encoder et le scaler, la version devient courante si l'accuracy est supérieure à celle actuelle
+    save_model_version(output_model_path, model_full, encoder, scaler, new_accuracy, always_save_model, current_acc)
 
     return model_full, history
 
-def save_feedback(audio_data, sample_rate, target, prediction, output_path):
-    with open("../artifacts/extract_features.pkl", "rb") as f:
-        extract_features_test = dill.load(f)
-        extract_features_test.__globals__["np"] = np
-        extract_features_test.__globals__["librosa"] = librosa
-        
+def iter_data_chunks(paths, chunk_rows=10000):
+    """
+    Lit les données (CSV ou Parquet) par morceaux de chunk_rows lignes et renvoie (X, y) pour chacun.
+    La colonne 'prediction' des données de prod est ignorée.
+    """
+    for path in paths:
+        if os.path.isdir(path) or path.endswith(".parquet"):
+            files = sorted(os.path.join(root, name) for root, _, names in os.walk(path) for name in names
+                           if name.endswith(".parquet")) if os.path.isdir(path) else [path]
+            chunks = (batch.to_pandas() for file in files for batch in pq.ParquetFile(file).iter_batches(chunk_rows))
+        else:
+            chunks = pd.read_csv(path, chunksize=chunk_rows)
+        for chunk in chunks:
+            y = chunk['target'].values
+            X = chunk.drop(columns=[c for c in ('target', 'prediction', 'version') if c in chunk.columns]).values
+            yield X.astype(np.float32), y
+
+def fit_streaming_preprocessors(paths, chunk_rows=10000, encoder=None, scaler=None):
+    """
+    Ajuste le scaler morceau par morceau (partial_fit) et collecte les labels en une passe sur les données.
+    encoder : encoder existant (reprise d'un modèle), ses classes doivent couvrir les labels des données.
+    scaler : scaler existant (reprise d'un modèle), mis à jour avec les lignes qu'il n'a pas encore vues. Les données
+    étant ajoutées à la fin, ce sont celles après ses n_samples_seen_ premières lignes. Il n'est pas modifié (copie).
+    Renvoie encoder, scaler, nombre de lignes
+    """
+    seen = 0
+    if scaler is None:
+        scaler = StandardScaler()
+    else:
+        scaler = copy.deepcopy(scaler)
+        seen = int(np.max(scaler.n_samples_seen_))
+    labels = set()
+    rows = 0
+    for X, y in iter_data_chunks(paths, chunk_rows):
+        skip = min(len(y), max(0, seen - rows))
+        if skip < len(y):
+            scaler.partial_fit(X[skip:])
+        labels.update(y)
+        rows += len(y)
+    if rows == 0:
+        raise ValueError("No training data.")
+
+    if encoder is None:
+        encoder = OneHotEncoder(categories=[sorted(labels)])
+        encoder.fit(np.array(sorted(labels)).reshape(-1, 1))
+    elif not labels <= set(encoder.categories_[0]):
+        raise ValueError(f"Labels unknown to the previous encoder: {sorted(labels - set(encoder.categories_[0]))}")
+    return encoder, scaler, rows
+
+def make_streaming_dataset(paths, encoder, scaler, chunk_rows=10000, batch_size=64, seed=None):
+    """
+    tf.data.Dataset des données normalisées et encodées, lues du disque à chaque epoch (un morceau en mémoire à la fois).
+    Les lignes sont mélangées à l'intérieur de chaque morceau.
+    """
+    rng = np.random.default_rng(seed)
+    n_classes = len(encoder.categories_[0])
+
+    def generator():
+        for X, y in iter_data_chunks(paths, chunk_rows):
+            order = rng.permutation(len(y))
+            X = scaler.transform(X[order]).astype(np.float32)
+            Y = encoder.transform(y[order].reshape(-1, 1)).toarray().astype(np.float32)
+            for start in range(0, len(y), batch_size):
+                yield np.expand_dims(X[start:start + batch_size], axis=2), Y[start:start + batch_size]
+
+    return tf.data.Dataset.from_generator(generator, output_signature=(
+        tf.TensorSpec(shape=(None, EMBEDDING_SIZE, 1), dtype=tf.float32),
+        tf.TensorSpec(shape=(None, n_classes), dtype=tf.float32),
+    )).prefetch(tf.data.AUTOTUNE)
+
+def fit_streaming_model(paths, model=None, encoder=None, scaler=None, verbose=2, epochs=None, batch_size=64,
+                        chunk_rows=10000):
+    """
+    Entrainer le cnn en lisant les données par morceaux, sans les charger entièrement en mémoire.
+    Le scaler est ajusté par partial_fit, puis le modèle est entrainé sur un tf.data.Dataset relu du disque à chaque epoch.
+    model, encoder, scaler : modèle, encoder et scaler à reprendre (warm start, 5 epochs par défaut au lieu de 50 à
+    partir de zéro). Le scaler n'est mis à jour qu'avec les nouvelles lignes, les entrées du modèle gardent la même échelle.
+    Renvoie model, encoder, scaler, history
+    """
+    warm_start = model is not None
+    encoder, scaler, rows = fit_streaming_preprocessors(paths, chunk_rows, encoder=encoder if warm_start else None,
+                                                        scaler=scaler if warm_start else None)
+    if warm_start:
+        model.compile(optimizer='adam', loss='categorical_crossentropy', metrics=['accuracy'])
+    else:
+        model = define_model(EMBEDDING_SIZE)
+    if epochs is None:
+        epochs = 5 if warm_start else 50
+
+    rlrp = keras.callbacks.ReduceLROnPlateau(monitor='loss', factor=0.4, verbose=0, patience=2, min_lr=0.0000001)
+    history = model.fit(
+        make_streaming_dataset(paths, encoder, scaler, chunk_rows, batch_size),
+        epochs=epochs,
+        callbacks=[rlrp],
+        verbose=verbose
+    )
+    print(f"{rows} rows, {math.ceil(rows / batch_size)} batches per epoch, warm start: {warm_start}")
+    return model, encoder, scaler, history
+
+def train_save_model_streaming(ref_path, output_model_path, verbose=2, prod_path=None, always_save_model=True,
+                               current_acc=None, warm_start=True, epochs=None, batch_size=64, chunk_rows=10000):
+    """
+    Version de train_save_model en streaming (voir fit_streaming_model).
+    warm_start : reprend le modèle, l'encoder et le scaler de la version courante de output_model_path s'il y en a une
+    """
+    paths = [ref_path] + ([prod_path] if prod_path is not None else [])
+    artifacts = load_artifacts(output_model_path) if warm_start else None
+
+    model_full, encoder, scaler, history = fit_streaming_model(
+        paths,
+        model=artifacts[0] if artifacts is not None else None,
+        encoder=artifacts[1] if artifacts is not None else None,
+        scaler=artifacts[2] if artifacts is not None else None,
+        verbose=verbose, epochs=epochs, batch_size=batch_size, chunk_rows=chunk_rows)
+
+    new_accuracy = history.history['accuracy'][-1]
+    save_model_version(output_model_path, model_full, encoder, scaler, new_accuracy, always_save_model, current_acc)
+
+    return model_full, history
+
+def save_model_version(output_model_path, model, encoder, scaler, accuracy, always_save_model=True, current_acc=None):
+    """
+    Sauvegarde une nouvelle version (save_versioned_artifacts), courante si always_save_model ou si accuracy >= current_acc
+    """
+    make_current = always_save_model or current_acc is None or current_acc <= accuracy
+    version = save_versioned_artifacts(output_model_path, model, encoder, scaler,
+                                       metadata={"accuracy": accuracy}, make_current=make_current)
+    print(f"Version {version} saved{' (current)' if make_current else ''}")
+    return version
+
+def save_feedback(audio_data, sample_rate, target, prediction, output_path, controller=None):
+    """
+    Ajoute les features de l'audio, le label et la prédiction au csv de prod.
+    controller : RetrainController (retrain_controller.py) tenu à jour à chaque ligne ajoutée
+    """
     try:
-        features = extract_features_test(audio_data, sample_rate)
+        features = load_feature_extractor()(audio_data, sample_rate)
     except Exception as e:
         return {"error": f"Failed to extract features: {str(e)}"}
 
@@ -252,6 +480,14 @@ def save_feedback(audio_data, sample_rate, target, prediction, output_path):
     Features.to_csv(output_path, mode='a',
                     header=not file_exists_and_non_empty,
                     index=False)
+    if controller is not None:
+        controller.record(features, target, prediction)
 
-def should_retrain_model(k, prod_path):
+def should_retrain_model(k, prod_path, manifest_path=None):
+    """
+    Réentrainement toutes les k lignes de prod. Avec le manifest du RetrainController, le csv n'est pas relu.
+    """
+    if manifest_path is not None and os.path.exists(manifest_path):
+        with open(manifest_path) as f:
+            return json.load(f)["prod_rows"] % k == 0
     return len(pd.read_csv(prod_path)) % k == 0
\ No newline at end of file
@@ -0,0 +1,78 @@
+# Versioned artifacts of the emotion model : <artifacts>/versions/vN/{model.keras, encoder.pkl, scaler.pkl} and
+# <artifacts>/versions/index.json (versions and current version).
+# Only needs keras and joblib : scripts that load the model (reporting/gen_ref_prediction.py) import this module
+# instead of fct_model (librosa, tensorflow, plotting...). fct_model re-exports these functions.
+
+import json
+import os
+import shutil
+import time
+
+import joblib
+import keras
+from joblib import dump
+
+VERSIONS_DIR = "versions"  # <artifacts>/versions/v1/{model.keras, encoder.pkl, scaler.pkl}, index.json -> version courante
+
+def read_version_index(artifacts_dir):
+    path = os.path.join(artifacts_dir, VERSIONS_DIR, "index.json")
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+def save_versioned_artifacts(artifacts_dir, model, encoder, scaler, metadata=None, make_current=True):
+    """
+    Sauvegarde le modèle (format natif Keras), l'encoder et le scaler dans une nouvelle version <artifacts>/versions/vN.
+    Les fichiers sont écrits dans un dossier temporaire renommé une fois complet, puis index.json est remplacé
+    atomiquement : un lecteur ne voit jamais une version à moitié écrite.
+    Renvoie le nom de la version
+    """
+    versions_dir = os.path.join(artifacts_dir, VERSIONS_DIR)
+    os.makedirs(versions_dir, exist_ok=True)
+    index = read_version_index(artifacts_dir) or {"current": None, "versions": []}
+    version = f"v{max([int(v['version'][1:]) for v in index['versions']], default=0) + 1}"
+
+    tmp_dir = os.path.join(versions_dir, f".{version}.tmp")
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+    model.save(os.path.join(tmp_dir, "model.keras"))
+    dump(encoder, os.path.join(tmp_dir, "encoder.pkl"))
+    dump(scaler, os.path.join(tmp_dir, "scaler.pkl"))
+    os.rename(tmp_dir, os.path.join(versions_dir, version))
+
+    index["versions"].append({"version": version, "created": time.time(), **(metadata or {})})
+    if make_current:
+        index["current"] = version
+    with open(os.path.join(versions_dir, "index.json.tmp"), "w") as f:
+        json.dump(index, f, indent=2)
+    os.replace(os.path.join(versions_dir, "index.json.tmp"), os.path.join(versions_dir, "index.json"))
+    return version
+
+def load_current_artifacts(artifacts_dir):
+    """
+    Charge la version courante de l'index (model, encoder, scaler, version), None s'il n'y a pas de version
+    """
+    index = read_version_index(artifacts_dir)
+    if index is None or index["current"] is None:
+        return None
+    version_dir = os.path.join(artifacts_dir, VERSIONS_DIR, index["current"])
+    model = keras.models.load_model(os.path.join(version_dir, "model.keras"))
+    encoder = joblib.load(os.path.join(version_dir, "encoder.pkl"))
+    scaler = joblib.load(os.path.join(version_dir, "scaler.pkl"))
+    return model, encoder, scaler, index["current"]
+
+def load_artifacts(artifacts_dir):
+    """
+    Version courante (load_current_artifacts), ou les artefacts d'avant les versions (model.pkl, encoder.pkl,
+    scaler.pkl, version None) s'il n'y a pas de version courante. None s'il n'y a aucun modèle
+    """
+    current = load_current_artifacts(artifacts_dir)
+    if current is not None:
+        return current
+    if not os.path.exists(os.path.join(artifacts_dir, "model.pkl")):
+        return None
+    model = joblib.load(os.path.join(artifacts_dir, "model.pkl"))["model"]
+    encoder = joblib.load(os.path.join(artifacts_dir, "encoder.pkl"))
+    scaler = joblib.load(os.path.join(artifacts_dir, "scaler.pkl"))
+    return model, encoder, scaler, None
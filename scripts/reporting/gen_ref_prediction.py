@@ -1,39 +1,80 @@
-import pandas as pd
-import joblib
-import fct_model
+# Adds the prediction of the current model to the reference data (ref_data.csv -> ref_data_report.csv).
+# The model is the current version of <artifacts>/versions (see scripts/model_artifacts.py), or the legacy model.pkl.
+# The whole feature matrix is scaled at once, predicted by batches and the labels decoded in one call.
+# With --chunk-rows, the reference data is read and written by chunks, for files that don't fit in memory.
+#
+# python gen_ref_prediction.py --batch-size 512
+# python gen_ref_prediction.py --chunk-rows 100000
+
+import argparse
+import os
+import sys
 
-ref_data = pd.read_csv("../data/ref_data.csv")
-ref_data_report = ref_data.copy()
-ref_data_report["prediction"] = None
+import pandas as pd
 
-encoder = joblib.load("../artifacts/encoder.pkl")
-model_data = joblib.load("../artifacts/model.pkl")
-model = model_data["model"]
-scaler = joblib.load("../artifacts/scaler.pkl")
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))  # scripts/model_artifacts.py
+import model_artifacts
 
 embedding_size = 162
 emotion_mapping = {
-    'C': 'Colère 😡​',   
+    'C': 'Colère 😡​',
     'T': 'Tristesse 😢​',
-    'J': 'Joie 😁​',     
-    'P': 'Peur 😨​',     
-    'D': 'Dégoût ​☹️​',   
-    'S': 'Surprise ​​😮​', 
-    'N': 'Neutre 😐​'    
+    'J': 'Joie 😁​',
+    'P': 'Peur 😨​',
+    'D': 'Dégoût ​☹️​',
+    'S': 'Surprise ​​😮​',
+    'N': 'Neutre 😐​'
 }
 
-features_table_ref = ref_data.drop(columns=["target"])
-for i in range(len(ref_data)):
-    features = features_table_ref.iloc[i]
+
+def load_artifacts(artifacts_dir):
+    """ Current model version (scripts/model_artifacts.py, shared with fct_model), or the legacy model.pkl. """
+    artifacts = model_artifacts.load_artifacts(artifacts_dir)
+    if artifacts is None:
+        raise FileNotFoundError(f"No model in {artifacts_dir}")
+    model, encoder, scaler, _ = artifacts
+    return model, encoder, scaler
+
+
+def predict_labels(features, model, encoder, scaler, batch_size=256):
+    """ Predicted class label of every row of `features` (DataFrame of the embedding_size features). """
     # Scale and reshape the features for the model
-    features_scaled = scaler.transform(features.values.reshape(1, -1))
-    features_reshaped = features_scaled.reshape(1, embedding_size, 1)
+    features_scaled = scaler.transform(features.values)
+    features_reshaped = features_scaled.reshape(len(features), embedding_size, 1)
 
     # Predict the class probabilities
-    pred = model.predict(features_reshaped)
-    predicted_class_label = encoder.inverse_transform(pred)[0][0]
+    pred = model.predict(features_reshaped, batch_size=batch_size, verbose=0)
+    return encoder.inverse_transform(pred)[:, 0]
+
+
+def add_predictions(ref_data, model, encoder, scaler, batch_size=256):
+    ref_data_report = ref_data.copy()
+    ref_data_report["prediction"] = predict_labels(ref_data.drop(columns=["target"]), model, encoder, scaler, batch_size)
+    return ref_data_report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Predict the labels of the reference data with the current model.")
+    parser.add_argument("--input", default="../data/ref_data.csv")
+    parser.add_argument("--output", default="../data/ref_data_report.csv")
+    parser.add_argument("--artifacts", default="../artifacts")
+    parser.add_argument("--batch-size", type=int, default=256, help="Rows per model.predict batch")
+    parser.add_argument("--chunk-rows", type=int, default=0, help="Rows read at once (0 = whole file)")
+    args = parser.parse_args()
+
+    model, encoder, scaler = load_artifacts(args.artifacts)
+    if not args.chunk_rows:
+        ref_data = pd.read_csv(args.input)
+        add_predictions(ref_data, model, encoder, scaler, args.batch_size).to_csv(args.output, index=False)
+        return
+
+    rows = 0
+    with open(args.output, "w", newline="") as f:
+        for chunk in pd.read_csv(args.input, chunksize=args.chunk_rows):
+            add_predictions(chunk, model, encoder, scaler, args.batch_size).to_csv(f, index=False, header=rows == 0)
+            rows += len(chunk)
+            print(f"{rows} rows predicted")
 
-    #ref_data_report["prediction"].iloc[i] = predicted_class_label
-    ref_data_report.at[i, "prediction"] = predicted_class_label
 
-ref_data_report.to_csv("../data/ref_data_report.csv", index=False)
\ No newline at end of file
+if __name__ == "__main__":
+    main()
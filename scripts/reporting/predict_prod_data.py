@@ -1,27 +1,135 @@
 # Splits the prod_data.csv into sub csvs, based on the model attribute.
+# prod_data.csv is only appended to : the splitter remembers the byte offset it stopped at, and each run reads
+# the new rows only, by chunks, and appends every row to the file of its version in a single pass.
+# The whole split is rebuilt if prod_data.csv was rewritten (smaller, or different bytes before the offset).
+#
+# python predict_prod_data.py                    -> data/reporting/split_prod_data/prod_data_{v}.csv
+# python predict_prod_data.py --format parquet   -> data/parquet/prod_data/version={v}/ (read by reporting/columnar.py)
+# python predict_prod_data.py --rebuild
 
-# load the csv prod_data.csv
-import pandas as pd
+import argparse
+import csv
+import fcntl
+import glob
+import json
 import os
+import shutil
+
+import pandas as pd
 
 # Construct the absolute path to the CSV file
 base_dir = os.path.dirname(os.path.abspath(__file__))
 csv_path = os.path.join(base_dir, '../../data/prod_data.csv')
+output_dir = os.path.join(base_dir, '../../data/reporting/split_prod_data')
+parquet_dir = os.path.join(base_dir, '../../data/parquet/prod_data')
 
-# Load the CSV file
-df = pd.read_csv(csv_path)
+CHUNK_ROWS = 10000
+CHECK_BYTES = 256  # Bytes before the offset compared between runs, to detect a rewritten file
 
-# Split the data into sub dataframes based on the model attribute
-sub_dfs = {}
-for v in df['version'].unique():
-    sub_dfs[v] = df[df['version'] == v]
 
+def state_path(output):
+    return os.path.join(output, ".split_state.json")
 
-# Save the sub dataframes to new CSV files
 
-output_dir = os.path.join(base_dir, '../../data/reporting/split_prod_data')
-os.makedirs(output_dir, exist_ok=True)
+def load_state(output):
+    if not os.path.exists(state_path(output)):
+        return None
+    with open(state_path(output)) as f:
+        return json.load(f)
+
+
+def save_state(output, state):
+    with open(f"{state_path(output)}.tmp", "w") as f:
+        json.dump(state, f, indent=2)
+    os.replace(f"{state_path(output)}.tmp", state_path(output))
+
+
+def read_check_bytes(f, offset):
+    f.seek(max(0, offset - CHECK_BYTES))
+    return f.read(min(offset, CHECK_BYTES)).hex()
+
+
+def output_files(output, file_format):
+    if file_format == "parquet":
+        return glob.glob(os.path.join(output, "version=*"))
+    return glob.glob(os.path.join(output, "prod_data_*.csv"))
+
+
+def can_resume(state, f, size, output, file_format):
+    """ The previous split is still valid : same format, prod_data.csv only grew, split files still there. """
+    if state is None or state["format"] != file_format or state["offset"] > size:
+        return False
+    if read_check_bytes(f, state["offset"]) != state["check"]:
+        return False
+    return all(os.path.exists(path) for path in state["outputs"])
+
+
+def write_rows(version, rows, output, file_format, part):
+    """ Append the rows of one version, returns the file written. """
+    if file_format == "parquet":
+        partition = os.path.join(output, f"version={version}")
+        os.makedirs(partition, exist_ok=True)
+        rows = rows.drop(columns=["version"])
+        if "rating" in rows.columns:
+            rows["rating"] = rows["rating"].astype("float64")  # Same type as columnar.convert_csv
+        rows.to_parquet(os.path.join(partition, f"part-{part}.parquet"), index=False)
+        return partition
+    path = os.path.join(output, f'prod_data_{version}.csv')
+    write_header = not os.path.exists(path) or os.path.getsize(path) == 0
+    rows.to_csv(path, mode="a", header=write_header, index=False)
+    return path
+
+
+def split(source, output, file_format="csv", rebuild=False, chunk_rows=CHUNK_ROWS):
+    """ Route the rows added to `source` since the last run to their version. Returns the number of new rows. """
+    os.makedirs(output, exist_ok=True)
+    with open(source, "rb") as f:
+        # Shared lock : the feedback store appends rows under an exclusive lock, no half-written row is read
+        fcntl.flock(f, fcntl.LOCK_SH)
+        size = os.fstat(f.fileno()).st_size
+        state = load_state(output)
+        if rebuild or not can_resume(state, f, size, output, file_format):
+            for path in output_files(output, file_format):
+                shutil.rmtree(path) if os.path.isdir(path) else os.remove(path)
+            state = None
+
+        f.seek(0)
+        header = f.readline()
+        columns = next(csv.reader([header.decode("utf-8-sig")]))
+        offset = state["offset"] if state is not None else f.tell()
+        outputs = set(state["outputs"]) if state is not None else set()
+        new_rows = 0
+
+        f.seek(offset)
+        if offset < size:
+            for i, chunk in enumerate(pd.read_csv(f, names=columns, header=None, chunksize=chunk_rows)):
+                for version, rows in chunk.groupby("version", sort=False):
+                    outputs.add(write_rows(version, rows, output, file_format, part=f"{offset}-{i}"))
+                new_rows += len(chunk)
+
+        save_state(output, {
+            "format": file_format,
+            "offset": size,
+            "check": read_check_bytes(f, size),
+            "rows": (state["rows"] if state is not None else 0) + new_rows,
+            "outputs": sorted(outputs),
+        })
+    return new_rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Split prod_data.csv by version, appending only the new rows.")
+    parser.add_argument("--input", default=csv_path)
+    parser.add_argument("--format", default="csv", choices=["csv", "parquet"])
+    parser.add_argument("--output", default=None, help="Split directory (default: split_prod_data, or parquet/prod_data)")
+    parser.add_argument("--rebuild", action="store_true", help="Split the whole file again")
+    parser.add_argument("--chunk-rows", type=int, default=CHUNK_ROWS)
+    args = parser.parse_args()
+
+    output = args.output or (parquet_dir if args.format == "parquet" else output_dir)
+    new_rows = split(args.input, output, args.format, args.rebuild, args.chunk_rows)
+    print(f"{new_rows} new rows split into {output}")
+
 
-for k, v in sub_dfs.items():
-    output_path = os.path.join(output_dir, f'prod_data_{k}.csv')
-    v.to_csv(output_path, index=False)
+if __name__ == "__main__":
+    main()
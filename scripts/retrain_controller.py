@@ -0,0 +1,226 @@
+# Retraining controller of the emotion model.
+# The feedback writer (fct_model.save_feedback) records every new prod row in a small JSON manifest
+# (<artifacts>/retrain_manifest.json) : row counter, accuracy and feature sums since the last training.
+# should_retrain() only reads the manifest, it never reads the prod data. When a threshold is crossed
+# (new rows, feature drift, or accuracy), maybe_retrain() trains in a background process, warm started from the
+# current version, and saves the artifacts as a new version (fct_model.save_versioned_artifacts).
+#
+# python retrain_controller.py status
+# python retrain_controller.py retrain --force
+
+import argparse
+import fcntl
+import json
+import multiprocessing
+import os
+import time
+from contextlib import contextmanager
+
+import numpy as np
+
+import fct_model
+
+ARTIFACTS_DIR = os.getenv("ARTIFACTS_DIR", "../artifacts")
+REF_PATH = os.getenv("REF_PATH", "../data/ref_data.csv")
+PROD_PATH = os.getenv("PROD_PATH", "../data/prod_data.csv")
+RETRAIN_EVERY_ROWS = int(os.getenv("RETRAIN_EVERY_ROWS", 500))  # New prod rows since the last training
+RETRAIN_MIN_ROWS = int(os.getenv("RETRAIN_MIN_ROWS", 50))  # Rows needed before drift/accuracy are trusted
+RETRAIN_DRIFT = float(os.getenv("RETRAIN_DRIFT", 0.5))  # Mean shift of the features, in reference standard deviations
+RETRAIN_MIN_ACCURACY = float(os.getenv("RETRAIN_MIN_ACCURACY", 0.6))  # Accuracy of the prod predictions
+
+
+class RetrainController:
+    """
+    Compteur de lignes et statistiques de prod persistés dans un manifest, et déclenchement du réentrainement.
+
+    controller = RetrainController()
+    fct_model.save_feedback(audio_data, sample_rate, target, prediction, PROD_PATH, controller=controller)
+    controller.maybe_retrain()
+    """
+
+    def __init__(self, artifacts_dir=ARTIFACTS_DIR, ref_path=REF_PATH, prod_path=PROD_PATH,
+                 every_rows=RETRAIN_EVERY_ROWS, min_rows=RETRAIN_MIN_ROWS, drift=RETRAIN_DRIFT,
+                 min_accuracy=RETRAIN_MIN_ACCURACY):
+        self.artifacts_dir = artifacts_dir
+        self.ref_path = ref_path
+        self.prod_path = prod_path
+        self.every_rows = every_rows
+        self.min_rows = min_rows
+        self.drift_threshold = drift
+        self.min_accuracy = min_accuracy
+        self.manifest_path = os.path.join(artifacts_dir, "retrain_manifest.json")
+        self.lock_path = os.path.join(artifacts_dir, "retrain_manifest.lock")
+        self._process = None
+        if not os.path.exists(self.manifest_path):
+            self.update(lambda manifest: None)  # Counts the existing prod rows once, before new ones are recorded
+
+    @contextmanager
+    def _locked(self):
+        # Several serving processes record rows : read-modify-write of the manifest under an exclusive lock
+        with open(self.lock_path, "a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def _new_manifest(self):
+        """ First manifest : the existing prod rows are counted once (lines of the csv, without reading it in pandas). """
+        prod_rows = 0
+        if os.path.exists(self.prod_path):
+            with open(self.prod_path, "rb") as f:
+                prod_rows = max(0, sum(block.count(b"\n") for block in iter(lambda: f.read(1 << 20), b"")) - 1)
+        manifest = {"prod_rows": prod_rows, "rows_at_last_train": prod_rows, "new_rows": 0, "correct": 0,
+                    "feature_sum": None, "reference_mean": None, "reference_scale": None, "last_train": None}
+        scaler_path = os.path.join(self.artifacts_dir, "scaler.pkl")
+        current = fct_model.read_version_index(self.artifacts_dir)
+        if current is not None and current["current"] is not None:
+            scaler_path = os.path.join(self.artifacts_dir, fct_model.VERSIONS_DIR, current["current"], "scaler.pkl")
+        if os.path.exists(scaler_path):
+            set_reference(manifest, fct_model.joblib.load(scaler_path))
+        return manifest
+
+    def read_manifest(self):
+        if not os.path.exists(self.manifest_path):
+            return self._new_manifest()
+        with open(self.manifest_path) as f:
+            return json.load(f)
+
+    def _write_manifest(self, manifest):
+        with open(f"{self.manifest_path}.tmp", "w") as f:
+            json.dump(manifest, f)
+        os.replace(f"{self.manifest_path}.tmp", self.manifest_path)
+
+    def update(self, fn):
+        """ Apply fn(manifest) under the lock and save the manifest. """
+        with self._locked():
+            manifest = self.read_manifest()
+            fn(manifest)
+            self._write_manifest(manifest)
+            return manifest
+
+    def record(self, features, target, prediction):
+        """ Called by the feedback writer for each row appended to the prod data. """
+        def add_row(manifest):
+            manifest["prod_rows"] += 1
+            manifest["new_rows"] += 1
+            manifest["correct"] += int(fct_model.EMOTION_MAPPING.get(target, target) == prediction or target == prediction)
+            feature_sum = np.asarray(features, dtype=np.float64).ravel()
+            if manifest["feature_sum"] is not None:
+                feature_sum = feature_sum + np.asarray(manifest["feature_sum"])
+            manifest["feature_sum"] = feature_sum.tolist()
+        return self.update(add_row)
+
+    def check(self, manifest=None):
+        """ Thresholds crossed since the last training (empty list : no retraining needed). """
+        manifest = manifest or self.read_manifest()
+        reasons = []
+        new_rows = manifest["new_rows"]
+        if new_rows >= self.every_rows:
+            reasons.append(f"{new_rows} new rows")
+        if new_rows >= self.min_rows:
+            accuracy = manifest["correct"] / new_rows
+            if accuracy < self.min_accuracy:
+                reasons.append(f"accuracy {accuracy:.2f}")
+            drift = feature_drift(manifest)
+            if drift is not None and drift > self.drift_threshold:
+                reasons.append(f"drift {drift:.2f}")
+        return reasons
+
+    def should_retrain(self):
+        return bool(self.check())
+
+    def running(self):
+        return self._process is not None and self._process.is_alive()
+
+    def maybe_retrain(self, force=False):
+        """ Start a background retraining if a threshold is crossed. Returns the reasons, or [] if nothing started. """
+        reasons = ["forced"] if force else self.check()
+        if not reasons or self.running():
+            return []
+        # spawn : TensorFlow is not fork safe once initialized in the serving process
+        self._process = multiprocessing.get_context("spawn").Process(
+            target=run_retraining, args=(self.__dict__ | {"_process": None}, reasons), daemon=True)
+        self._process.start()
+        return reasons
+
+    def wait(self, timeout=None):
+        if self._process is not None:
+            self._process.join(timeout)
+        return not self.running()
+
+
+def set_reference(manifest, scaler):
+    manifest["reference_mean"] = scaler.mean_.tolist()
+    manifest["reference_scale"] = scaler.scale_.tolist()
+
+
+def feature_drift(manifest):
+    """ Largest shift of the mean of a feature since the last training, in reference standard deviations. """
+    if not manifest["new_rows"] or manifest["feature_sum"] is None or manifest["reference_mean"] is None:
+        return None
+    mean = np.asarray(manifest["feature_sum"]) / manifest["new_rows"]
+    return float(np.max(np.abs(mean - np.asarray(manifest["reference_mean"])) / np.asarray(manifest["reference_scale"])))
+
+
+def run_retraining(settings, reasons):
+    """ Background process : warm started training on the ref and prod data, saved as a new version. """
+    controller = RetrainController.__new__(RetrainController)
+    controller.__dict__.update(settings)
+    with open(os.path.join(controller.artifacts_dir, "retrain.lock"), "a") as lock:
+        try:
+            fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            print("Retraining already running")
+            return
+
+        # Counters at the start, the rows recorded during the training count for the next one
+        start = controller.read_manifest()
+        current = fct_model.load_artifacts(controller.artifacts_dir)
+        model, encoder, scaler = current[:3] if current is not None else (None, None, None)
+
+        started = time.time()
+        paths = [controller.ref_path] + ([controller.prod_path] if os.path.exists(controller.prod_path) else [])
+        model, encoder, scaler, history = fct_model.fit_streaming_model(paths, model=model, encoder=encoder, scaler=scaler,
+                                                                       verbose=0)
+        version = fct_model.save_versioned_artifacts(controller.artifacts_dir, model, encoder, scaler, metadata={
+            "accuracy": history.history["accuracy"][-1],
+            "prod_rows": start["prod_rows"],
+            "reasons": reasons,
+            "seconds": time.time() - started,
+        })
+
+        def reset(manifest):
+            manifest["rows_at_last_train"] = start["prod_rows"]
+            manifest["new_rows"] -= start["new_rows"]
+            manifest["correct"] -= start["correct"]
+            if start["feature_sum"] is not None and manifest["feature_sum"] is not None:
+                manifest["feature_sum"] = (np.asarray(manifest["feature_sum"]) - np.asarray(start["feature_sum"])).tolist()
+            if manifest["new_rows"] == 0:
+                manifest["feature_sum"] = None
+            set_reference(manifest, scaler)
+            manifest["last_train"] = {"version": version, "time": time.time(), "reasons": reasons}
+        controller.update(reset)
+        print(f"Version {version} trained ({', '.join(reasons)})")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check the retraining thresholds, or retrain the model.")
+    parser.add_argument("command", choices=["status", "retrain"])
+    parser.add_argument("--artifacts", default=ARTIFACTS_DIR)
+    parser.add_argument("--force", action="store_true", help="Retrain even if no threshold is crossed")
+    args = parser.parse_args()
+
+    controller = RetrainController(artifacts_dir=args.artifacts)
+    if args.command == "status":
+        manifest = controller.read_manifest()
+        print(json.dumps({key: manifest[key] for key in ("prod_rows", "rows_at_last_train", "new_rows", "correct", "last_train")}, indent=2))
+        print(f"drift: {feature_drift(manifest)}, retrain: {controller.check(manifest) or 'no'}")
+    elif controller.maybe_retrain(force=args.force):
+        controller.wait()
+    else:
+        print("No retraining needed")
+
+
+if __name__ == "__main__":
+    main()
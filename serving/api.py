@@ -5,50 +5,168 @@
 # Others depend on the page size.
 
 from fastapi import FastAPI, Request, BackgroundTasks, HTTPException
+from fastapi.responses import StreamingResponse
 import os
-import pandas as pd
-import requests
-import re
-from bs4 import BeautifulSoup
 # For youtube
-from youtube_transcript_api import YouTubeTranscriptApi
 # For huggingface models
 from transformers import pipeline
-from transformers import AutoModelForSeq2SeqLM, AutoTokenizer
-import csv
-from transformers import T5ForConditionalGeneration, T5Tokenizer
+from transformers import AutoTokenizer
+from transformers import T5Tokenizer
 import torch
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+import multiprocessing
+import json
+
+from batching import BatchScheduler
+from model_registry import ModelRegistry
+from summary_cache import SummaryCache, make_key
+from fetcher import PageFetcher, FetchError
+from extraction_cache import ExtractionCache
+from metrics import EXTRACTION_CACHE_REQUESTS, SUMMARY_TTFT_SECONDS, make_metrics_app, observe_trace, observe_tokens
+from chunking import map_reduce_summarize, CHUNK_TOKENS, CHUNK_OVERLAP, MAP_REDUCE_MAX_DEPTH
+from streaming import stream_generate, sse_event
+import tracing
+from tracing import span
+from backends import backend_for, load_seq2seq_model, model_memory, DEVICE
+from jobs import Job, JobQueue, make_job_store
+from feedback_store import FeedbackStore, parse_rating
+import extractors
+import textnorm
+import budget
 
 
 #import fct_model
 
 import logging
-logging.basicConfig(level=logging.INFO)
+logging.basicConfig(level=os.getenv("LOG_LEVEL", "INFO"))
 logger = logging.getLogger(__name__)
 
 app = FastAPI()
+app.mount("/metrics", make_metrics_app())
+
+@app.middleware("http")
+async def server_timing(request: Request, call_next):
+  """
+    Time spent in each stage of the request (fetch, parse, extract, tokenize, generate, ...), in the Server-Timing header
+    and in the request_stage_seconds histogram of /metrics (labelled by version and source).
+    A streamed response only reports the stages done before its first event.
+  """
+  trace, labels = tracing.start_trace()
+  response = await call_next(request)
+  if trace:
+    response.headers["Server-Timing"] = tracing.server_timing_header(trace)
+    observe_trace(trace, labels)
+  return response
 
 MAX_LENGTH = 500 # Max length of the summary
 MIN_LENGTH = 30
-prod_path = "/data/prod_data.csv"
+VERSIONS = ["v1", "v2", "v3", "v4", "v5"]
+MODEL_NAMES = {
+  "v1": "Falconsai/text_summarization",
+  "v2": "claradlnv/distilbart-fine-tune",
+  "v3": "maryemj/T5_Small_fineTuned",
+  "v4": "claradlnv/fine-tuned-distilbart2",
+  "v5": "Atatra/T5_Small_fineTuned2",
+}
+DEFAULT_VERSION = os.getenv("DEFAULT_VERSION", "v1")
+PREWARM_DEFAULT_VERSION = os.getenv("PREWARM_DEFAULT_VERSION", "1") == "1" # Load the default version in background at startup
+PRELOAD_VERSIONS = [v for v in os.getenv("PRELOAD_VERSIONS", "").split(",") if v] # Loaded at import, before gunicorn forks its workers
+INFERENCE_THREADS = int(os.getenv("INFERENCE_THREADS", "1")) # Threads running generate calls
+BATCH_MAX_URLS = int(os.getenv("BATCH_MAX_URLS", "10000")) # URLs per /summary/batch request
+BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", "16")) # URLs of a batch fetched and summarized at once
+EXTRACTION_PROCESSES = int(os.getenv("EXTRACTION_PROCESSES", "0")) or max(1, min(4, os.cpu_count() or 1)) # Process pool of batch extractions
+
+inference_executor = ThreadPoolExecutor(max_workers=INFERENCE_THREADS, thread_name_prefix="inference")
+batchers = {}
+extraction_pool = None # Created on first batch
+
+def load_version(version):
+  """
+    Load the summarizer of a version : a pipeline for v1, a (model, tokenizer) pair otherwise.
+    The inference backend (torch, onnx, onnx-int8) is configured per version with INFERENCE_BACKENDS.
+  """
+  if version == "v1":
+    return get_summarizer(MODEL_NAMES[version], backend=backend_for(version))
+  return get_model_tokenizer(model_name=MODEL_NAMES[version], backend=backend_for(version))
+
+def model_size(entry):
+  """ Memory used by the weights of a loaded version, in bytes. """
+  return model_memory(entry[0] if isinstance(entry, tuple) else entry.model)
+
+registry = ModelRegistry(load_version, model_size)
+summary_cache = SummaryCache()
+fetcher = PageFetcher()
+extraction_cache = ExtractionCache()
+job_store = make_job_store()
+feedback_store = FeedbackStore() # Also appends to /data/prod_data.csv (FEEDBACK_CSV_PATH)
+CACHE_CONTROLS = ["default", "no-cache", "no-store"]
+MODES = ["truncate", "mapreduce", "salient"]
+# Tokens given to the model per version (v2 : tokenizer.model_max_length of distilbart, the others are truncated to 512)
+INPUT_WINDOWS = {"v1": 512, "v2": 1024, "v3": 512, "v4": 512, "v5": 512}
 
 @app.on_event("startup")
 def load_model():
-  """ global summarizer """
-  #summarizer = get_summarizer()
-  global summarizerFalconT5, modelBart, tokenizerBart, modelT5, tokenizerT5, modelBartNew, tokenizerBartNew, modelT5New, tokenizerT5New
-  summarizerFalconT5 = get_summarizer("Falconsai/text_summarization")
-  modelBart, tokenizerBart = get_model_tokenizer(model_name="claradlnv/distilbart-fine-tune")
-  modelT5, tokenizerT5 = get_model_tokenizer(model_name="maryemj/T5_Small_fineTuned")
-  modelBartNew, tokenizerBartNew = get_model_tokenizer(model_name="claradlnv/fine-tuned-distilbart2")
-  modelT5New, tokenizerT5New = get_model_tokenizer(model_name="Atatra/T5_Small_fineTuned2")
+  """ Models are loaded on demand by the registry, only the default version may be prewarmed. """
+  if PREWARM_DEFAULT_VERSION:
+    registry.prewarm(DEFAULT_VERSION)
+
+@app.on_event("startup")
+async def start_fetcher():
+  await fetcher.start()
+
+@app.on_event("shutdown")
+async def close_fetcher():
+  await fetcher.close()
+
+@app.on_event("startup")
+async def start_batchers():
+  """ One batching queue per model version, all sharing the inference thread pool. """
+  for version in VERSIONS:
+    batchers[version] = BatchScheduler(version, lambda texts, version=version: summarize_batch(texts, version), executor=inference_executor)
+    batchers[version].start()
+
+@app.on_event("shutdown")
+async def stop_batchers():
+  for batcher in batchers.values():
+    await batcher.stop()
+  inference_executor.shutdown(wait=False)
+  if extraction_pool is not None:
+    extraction_pool.shutdown(wait=False, cancel_futures=True)
+
+@app.on_event("startup")
+async def start_feedback_store():
+  await feedback_store.start()
+
+@app.on_event("shutdown")
+async def stop_feedback_store():
+  await feedback_store.stop()
+
+@app.on_event("startup")
+async def start_jobs():
+  await job_queue.start()
+
+@app.on_event("shutdown")
+async def stop_jobs():
+  await job_queue.stop()
 
 @app.get("/")
 def read_root(input):
   return {"message": f"Hello, {input}"}
 
+@app.get("/models")
+def models():
+  """ Versions currently loaded in memory. """
+  return registry.stats()
+
+@app.get("/cache")
+def cache_stats():
+  """ Size of the summary and extraction caches (hit/miss counters are in /metrics). """
+  return {"summaries": summary_cache.stats(), "extraction": extraction_cache.stats()}
+
 @app.post("/summary")
-async def summary(url: str, version: str = "v1"):
+async def summary(url: str, version: str = "v1", cache_control: str = "default", mode: str = "truncate"):
   """
     Return summary of link's content.
     - v1 for FalconsAI T5-small
@@ -56,109 +174,453 @@ async def summary(url: str, version: str = "v1"):
     - v3 for our fine-tuned T5-Small on a caption summary dataset
     - V4 for our fine-tuned distilBart on our custom summary dataset
     - V5 for our fine-tuned T5-Small on our custom summary dataset
+
+    cache_control works like the Cache-Control header :
+    - default : return the cached summary of this text if there is one
+    - no-cache : always generate, then update the cache
+    - no-store : always generate and don't cache the result
+
+    mode :
+    - truncate : the text is truncated to the model window (512 tokens)
+    - salient : the sentences of the text closest to the whole text (TF-IDF) that fit the model window are summarized
+    - mapreduce : the whole text is summarized by chunks, then the partial summaries are summarized (long pages, videos)
+
+    The returned summary_id can be sent back with the feedback instead of the url.
   """
-  response = requests.get(url)
-  # Vérifie si la requête a réussi (code 200)
-  if response.status_code != 200:
-    raise HTTPException(status_code=400, detail="Impossible de récupérer l'URL fournie.")
-  soup = BeautifulSoup(response.text, 'html.parser')
-  extracted_text = main_content_extractor(soup, url)
-  # Vérifie que du texte a bien été extrait
-  if not extracted_text or len(extracted_text) < 50:
-    raise HTTPException(status_code=400, detail="Aucun contenu pertinent trouvé sur la page.")
+  check_summary_params(version, cache_control, mode)
+  tracing.set_labels(version=version, source=source_type(url))
+  extracted_text = await fetch_page_text(url)
+  return await summarize_page(url, extracted_text, version, cache_control, mode)
 
-  if version == "v1":
-    summary = summarizerFalconT5(extracted_text, max_length=MAX_LENGTH, min_length=MIN_LENGTH, do_sample=False)[0]["summary_text"]
-  elif version == "v2":
-    summary = get_summary(extracted_text, model=modelBart, tokenizer=tokenizerBart)
-  elif version == "v3":
-    summary = generate_summary(extracted_text, model=modelT5, tokenizer=tokenizerT5)
-  elif version == "v4":
-    summary = generate_summary(extracted_text, model=modelBartNew, tokenizer=tokenizerBartNew)
-  elif version == "v5":
-    summary = generate_summary(extracted_text, model=modelT5New, tokenizer=tokenizerT5New)
-  return {"summary": summary, "original": extracted_text}
+@app.post("/summary/batch")
+async def summary_batch(request: Request):
+  """
+    Summarize a list of URLs. JSON body : {"urls": [...], "version": "v1", "cache_control": "default", "mode": "truncate"}
+    Pages are fetched concurrently and extracted in a process pool, their summaries share the padded batches of the version.
+    One JSON line is streamed per URL as soon as it is done (not in the input order) :
+    {"index": ..., "url": ..., "version": ..., "summary": ..., "summary_id": ...} or {"index": ..., "url": ..., "error": ...}
+  """
+  data = await request.json()
+  urls = data.get("urls")
+  version = data.get("version", "v1")
+  cache_control = data.get("cache_control", "default")
+  mode = data.get("mode", "truncate")
+  if not isinstance(urls, list) or not all(isinstance(url, str) for url in urls):
+    raise HTTPException(status_code=400, detail="urls must be a list of URLs.")
+  if len(urls) > BATCH_MAX_URLS:
+    raise HTTPException(status_code=400, detail=f"At most {BATCH_MAX_URLS} URLs per batch.")
+  check_summary_params(version, cache_control, mode)
+  tracing.set_labels(version=version, source="batch")
+
+  async def lines():
+    async for result in summarize_urls(urls, version, cache_control, mode):
+      yield json.dumps(result) + "\n"
+
+  return StreamingResponse(lines(), media_type="application/x-ndjson")
+
+@app.post("/jobs", status_code=202)
+async def create_job(request: Request, url: str, version: str = "v1", cache_control: str = "default", mode: str = "truncate",
+                     callback_url: str = None):
+  """
+    Same as /summary, but returns a job at once instead of waiting for the summary (long pages, videos).
+    Poll GET /jobs/{id} until its status is done (result holds the /summary response), failed (see error) or cancelled.
+    If callback_url is given, the finished job is POSTed to it as JSON.
+    Jobs are run shortest page first, with at most JOB_CLIENT_CONCURRENCY running jobs per client
+    (X-Client-Id header, or client address).
+  """
+  check_summary_params(version, cache_control, mode)
+  client = request.headers.get("x-client-id") or (request.client.host if request.client else "anonymous")
+  job = Job(url, version, mode=mode, cache_control=cache_control, client=client, callback_url=callback_url)
+  return (await job_queue.submit(job)).to_dict()
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+  job = await job_queue.get(job_id)
+  if job is None:
+    raise HTTPException(status_code=404, detail="Unknown job.")
+  return job.to_dict()
+
+@app.delete("/jobs/{job_id}")
+async def cancel_job(job_id: str):
+  """ Cancel a queued or running job. """
+  job = await job_queue.cancel(job_id)
+  if job is None:
+    raise HTTPException(status_code=404, detail="Unknown job.")
+  return job.to_dict()
+
+@app.post("/summary/stream")
+async def summary_stream(url: str, version: str = "v1", cache_control: str = "default"):
+  """
+    Same as /summary, but a preview of the summary is streamed as Server-Sent Events while it is generated :
+    - one event per decoded piece of text : data: {"token": ...}
+    - a final "done" event : data: {"summary": ..., "original": ..., "summary_id": ...}
+    - an "error" event if generation fails
+    The preview is generated greedily (see streaming_params). The summary of the "done" event is the one of /summary
+    (same decoding, batching queue and cache), it is the one rated through /feedback.
+  """
+  started = time.perf_counter()
+  check_summary_params(version, cache_control)
+  tracing.set_labels(version=version, source=source_type(url))
+  extracted_text = await fetch_page_text(url)
+
+  # Streamed previews are cached apart from /summary summaries
+  cache_key = make_key(extracted_text, version, stream=True, backend=backend_for(version), **streaming_params(version))
+  summary_key = make_key(extracted_text, version, **generation_params("truncate", version))
+  summary = await asyncio.to_thread(summary_cache.get, summary_key) if cache_control == "default" else None
+  cached = await asyncio.to_thread(summary_cache.get, cache_key) if cache_control == "default" and summary is None else None
+
+  async def events():
+    if summary is not None:
+      # Already summarized by /summary, nothing to preview
+      SUMMARY_TTFT_SECONDS.labels(version).observe(time.perf_counter() - started)
+      yield sse_event({"token": summary})
+      summary_id = extraction_cache.issue_summary_id(url, extracted_text, summary, version)
+      yield sse_event({"summary": summary, "original": extracted_text, "summary_id": summary_id}, event="done")
+      return
+
+    result = None  # /summary result, started once the preview is streaming
+    try:
+      if cached is not None:
+        SUMMARY_TTFT_SECONDS.labels(version).observe(time.perf_counter() - started)
+        yield sse_event({"token": cached})
+      else:
+        pieces = []
+        try:
+          model, tokenizer, inputs, generate_kwargs = await asyncio.to_thread(streaming_inputs, extracted_text, version)
+          async for piece in stream_generate(model, tokenizer, inputs, generate_kwargs, executor=inference_executor):
+            if not pieces:
+              SUMMARY_TTFT_SECONDS.labels(version).observe(time.perf_counter() - started)
+              result = asyncio.ensure_future(summarize_page(url, extracted_text, version, cache_control))
+            pieces.append(piece)
+            yield sse_event({"token": piece})
+          if cache_control != "no-store":
+            await asyncio.to_thread(summary_cache.set, cache_key, "".join(pieces).strip())
+        except Exception as e:
+          logger.error(f"Streaming generation failed: {e}")  # Only the preview is missing
+
+      try:
+        yield sse_event(await (result or summarize_page(url, extracted_text, version, cache_control)), event="done")
+      except Exception as e:
+        logger.error(f"Summary generation failed: {e}")
+        yield sse_event({"detail": getattr(e, "detail", None) or str(e)}, event="error")
+    finally:
+      if result is not None and not result.done():
+        result.cancel()  # Client gone
+
+  return StreamingResponse(events(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
 
 
 @app.post("/feedback")
 async def feedback(background_tasks: BackgroundTasks, request: Request):
   """
   Send feedback of model's prediction.
-  Feedback is then saved in /data/prod_data.csv with full text, summary, and rating.
+  Feedback is then saved in the feedback store with full text, summary, and rating (written by batches,
+  and appended to /data/prod_data.csv, see feedback_store.py).
+  The full text is the one that was summarized (from summary_id, or the cached page of url),
+  the page is only downloaded again if it is no longer cached.
   """
   data = await request.json()
   url = data.get("url")
-  # Client should send the full text, but for now...
-  response = requests.get(url) 
-  soup = BeautifulSoup(response.text, 'html.parser')
-  full = main_content_extractor(soup, url)
   summary = data.get("summary")
-  rating = data.get("rating")
   version = data.get("version")
-  save_feedback(full, summary, rating, version, output_path=prod_path)
-
-def main_content_extractor(soup, url):
-  text = None
-  
-  if ("wikipedia" in url):
-    # Find all p direct children of target_div
-    target_div = soup.find('div', class_='mw-content-ltr mw-parser-output')
-    paragraphs = " ".join([p.get_text() for p in target_div.find_all('p', recursive=False)]) # A revoir si on veut + de texte
-    logger.info("Text: %s", paragraphs)
-    
-  elif ("youtube" in url): # Retreive transcript if exist
-    video_id = url.split("v=")[1]
+  try:
+    rating = parse_rating(data.get("rating"))  # Checked before the page is fetched again
+  except ValueError as e:
+    raise HTTPException(status_code=400, detail=str(e))
+  tracing.set_labels(version=str(version), source=source_type(url) if url else "none")
+  record = extraction_cache.get_summary(data.get("summary_id")) if data.get("summary_id") else None
+  cached = extraction_cache.get(url) if url is not None else None
+  if record is not None:
+    full = record.text
+    summary = summary or record.summary
+    version = version or record.version
+  elif cached is not None:
+    full = cached.text
+    EXTRACTION_CACHE_REQUESTS.labels("hit").inc()
+  elif url is not None:
+    full = await fetch_content(url)
+  else:
+    raise HTTPException(status_code=400, detail="url or summary_id is required.")
+  with span("save_feedback"):
     try:
-      transcript = YouTubeTranscriptApi.get_transcript(video_id, languages=['en'])
-      paragraphs = " ".join([t['text'] for t in transcript])
-    except:
-      raise HTTPException(status_code=404, detail="No english transcript found for this video.")
-    
-  else: # Otherwise extract all text from page
-    paragraphs = soup.get_text()
-    
-  text = preprocess(paragraphs)
+      save_feedback(full, summary, rating, version)
+    except ValueError as e:
+      raise HTTPException(status_code=400, detail=str(e))
+
+def check_summary_params(version, cache_control, mode="truncate"):
+  if version not in VERSIONS:
+    raise HTTPException(status_code=400, detail=f"Unknown version '{version}'.")
+  if cache_control not in CACHE_CONTROLS:
+    raise HTTPException(status_code=400, detail=f"cache_control must be one of {CACHE_CONTROLS}.")
+  if mode not in MODES:
+    raise HTTPException(status_code=400, detail=f"mode must be one of {MODES}.")
+
+async def fetch_page_text(url, executor=None):
+  """ Extracted text of the page, an error if there is nothing to summarize. """
+  extracted_text = await fetch_content(url, executor)
+  # Vérifie que du texte a bien été extrait
+  if not extracted_text or len(extracted_text) < 50:
+    raise HTTPException(status_code=400, detail="Aucun contenu pertinent trouvé sur la page.")
+  return extracted_text
+
+async def summarize_page(url, extracted_text, version, cache_control="default", mode="truncate"):
+  """ Summary of an extracted page through the summary cache, as returned by /summary. """
+  cache_key = make_key(extracted_text, version, **generation_params(mode, version))
+  if cache_control == "default":
+    summary = await asyncio.to_thread(summary_cache.get, cache_key)
+  else:
+    summary = None
+
+  if summary is None:
+    summary = await summarize_text(extracted_text, version, mode)
+    if cache_control != "no-store":
+      await asyncio.to_thread(summary_cache.set, cache_key, summary)
+  summary_id = extraction_cache.issue_summary_id(url, extracted_text, summary, version)
+  return {"summary": summary, "original": extracted_text, "summary_id": summary_id}
+
+async def summarize_urls(urls, version, cache_control="default", mode="truncate", concurrency=BATCH_CONCURRENCY):
+  """
+    Summarize a list of URLs, yields one result per URL in completion order (see /summary/batch).
+    Errors are reported per URL. Stopping the iteration cancels the URLs not done yet.
+  """
+  semaphore = asyncio.Semaphore(concurrency)
+  pool = get_extraction_pool()
+
+  async def one(index, url):
+    async with semaphore:
+      try:
+        text = await fetch_page_text(url, executor=pool)
+        result = await summarize_page(url, text, version, cache_control, mode)
+        return {"index": index, "url": url, "version": version, "summary": result["summary"], "summary_id": result["summary_id"]}
+      except HTTPException as e:
+        error = e.detail
+      except Exception as e:
+        logger.error(f"Batch summary of '{url}' failed: {e}")
+        error = str(e) or type(e).__name__
+      return {"index": index, "url": url, "version": version, "error": error}
+
+  tasks = [asyncio.ensure_future(one(index, url)) for index, url in enumerate(urls)]
+  try:
+    for done in asyncio.as_completed(tasks):
+      yield await done
+  finally:
+    for task in tasks:
+      task.cancel()
+
+def get_extraction_pool():
+  """
+    Process pool of the batch extractions (HTML parsing holds the GIL).
+    The workers are forked from a fresh forkserver process, not from the server (threads, sockets, torch) :
+    they only import extractors, never the API.
+  """
+  global extraction_pool
+  if extraction_pool is None:
+    context = multiprocessing.get_context("forkserver")
+    context.set_forkserver_preload(["extractors"])
+    extraction_pool = ProcessPoolExecutor(EXTRACTION_PROCESSES, mp_context=context)
+  return extraction_pool
+
+async def summarize_text(text, version, mode="truncate"):
+  """
+    Summarize through the batching queue of the version (generated on a worker thread,
+    batched with concurrent requests). In mapreduce mode, all chunks are queued at once.
+  """
+  if mode == "mapreduce":
+    tokenizer = await asyncio.to_thread(get_tokenizer, version)
+    return await map_reduce_summarize(text, tokenizer, lambda chunk: generate_text(chunk, version))
+  with span("select"):
+    if mode == "salient": # Sentence scoring takes a while on large pages, off the event loop
+      text = await asyncio.to_thread(select_input, text, version, mode)
+    else:
+      text = select_input(text, version, mode)
+  return await generate_text(text, version)
+
+def select_input(text, version, mode="truncate"):
+  """
+    Part of the text given to the tokenizer (see budget.py) : the salient sentences fitting the model window,
+  or in truncate mode a prefix long enough to give the same truncated input (only this prefix is tokenized).
+  The v1 pipeline doesn't truncate its inputs, they are kept whole in truncate mode.
+  """
+  if mode == "salient":
+    return budget.select_sentences(text, INPUT_WINDOWS[version])
+  if version == "v1":
+    return text
+  return budget.fit_prefix(text, INPUT_WINDOWS[version])
+
+async def generate_text(text, version):
+  """ Submit one text to the batching queue, the timings of its batch are added to the request trace. """
+  started = time.perf_counter()
+  summary, timings = await batchers[version].submit(text)
+  tracing.merge(timings)
+  tracing.record("queue", max(0.0, time.perf_counter() - started - sum(timings.values())))
+  return summary
+
+def generation_params(mode="truncate", version=None):
+  """
+    Parameters changing the generated summary, part of the summary cache key.
+  The inference backend is included : onnx-int8 summaries are not served for torch ones, and the other way round.
+  """
+  params = {"max_length": MAX_LENGTH, "min_length": MIN_LENGTH}
+  if version is not None:
+    params["backend"] = backend_for(version)
+  if mode == "mapreduce":
+    params.update(mode=mode, chunk_tokens=CHUNK_TOKENS, chunk_overlap=CHUNK_OVERLAP, max_depth=MAP_REDUCE_MAX_DEPTH)
+  elif mode == "salient":
+    params.update(mode=mode, selection_fill=budget.SELECTION_FILL)
+  return params
+
+def streaming_params(version):
+  """
+    Input window and generate arguments of a streamed summary, part of its cache key.
+  TextStreamer doesn't support beam search : the stream is generated greedily (num_beams=1), whatever the
+  generation config of the model or the task parameters of the v1 pipeline.
+  """
+  if version == "v2":
+    generate_kwargs = {"max_new_tokens": 150, "do_sample": False, "num_beams": 1}
+  else:
+    generate_kwargs = {"max_length": MAX_LENGTH, "min_length": MIN_LENGTH, "do_sample": False, "num_beams": 1}
+  return {"max_input_tokens": INPUT_WINDOWS[version], **generate_kwargs}
+
+def streaming_inputs(text, version):
+  """
+    Model, tokenizer, tokenized input and generate arguments of a version, for stream_generate.
+  """
+  entry = registry.get(version)
+  if isinstance(entry, tuple):
+    model, tokenizer = entry
+  else:
+    model, tokenizer = entry.model, entry.tokenizer
+    text = (getattr(model.config, "prefix", None) or "") + text # Same prefix as the summarization pipeline
+  generate_kwargs = streaming_params(version)
+  max_input_tokens = generate_kwargs.pop("max_input_tokens")
+  text = budget.fit_prefix(text, max_input_tokens) # Only the truncated part is tokenized
+  inputs = tokenizer(text, return_tensors="pt", truncation=True, max_length=max_input_tokens)
+  inputs = {key: value.to(model.device) for key, value in inputs.items()}
+  return model, tokenizer, inputs, generate_kwargs
+
+def source_type(url):
+  """ Kind of page, as handled by extractors.page_text (metrics label). """
+  if "wikipedia" in url:
+    return "wikipedia"
+  if "youtube" in url:
+    return "youtube"
+  return "generic"
+
+def get_tokenizer(version):
+  entry = registry.get(version)
+  return entry[1] if isinstance(entry, tuple) else entry.tokenizer
+
+async def fetch_content(url, executor=None):
+  """
+    Download the page with the shared async client and extract its main content on a worker thread
+  (or with `executor`, a process pool). Extracted texts are cached : a cached page is revalidated with a
+  conditional GET and reused on 304.
+  """
+  cached = extraction_cache.get(url)
+  if "youtube" in url: # The transcript is retrieved from its own API, no need to download the page
+    if cached is not None:
+      EXTRACTION_CACHE_REQUESTS.labels("hit").inc()
+      return cached.text
+    text = await run_extraction(None, url, executor)
+    EXTRACTION_CACHE_REQUESTS.labels("miss").inc()
+    return extraction_cache.put(url, text).text
+
+  try:
+    with span("fetch"):
+      response = await fetcher.fetch(url, headers=extraction_cache.validators(cached))
+  except FetchError as e:
+    raise HTTPException(status_code=400, detail=f"Impossible de récupérer l'URL fournie. {e}")
+  if response.status_code == 304 and cached is not None:
+    EXTRACTION_CACHE_REQUESTS.labels("revalidated").inc()
+    return cached.text
+  # Vérifie si la requête a réussi (code 200)
+  if response.status_code != 200:
+    raise HTTPException(status_code=400, detail="Impossible de récupérer l'URL fournie.")
+  text = await run_extraction(response.text, url, executor)
+  EXTRACTION_CACHE_REQUESTS.labels("miss").inc()
+  return extraction_cache.put(url, text, response.headers.get("etag"), response.headers.get("last-modified")).text
+
+async def run_extraction(html, url, executor=None):
+  """ Main text of the page (extractors.page_text) on a worker thread, or in the process pool `executor`. """
+  if executor is None:
+    return await asyncio.to_thread(extract_content, html, url)
+  text, error = await asyncio.get_running_loop().run_in_executor(executor, extractors.page_text_in_process, html, url)
+  if error is not None:
+    raise HTTPException(status_code=error[0], detail=error[1])
   return text
 
+def extract_content(html, url):
+  try:
+    return extractors.page_text(html, url)
+  except extractors.ExtractionError as e:
+    raise HTTPException(status_code=e.status_code, detail=e.detail)
+
+def summarize_batch(texts, version):
+  """
+  Summarize a list of texts with a single batched call (blocking, run by the batch schedulers).
+  The model is loaded by the registry on first use.
+  Returns a (summary, timings of the batch) pair per text.
+  """
+  if version not in VERSIONS:
+    raise ValueError(f"Unknown version '{version}'")
+  timings = {}
+  with span("model_load", timings):
+    entry = registry.get(version)
+  if version == "v1":
+    # The pipeline tokenizes internally (included in generate), the token ids are decoded here to count them
+    with span("generate", timings):
+      outputs = entry(texts, max_length=MAX_LENGTH, min_length=MIN_LENGTH, do_sample=False, batch_size=len(texts), return_tensors=True)
+    token_ids = [output["summary_token_ids"] for output in outputs]
+    with span("decode", timings):
+      # Same decoding as the pipeline's summary_text
+      summaries = entry.tokenizer.batch_decode(token_ids, skip_special_tokens=True, clean_up_tokenization_spaces=False)
+    observe_tokens(version, None, [len(ids) for ids in token_ids])
+  else:
+    model, tokenizer = entry
+    if version == "v2":
+      summaries = get_summary(texts, model=model, tokenizer=tokenizer, timings=timings, version=version)
+    else:
+      summaries = generate_summary(texts, model=model, tokenizer=tokenizer, timings=timings, version=version)
+  return [(summary, timings) for summary in summaries]
+
 def preprocess(text):
   """
-    Preprocess text.
+    Preprocess text : whitespace, quotes, citations and hyperlinks, null characters (see textnorm.py).
   """
-  text = text.replace("\n", " ").replace("\t", " ")
-  text = " ".join(text.split())  # Remove extra spaces
-  text = text.replace('"', "'")
-  text = re.sub(r'\[\d+\]', '', text)  # Remove citations
-  text = re.sub(r'\[.*?\]', '', text) # Remove hyperlinks
-  
-  return text
+  return textnorm.normalize(text)
 
-def get_summarizer(model_name="claradlnv/distilbart-fine-tune"):
+def get_summarizer(model_name="claradlnv/distilbart-fine-tune", backend="torch"):
   cache_dir = "~/.cache/huggingface/hub/"  # Local directory to store models
   logger.info(f"Model is saved in '{cache_dir}'...")
   try:
-    logger.info(f"Initializing summarizer with model '{model_name}'...")
-    summarizer = pipeline("summarization", model=model_name)
+    logger.info(f"Initializing summarizer with model '{model_name}' ({backend})...")
+    if backend == "torch":
+      summarizer = pipeline("summarization", model=model_name, device=torch.device(DEVICE))
+    else:
+      model = load_seq2seq_model(model_name, backend)
+      summarizer = pipeline("summarization", model=model, tokenizer=AutoTokenizer.from_pretrained(model_name))
     logger.info("Model loaded successfully.")
     return summarizer
   except Exception as e:
     logger.error(f"Failed to load the model: {e}")
     raise
 
-def get_model_tokenizer(model_name="maryemj/T5_Small_fineTuned"):
+def get_model_tokenizer(model_name="maryemj/T5_Small_fineTuned", backend="torch"):
   """
   Charge le modèle et le tokenizer depuis Hugging Face.
+  backend : torch, onnx or onnx-int8 (see backends.py)
   """
-  logger.info(f"Initializing model and tokenizer with '{model_name}'...")
+  logger.info(f"Initializing model and tokenizer with '{model_name}' ({backend})...")
   try:
 
     if "T5" in model_name:
-      model = T5ForConditionalGeneration.from_pretrained(model_name)
+      model = load_seq2seq_model(model_name, backend)
       tokenizer = T5Tokenizer.from_pretrained(model_name)
       logger.info("Model and tokenizer loaded successfully.")
       return model, tokenizer
     
     elif "distilbart" in model_name:
-      model = AutoModelForSeq2SeqLM.from_pretrained(model_name)
+      model = load_seq2seq_model(model_name, backend)
       tokenizer = AutoTokenizer.from_pretrained(model_name)
       return model, tokenizer
     
@@ -170,40 +632,79 @@ def get_model_tokenizer(model_name="maryemj/T5_Small_fineTuned"):
     logger.error(f"Failed to load the model and tokenizer: {e}")
     raise
 
-def generate_summary(text, tokenizer, model):
+def generate_summary(text, tokenizer, model, timings=None, version=None):
   """
   Generate summary for T5-small fine-tuned
+  Accepts a single text or a list of texts (padded into one batch).
+  timings : optional dict receiving the duration of tokenize, generate and decode
+  version : if given, the token counts are recorded in the metrics of this version
   """
-  logger.info("Received a summarization request.")
+  texts = [text] if isinstance(text, str) else list(text)
+  logger.info(f"Received a summarization request ({len(texts)} texts).")
   
-  inputs = tokenizer(text, return_tensors="pt", truncation=True, max_length=512)
+  with span("tokenize", timings):
+    inputs = tokenizer(texts, return_tensors="pt", padding=True, truncation=True, max_length=512)
 
-  # Envoyer sur GPU si disponible
-  device = "cuda" if torch.cuda.is_available() else "cpu"
-  model.to(device)
-  inputs = {key: value.to(device) for key, value in inputs.items()}
+  # Le modèle est déjà sur GPU si disponible (backends.load_seq2seq_model)
+  inputs = {key: value.to(model.device) for key, value in inputs.items()}
 
-  outputs = model.generate(**inputs, max_length=MAX_LENGTH, min_length=MIN_LENGTH, do_sample=False)
+  with span("generate", timings):
+    outputs = model.generate(**inputs, max_length=MAX_LENGTH, min_length=MIN_LENGTH, do_sample=False)
 
-  summary = tokenizer.decode(outputs[0], skip_special_tokens=True)
-  return summary
+  with span("decode", timings):
+    summaries = tokenizer.batch_decode(outputs, skip_special_tokens=True)
+  if version is not None:
+    observe_tokens(version, input_lengths(inputs, texts, tokenizer, 512), output_lengths(outputs, tokenizer), 512)
+  return summaries[0] if isinstance(text, str) else summaries
 
-def get_summary(text, tokenizer, model):
+def get_summary(text, tokenizer, model, timings=None, version=None):
   """
   Generate summary for distilBar fine-tuned
+  Accepts a single text or a list of texts (padded into one batch).
+  timings : optional dict receiving the duration of tokenize, generate and decode
+  version : if given, the token counts are recorded in the metrics of this version
   """
-  inputs = tokenizer(text, return_tensors="pt", truncation=True, max_length=tokenizer.model_max_length).input_ids
-  outputs = model.generate(inputs, max_new_tokens=150, do_sample=False)
-  pred_text = tokenizer.decode(outputs[0], skip_special_tokens=True)
-  return pred_text
-
-def clean_input_data(data):
-  return data.replace("\x00", "")  # Remove null characters
-
-def save_feedback(full, summary, rating, version, output_path):
-  full = clean_input_data(full)
-  feedback_data = {"article": full, "abstract": summary, "rating": rating, "version": version}
-  feedback_df = pd.DataFrame([feedback_data])
-  file_exists_and_non_empty = os.path.isfile(output_path) and os.path.getsize(output_path) > 0
-  feedback_df.to_csv(output_path, mode='a', header=not file_exists_and_non_empty, index=False,
-                     quoting=csv.QUOTE_MINIMAL, encoding="utf-8")
\ No newline at end of file
+  texts = [text] if isinstance(text, str) else list(text)
+  with span("tokenize", timings):
+    inputs = tokenizer(texts, return_tensors="pt", padding=True, truncation=True, max_length=tokenizer.model_max_length)
+  inputs = {key: value.to(model.device) for key, value in inputs.items()}
+  with span("generate", timings):
+    outputs = model.generate(**inputs, max_new_tokens=150, do_sample=False)
+  with span("decode", timings):
+    pred_texts = tokenizer.batch_decode(outputs, skip_special_tokens=True)
+  if version is not None:
+    observe_tokens(version, input_lengths(inputs, texts, tokenizer, tokenizer.model_max_length), output_lengths(outputs, tokenizer), tokenizer.model_max_length)
+  return pred_texts[0] if isinstance(text, str) else pred_texts
+
+def input_lengths(inputs, texts, tokenizer, max_length):
+  """
+  Tokens per text before truncation. Only the texts filling the window are tokenized again, without truncation,
+  to tell those that fit exactly from the truncated ones (their length is bounded by budget.fit_prefix).
+  """
+  lengths = inputs["attention_mask"].sum(dim=1).tolist()
+  full = [i for i, length in enumerate(lengths) if length >= max_length]
+  if full:
+    for i, ids in zip(full, tokenizer([texts[i] for i in full], truncation=False, verbose=False)["input_ids"]):
+      lengths[i] = len(ids)
+  return lengths
+
+def output_lengths(outputs, tokenizer):
+  """ Generated tokens per sequence of a padded generate output. """
+  if tokenizer.pad_token_id is None:
+    return [outputs.shape[1]] * outputs.shape[0]
+  return (outputs != tokenizer.pad_token_id).sum(dim=1).tolist()
+
+def save_feedback(full, summary, rating, version):
+  """ Buffered, written by the flush loop of the feedback store (which also removes the null characters). """
+  feedback_store.add(full, summary, rating, version)
+
+job_queue = JobQueue(
+  prepare=lambda job: fetch_page_text(job.url),
+  runner=lambda job, text: summarize_page(job.url, text, job.version, job.cache_control, job.mode),
+  store=job_store,
+)
+
+# Multi-process serving (gunicorn.conf.py) : the app is imported once by the master process,
+# the weights loaded here are shared by the forked workers
+for version in PRELOAD_VERSIONS:
+  registry.get(version)
@@ -0,0 +1,97 @@
+# Inference backends for the seq2seq summarization models.
+# - torch : eager PyTorch (default), moved once to the GPU if there is one
+# - onnx : ONNX Runtime, encoder/decoder exported with cached past key values
+# - onnx-int8 : same as onnx, with dynamic int8 quantization of the weights
+# The backend is chosen per version with INFERENCE_BACKENDS, e.g. "v1=onnx,v3=onnx-int8" (others use torch).
+# Exported models are kept in ONNX_CACHE_DIR so the export only happens once.
+
+import logging
+import os
+
+import torch
+from transformers import AutoModelForSeq2SeqLM, T5ForConditionalGeneration
+
+logger = logging.getLogger(__name__)
+
+BACKENDS = ["torch", "onnx", "onnx-int8"]
+ONNX_CACHE_DIR = os.getenv("ONNX_CACHE_DIR", "/data/cache/onnx")
+DEVICE = "cuda" if torch.cuda.is_available() else "cpu"
+
+
+def parse_backends(config):
+  """ "v1=onnx,v3=onnx-int8" -> {"v1": "onnx", "v3": "onnx-int8"} """
+  backends = {}
+  for item in filter(None, (part.strip() for part in config.split(","))):
+    version, _, backend = item.partition("=")
+    if backend not in BACKENDS:
+      raise ValueError(f"Unknown inference backend '{backend}' for {version}, expected one of {BACKENDS}.")
+    backends[version.strip()] = backend
+  return backends
+
+
+VERSION_BACKENDS = parse_backends(os.getenv("INFERENCE_BACKENDS", ""))
+
+
+def backend_for(version):
+  return VERSION_BACKENDS.get(version, "torch")
+
+
+def load_seq2seq_model(model_name, backend="torch"):
+  """ Load a seq2seq model exposing `generate` with the given backend. """
+  if backend == "torch":
+    model_class = T5ForConditionalGeneration if "T5" in model_name else AutoModelForSeq2SeqLM
+    model = model_class.from_pretrained(model_name)
+    # Moved once here rather than before every generate call
+    return model.to(DEVICE).eval()
+  if backend in ("onnx", "onnx-int8"):
+    return load_onnx_model(model_name, quantize=backend == "onnx-int8")
+  raise ValueError(f"Unknown inference backend '{backend}', expected one of {BACKENDS}.")
+
+
+def load_onnx_model(model_name, quantize=False):
+  """ Export `model_name` to ONNX (with past key values) on first use, optionally quantized to int8. """
+  from optimum.onnxruntime import ORTModelForSeq2SeqLM
+
+  export_dir = os.path.join(ONNX_CACHE_DIR, model_name.replace("/", "--"))
+  if not os.path.isfile(os.path.join(export_dir, "encoder_model.onnx")):
+    logger.info(f"Exporting '{model_name}' to ONNX in '{export_dir}'...")
+    model = ORTModelForSeq2SeqLM.from_pretrained(model_name, export=True, use_cache=True, use_merged=False)
+    model.save_pretrained(export_dir)
+
+  if not quantize:
+    return ORTModelForSeq2SeqLM.from_pretrained(export_dir, use_cache=True)
+
+  file_names = quantize_onnx_model(export_dir)
+  return ORTModelForSeq2SeqLM.from_pretrained(
+    export_dir,
+    use_cache=True,
+    encoder_file_name=file_names["encoder_model.onnx"],
+    decoder_file_name=file_names["decoder_model.onnx"],
+    decoder_with_past_file_name=file_names["decoder_with_past_model.onnx"],
+  )
+
+
+def quantize_onnx_model(export_dir):
+  """ Dynamic int8 quantization of the exported encoder/decoders, done once. Returns the quantized file names. """
+  from optimum.onnxruntime import ORTQuantizer
+  from optimum.onnxruntime.configuration import AutoQuantizationConfig
+
+  config = AutoQuantizationConfig.avx2(is_static=False, per_channel=False)
+  file_names = {}
+  for file_name in ("encoder_model.onnx", "decoder_model.onnx", "decoder_with_past_model.onnx"):
+    quantized_name = file_name.replace(".onnx", "_quantized.onnx")
+    if not os.path.isfile(os.path.join(export_dir, quantized_name)):
+      logger.info(f"Quantizing '{file_name}' to int8...")
+      quantizer = ORTQuantizer.from_pretrained(export_dir, file_name=file_name)
+      quantizer.quantize(save_dir=export_dir, quantization_config=config)
+    file_names[file_name] = quantized_name
+  return file_names
+
+
+def model_memory(model):
+  """ Memory used by the weights of a model, in bytes (size of the ONNX files for ONNX Runtime models). """
+  if hasattr(model, "parameters"):
+    tensors = list(model.parameters()) + list(model.buffers())
+    return sum(t.numel() * t.element_size() for t in tensors)
+  paths = (getattr(model, name, None) for name in ("encoder_model_path", "decoder_model_path", "decoder_with_past_model_path"))
+  return sum(os.path.getsize(path) for path in paths if path and os.path.isfile(path))
@@ -0,0 +1,103 @@
+# Summarize a list of URLs offline (corpus refresh, evaluation sets), in-process without the HTTP server.
+# Same pipeline as /summary/batch : concurrent fetches, extraction in a process pool, padded inference batches.
+# Results are appended to the output as JSON lines as soon as they are done, one per URL, errors included.
+# The output is also the checkpoint : after a crash, run the same command again and the URLs already in the
+# output are skipped (--retry-errors to run the failed ones again, the last line of a URL is the one that counts).
+#
+# python batch_summarize.py --input urls.txt --version v3 --output /data/cache/summaries.jsonl
+# python batch_summarize.py https://en.wikipedia.org/wiki/Bicycle https://www.youtube.com/watch?v=... --output out.jsonl
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import sys
+import time
+
+import api
+
+logger = logging.getLogger(__name__)
+
+
+def read_urls(args):
+  """ URLs of the command line and of --input (one per line, '-' for stdin), without duplicates. """
+  urls = list(args.urls)
+  if args.input:
+    with (sys.stdin if args.input == "-" else open(args.input, encoding="utf-8")) as f:
+      urls.extend(line.strip() for line in f)
+  return list(dict.fromkeys(url for url in urls if url and not url.startswith("#")))
+
+
+def read_checkpoint(path, retry_errors=False):
+  """
+  URLs already done according to the output file. A last line cut by a crash is removed from the file,
+  so that the next results start on a new line.
+  """
+  done = {}
+  if not os.path.exists(path):
+    return set()
+  with open(path, "rb+") as f:
+    valid_size = 0
+    for line in f:
+      if not line.endswith(b"\n"):
+        break
+      valid_size += len(line)
+      try:
+        result = json.loads(line)
+      except ValueError:
+        continue
+      done[result["url"]] = "error" not in result
+    f.truncate(valid_size)
+  return {url for url, ok in done.items() if ok or not retry_errors}
+
+
+async def run(urls, version, cache_control, mode, concurrency, output, sync_every):
+  await api.start_fetcher()
+  await api.start_batchers()
+  counts = {"done": 0, "errors": 0}
+  started = time.perf_counter()
+  try:
+    with open(output, "a", encoding="utf-8") as f:
+      async for result in api.summarize_urls(urls, version, cache_control, mode, concurrency=concurrency):
+        result.pop("index")
+        f.write(json.dumps(result, ensure_ascii=False) + "\n")
+        f.flush()
+        counts["errors" if "error" in result else "done"] += 1
+        finished = counts["done"] + counts["errors"]
+        if finished % sync_every == 0:
+          os.fsync(f.fileno())
+          logger.info(f"{finished}/{len(urls)} URLs ({counts['errors']} errors, {finished / (time.perf_counter() - started):.2f} URL/s)")
+      os.fsync(f.fileno())
+  finally:
+    await api.stop_batchers()
+    await api.close_fetcher()
+  return counts
+
+
+def main():
+  parser = argparse.ArgumentParser(description="Summarize a list of URLs into a JSONL file (resumable).")
+  parser.add_argument("urls", nargs="*", help="URLs to summarize")
+  parser.add_argument("--input", default=None, help="File with one URL per line ('-' for stdin)")
+  parser.add_argument("--output", required=True, help="JSONL results, also used as checkpoint")
+  parser.add_argument("--version", default="v1", choices=api.VERSIONS)
+  parser.add_argument("--mode", default="truncate", choices=api.MODES)
+  parser.add_argument("--cache-control", default="default", choices=api.CACHE_CONTROLS)
+  parser.add_argument("--concurrency", type=int, default=api.BATCH_CONCURRENCY, help="URLs fetched and summarized at once")
+  parser.add_argument("--retry-errors", action="store_true", help="Run again the URLs that failed in a previous run")
+  parser.add_argument("--sync-every", type=int, default=50, help="Results between two fsyncs and progress logs")
+  args = parser.parse_args()
+
+  urls = read_urls(args)
+  os.makedirs(os.path.dirname(args.output) or ".", exist_ok=True)
+  done = read_checkpoint(args.output, args.retry_errors)
+  todo = [url for url in urls if url not in done]
+  logger.info(f"{len(urls)} URLs, {len(urls) - len(todo)} already in '{args.output}', {len(todo)} to summarize.")
+  if not todo:
+    return
+  counts = asyncio.run(run(todo, args.version, args.cache_control, args.mode, args.concurrency, args.output, max(1, args.sync_every)))
+  logger.info(f"Finished : {counts['done']} summaries, {counts['errors']} errors.")
+
+
+if __name__ == "__main__":
+  main()
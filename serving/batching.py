@@ -0,0 +1,113 @@
+# Dynamic request batching for summary inference.
+# Each model version gets its own BatchScheduler: requests are queued, collected for a short
+# window (or until the batch is full) and summarized by a single batched generate call that runs
+# on a worker thread, so the event loop stays free while the model is busy.
+
+import asyncio
+import logging
+import os
+import time
+
+from metrics import BATCH_QUEUE_DEPTH, BATCH_SIZE, BATCH_WAIT_SECONDS, BATCH_INFERENCE_SECONDS
+
+logger = logging.getLogger(__name__)
+
+BATCH_MAX_SIZE = int(os.getenv("BATCH_MAX_SIZE", "8"))  # Max requests per generate call
+BATCH_MAX_WAIT_MS = float(os.getenv("BATCH_MAX_WAIT_MS", "25"))  # Max time to wait for a batch to fill
+
+
+class BatchScheduler:
+  """
+  Collect pending items and run them through `runner` in batches.
+  `runner(items)` is a blocking callable returning one result per item, in the same order.
+  """
+
+  def __init__(self, name, runner, executor=None, max_batch_size=BATCH_MAX_SIZE, max_wait_ms=BATCH_MAX_WAIT_MS):
+    self.name = name
+    self.runner = runner
+    self.executor = executor
+    self.max_batch_size = max(1, int(max_batch_size))
+    self.max_wait = max(0.0, max_wait_ms / 1000)
+    self.queue = None
+    self._task = None
+
+  def start(self):
+    """ Start the collecting loop on the running event loop. """
+    if self._task is None:
+      self.queue = asyncio.Queue()
+      self._task = asyncio.get_running_loop().create_task(self._run())
+      logger.info(f"Batch scheduler '{self.name}' started (max_batch_size={self.max_batch_size}, max_wait={self.max_wait}s).")
+
+  async def stop(self):
+    """ Stop the loop and fail every request still waiting. """
+    if self._task is None:
+      return
+    self._task.cancel()
+    try:
+      await self._task
+    except asyncio.CancelledError:
+      pass
+    self._task = None
+    while not self.queue.empty():
+      _, future, _ = self.queue.get_nowait()
+      if not future.done():
+        future.set_exception(RuntimeError("Batch scheduler stopped."))
+    BATCH_QUEUE_DEPTH.labels(self.name).set(0)
+
+  async def submit(self, item):
+    """ Queue an item and wait for its own result. """
+    if self._task is None:
+      raise RuntimeError(f"Batch scheduler '{self.name}' is not running.")
+    future = asyncio.get_running_loop().create_future()
+    self.queue.put_nowait((item, future, time.perf_counter()))
+    BATCH_QUEUE_DEPTH.labels(self.name).set(self.queue.qsize())
+    return await future
+
+  async def _collect(self):
+    """ Wait for a first item, then gather more until the batch is full or the window closes. """
+    loop = asyncio.get_running_loop()
+    batch = [await self.queue.get()]
+    deadline = loop.time() + self.max_wait
+    while len(batch) < self.max_batch_size:
+      if not self.queue.empty():
+        batch.append(self.queue.get_nowait())
+        continue
+      timeout = deadline - loop.time()
+      if timeout <= 0:
+        break
+      try:
+        batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+      except asyncio.TimeoutError:
+        break
+    BATCH_QUEUE_DEPTH.labels(self.name).set(self.queue.qsize())
+    # Requests whose client went away are dropped before inference
+    return [entry for entry in batch if not entry[1].done()]
+
+  async def _run(self):
+    loop = asyncio.get_running_loop()
+    while True:
+      batch = await self._collect()
+      if not batch:
+        continue
+      items = [item for item, _, _ in batch]
+      started = time.perf_counter()
+      for _, _, queued_at in batch:
+        BATCH_WAIT_SECONDS.labels(self.name).observe(started - queued_at)
+      BATCH_SIZE.labels(self.name).observe(len(items))
+
+      try:
+        results = await loop.run_in_executor(self.executor, self.runner, items)
+        if len(results) != len(items):
+          raise RuntimeError(f"Runner returned {len(results)} results for {len(items)} items.")
+      except Exception as e:
+        logger.error(f"Batch of {len(items)} failed on '{self.name}': {e}")
+        for _, future, _ in batch:
+          if not future.done():
+            future.set_exception(e)
+        continue
+      finally:
+        BATCH_INFERENCE_SECONDS.labels(self.name).observe(time.perf_counter() - started)
+
+      for (_, future, _), result in zip(batch, results):
+        if not future.done():
+          future.set_result(result)
@@ -0,0 +1,78 @@
+# Input budgeting : what part of a long text is given to the tokenizer and the model.
+# Token counts are estimated from the words, without tokenizing :
+# - fit_prefix : the text is cut after as many words as the model window has tokens. A word is at least one token,
+#   so truncating the prefix gives the same tokens as truncating the whole text, only the prefix is tokenized.
+# - select_sentences : the most salient sentences that fit the window are kept, in their order in the text.
+#   Sentences are scored by TF-IDF cosine similarity with the whole text (NumPy, sparse counts).
+
+import itertools
+import re
+
+import numpy as np
+
+WORD = re.compile(r"\S+")
+TERM = re.compile(r"\w+")
+SENTENCE_END = re.compile(r"(?<=[.!?])\s+")
+PREFIX_MARGIN = 8  # Extra words kept after the window, the last words are truncated by the tokenizer anyway
+SELECTION_FILL = 0.9  # Share of the window filled by the selected sentences (the token estimate is rough)
+
+
+def estimate_tokens(text):
+  """ Rough token count of a text (~4/3 token per word for the T5 and BART vocabularies). """
+  return len(text.split()) * 4 // 3
+
+
+def fit_prefix(text, window):
+  """ Text cut after its first window (+ margin) words, or the text itself if it is shorter. """
+  last = None
+  for last in itertools.islice(WORD.finditer(text), window + PREFIX_MARGIN - 1, None):
+    break
+  return text if last is None else text[:last.end()]
+
+
+def split_sentences(text):
+  return [sentence for sentence in SENTENCE_END.split(text) if sentence.strip()]
+
+
+def sentence_scores(sentences):
+  """ Cosine similarity between the TF-IDF vector of each sentence and the sum of the (normalized) sentence vectors. """
+  vocabulary = {}
+  rows, columns = [], []
+  for row, sentence in enumerate(sentences):
+    for term in TERM.findall(sentence.lower()):
+      rows.append(row)
+      columns.append(vocabulary.setdefault(term, len(vocabulary)))
+  if not columns:
+    return np.zeros(len(sentences))
+
+  # Term counts per sentence, as (sentence, term, count) triplets
+  pairs, counts = np.unique(np.array(rows, dtype=np.int64) * len(vocabulary) + np.array(columns), return_counts=True)
+  rows, columns = pairs // len(vocabulary), pairs % len(vocabulary)
+  document_frequency = np.bincount(columns, minlength=len(vocabulary))
+  idf = np.log((1 + len(sentences)) / (1 + document_frequency)) + 1
+  weights = counts * idf[columns]
+  weights /= np.sqrt(np.bincount(rows, weights ** 2, minlength=len(sentences)))[rows]
+
+  centroid = np.bincount(columns, weights, minlength=len(vocabulary))
+  return np.bincount(rows, weights * centroid[columns], minlength=len(sentences)) / np.linalg.norm(centroid)
+
+
+def select_sentences(text, window, fill=SELECTION_FILL):
+  """
+  Best scored sentences whose estimated tokens fit `fill` of the window, joined in their order in the text.
+  Falls back to fit_prefix when the text already fits or no sentence does.
+  """
+  budget = int(window * fill)
+  if estimate_tokens(text) <= budget:
+    return text
+  sentences = split_sentences(text)
+  scores = sentence_scores(sentences)
+  selected, used = [], 0
+  for index in np.argsort(-scores, kind="stable"):  # Ties : earlier sentences first
+    tokens = estimate_tokens(sentences[index])
+    if used + tokens <= budget:
+      selected.append(index)
+      used += tokens
+  if not selected:
+    return fit_prefix(text, window)
+  return " ".join(sentences[index] for index in sorted(selected))
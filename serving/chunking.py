@@ -0,0 +1,48 @@
+# Map-reduce summarization of long documents.
+# The text is split into overlapping chunks of at most `chunk_tokens` tokens, the chunks are summarized
+# together (they go through the batching queue at once), and the concatenated partial summaries are
+# summarized again until they fit in a single chunk or the max depth is reached.
+
+import asyncio
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+CHUNK_TOKENS = int(os.getenv("CHUNK_TOKENS", "480"))  # Tokens per chunk (below the 512 tokens window)
+CHUNK_OVERLAP = int(os.getenv("CHUNK_OVERLAP", "48"))  # Tokens shared by two consecutive chunks
+MAP_REDUCE_MAX_DEPTH = int(os.getenv("MAP_REDUCE_MAX_DEPTH", "3"))  # Max number of map steps
+
+
+def split_into_chunks(text, tokenizer, chunk_tokens=CHUNK_TOKENS, overlap=CHUNK_OVERLAP):
+  """
+  Split `text` into overlapping chunks of at most `chunk_tokens` tokens.
+  Returns [text] when it already fits.
+  """
+  overlap = min(overlap, chunk_tokens // 2)
+  ids = tokenizer(text, add_special_tokens=False, truncation=False, verbose=False)["input_ids"]
+  if len(ids) <= chunk_tokens:
+    return [text]
+
+  chunks = []
+  step = chunk_tokens - overlap
+  for start in range(0, len(ids), step):
+    chunks.append(tokenizer.decode(ids[start:start + chunk_tokens], skip_special_tokens=True))
+    if start + chunk_tokens >= len(ids):
+      break
+  return chunks
+
+
+async def map_reduce_summarize(text, tokenizer, summarize, chunk_tokens=CHUNK_TOKENS, overlap=CHUNK_OVERLAP, max_depth=MAP_REDUCE_MAX_DEPTH):
+  """
+  Summarize a text of any length.
+  `summarize(text)` is a coroutine returning the summary of one chunk, chunks of a same step are submitted concurrently.
+  """
+  for depth in range(max_depth + 1):
+    chunks = await asyncio.to_thread(split_into_chunks, text, tokenizer, chunk_tokens, overlap)
+    if len(chunks) == 1 or depth == max_depth:
+      # Fits in the model window (or max depth reached, the last step is truncated as in the default mode)
+      return await summarize(text)
+    logger.info(f"Map-reduce step {depth + 1}: summarizing {len(chunks)} chunks.")
+    partial_summaries = await asyncio.gather(*(summarize(chunk) for chunk in chunks))
+    text = " ".join(partial_summaries)
@@ -0,0 +1,76 @@
+# Throughput of the main content extraction (parse + extract) of each engine, on a corpus of saved HTML pages
+# (fixtures/pages by default). Pages whose file name starts with a site name (wikipedia_...) are extracted as
+# pages of that site. Reports MB/s per engine and page, and the speedup of each engine against bs4.
+#
+# python extraction_benchmark.py --repeat 50
+# python extraction_benchmark.py --corpus /data/html --engines lxml bs4 --output extraction.json
+
+import argparse
+import json
+import os
+import time
+
+import extractors
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+
+
+def load_corpus(corpus_dir):
+  """ (name, url, html) of every .html file of the corpus. """
+  pages = []
+  for file_name in sorted(os.listdir(corpus_dir)):
+    if not file_name.endswith((".html", ".htm")):
+      continue
+    with open(os.path.join(corpus_dir, file_name), encoding="utf-8", errors="replace") as f:
+      # The URL only selects the extractor, the site name in the path is enough (as with load_test's origin)
+      pages.append((file_name, f"http://127.0.0.1/{file_name}", f.read()))
+  return pages
+
+
+def benchmark(pages, engine, repeat):
+  """ Seconds spent on each page (best of `repeat` runs) and length of the extracted text. """
+  results = {}
+  for name, url, html in pages:
+    best = float("inf")
+    for _ in range(repeat):
+      start = time.perf_counter()
+      text = extractors.extract(extractors.parse(html, engine), url, engine)
+      best = min(best, time.perf_counter() - start)
+    results[name] = {"seconds": best, "mb_per_s": len(html.encode()) / best / 1e6, "text_chars": len(" ".join(text.split()))}
+  return results
+
+
+def main():
+  parser = argparse.ArgumentParser(description="Benchmark the HTML main content extraction engines.")
+  parser.add_argument("--corpus", default=os.path.join(FIXTURES_DIR, "pages"), help="Directory of .html pages")
+  parser.add_argument("--engines", nargs="+", default=extractors.ENGINES, choices=extractors.ENGINES)
+  parser.add_argument("--repeat", type=int, default=20, help="Runs per page, the best one is kept")
+  parser.add_argument("--output", default=None, help="JSON file of the results")
+  args = parser.parse_args()
+
+  pages = load_corpus(args.corpus)
+  if not pages:
+    parser.error(f"No .html page in {args.corpus}")
+  total_bytes = sum(len(html.encode()) for _, _, html in pages)
+  report = {"corpus": args.corpus, "pages": len(pages), "bytes": total_bytes, "engines": {}}
+  for engine in args.engines:
+    results = benchmark(pages, engine, args.repeat)
+    seconds = sum(result["seconds"] for result in results.values())
+    report["engines"][engine] = {"seconds": seconds, "mb_per_s": total_bytes / seconds / 1e6, "pages": results}
+
+  print(f"{len(pages)} pages, {total_bytes / 1e6:.2f} MB, best of {args.repeat} runs")
+  print(f"{'page':<40}" + "".join(f"{engine + ' MB/s':>14}{'chars':>8}" for engine in args.engines))
+  for name, _, _ in pages:
+    print(f"{name:<40}" + "".join(f"{report['engines'][engine]['pages'][name]['mb_per_s']:>14.2f}"
+                                   f"{report['engines'][engine]['pages'][name]['text_chars']:>8}" for engine in args.engines))
+  for engine, result in report["engines"].items():
+    speedup = report["engines"]["bs4"]["seconds"] / result["seconds"] if "bs4" in report["engines"] else None
+    print(f"{engine}: {result['mb_per_s']:.2f} MB/s" + (f", x{speedup:.1f} vs bs4" if speedup is not None else ""))
+
+  if args.output:
+    with open(args.output, "w") as f:
+      json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,80 @@
+# Cache of extracted page texts, shared by /summary and /feedback.
+# Pages are keyed by URL with their ETag/Last-Modified validators, so /summary can revalidate them with a
+# conditional GET (a 304 costs a round trip, no download nor parsing), and /feedback can reuse the text
+# that was summarized instead of downloading the page again.
+
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict, namedtuple
+
+EXTRACTION_CACHE_ITEMS = int(os.getenv("EXTRACTION_CACHE_ITEMS", "512"))  # Pages kept in memory
+SUMMARY_RECORDS_ITEMS = int(os.getenv("SUMMARY_RECORDS_ITEMS", "4096"))  # Summary ids kept for /feedback
+
+CachedPage = namedtuple("CachedPage", ["text", "etag", "last_modified", "fetched_at"])
+SummaryRecord = namedtuple("SummaryRecord", ["url", "text", "summary", "version"])
+
+
+class LRUDict:
+  """ Small thread-safe LRU mapping. """
+
+  def __init__(self, max_items):
+    self.max_items = max(1, int(max_items))
+    self._items = OrderedDict()
+    self._lock = threading.Lock()
+
+  def get(self, key):
+    with self._lock:
+      value = self._items.get(key)
+      if value is not None:
+        self._items.move_to_end(key)
+      return value
+
+  def put(self, key, value):
+    with self._lock:
+      self._items[key] = value
+      self._items.move_to_end(key)
+      while len(self._items) > self.max_items:
+        self._items.popitem(last=False)
+
+  def __len__(self):
+    return len(self._items)
+
+
+class ExtractionCache:
+
+  def __init__(self, max_pages=EXTRACTION_CACHE_ITEMS, max_records=SUMMARY_RECORDS_ITEMS):
+    self._pages = LRUDict(max_pages)
+    self._records = LRUDict(max_records)
+
+  def get(self, url):
+    """ Cached page for `url` or None. """
+    return self._pages.get(url)
+
+  def put(self, url, text, etag=None, last_modified=None):
+    page = CachedPage(text, etag, last_modified, time.time())
+    self._pages.put(url, page)
+    return page
+
+  @staticmethod
+  def validators(page):
+    """ Headers of a conditional GET revalidating `page` (empty if the origin gave no validator). """
+    headers = {}
+    if page is not None and page.etag:
+      headers["If-None-Match"] = page.etag
+    if page is not None and page.last_modified:
+      headers["If-Modified-Since"] = page.last_modified
+    return headers
+
+  def issue_summary_id(self, url, text, summary, version):
+    """ Remember what was summarized and return an id the client can send back with its feedback. """
+    summary_id = uuid.uuid4().hex
+    self._records.put(summary_id, SummaryRecord(url, text, summary, version))
+    return summary_id
+
+  def get_summary(self, summary_id):
+    return self._records.get(summary_id)
+
+  def stats(self):
+    return {"pages": len(self._pages), "summary_ids": len(self._records)}
@@ -0,0 +1,211 @@
+# Main content extraction of the fetched pages.
+# Extractors are registered per site (domain) and per engine :
+# - lxml (default) : C parser, comments are skipped by the parser and <script>, <style>, ... are stripped right after
+#   parsing, then the block of the page that holds the text is kept, without its boilerplate (menus, comments...).
+#   Classes and ids only lower the score of a paragraph : a wrapper of the content (class "has-sidebar") is not dropped.
+# - bs4 : the previous BeautifulSoup html.parser extraction (get_text() of the whole page for generic pages).
+# The engine is chosen with EXTRACTION_ENGINE. Pages of other sites use the generic extractor.
+#
+# text = extract(parse(html, engine), url, engine)
+# page_text(html, url) is the whole extraction of a fetched page (or YouTube transcript) as used by the API. This module
+# doesn't import the API (nor torch) : the batch extraction processes only import it.
+
+import itertools
+import logging
+import os
+import re
+from urllib.parse import urlsplit
+
+import lxml.html
+from bs4 import BeautifulSoup
+from lxml import etree
+from youtube_transcript_api import YouTubeTranscriptApi
+
+import textnorm
+from tracing import span
+
+logger = logging.getLogger(__name__)
+
+ENGINES = ["lxml", "bs4"]
+ENGINE = os.getenv("EXTRACTION_ENGINE", "lxml")
+
+# Never part of the text, stripped from the parsed page
+SKIPPED_ELEMENTS = ["script", "style", "noscript", "template", "svg"]
+BOILERPLATE_TAGS = ["nav", "header", "footer", "aside", "form", "button", "iframe", "select", "figure"]
+# Whole words of a class or id ("share-buttons", not "shared-content" or "commentary")
+BOILERPLATE_HINTS = re.compile(r"(?<![a-z0-9])(cookies?|banner|newsletter|subscribe|share|social|comments?|sidebar|menu"
+                               r"|breadcrumbs?|related|advert|ads?|promo|popup|modal|footer|header|nav)(?![a-z0-9])", re.I)
+HTML_PARSER = lxml.html.HTMLParser(remove_comments=True, remove_pis=True)
+TEXT_BLOCKS = {"p", "pre", "blockquote", "h1", "h2", "h3", "h4", "h5", "h6", "li", "td"}
+MIN_PARAGRAPH_LENGTH = 25  # Shorter paragraphs don't count to find the main block
+BOILERPLATE_WEIGHT = 0.2  # Factor of the score of a paragraph per boilerplate-looking ancestor
+WRAPPER_SHARE = 0.5  # A boilerplate-looking element holding more of the main block's text is a wrapper, it is kept
+
+_extractors = {}  # site -> (domains, {engine: function})
+
+
+def register(site, domains=(), engine="lxml"):
+  """
+  Register `function(document) -> text` as the extractor of `site` for `engine`.
+  A URL belongs to the site if its host is one of `domains` (or a subdomain), or if it contains the site name.
+  """
+  def decorator(function):
+    _extractors.setdefault(site, (tuple(domains), {}))[1][engine] = function
+    return function
+  return decorator
+
+
+def site_for(url):
+  host = (urlsplit(url).hostname or "").lower()
+  for site, (domains, _) in _extractors.items():
+    if any(host == domain or host.endswith(f".{domain}") for domain in domains):
+      return site
+  for site in _extractors:
+    if site != "generic" and site in url:
+      return site
+  return "generic"
+
+
+def parse(html, engine=ENGINE):
+  """ Parsed page (lxml element or BeautifulSoup) of `engine`. """
+  if engine == "bs4":
+    return BeautifulSoup(html, "html.parser")
+  if not html.strip():
+    return lxml.html.document_fromstring("<html></html>")
+  try:
+    document = lxml.html.document_fromstring(html, parser=HTML_PARSER)
+  except ValueError:  # str with an encoding declaration
+    document = lxml.html.document_fromstring(html.encode("utf-8", "replace"), parser=HTML_PARSER)
+  etree.strip_elements(document, *SKIPPED_ELEMENTS, with_tail=False)
+  return document
+
+
+def extract(document, url, engine=ENGINE):
+  """ Raw text (not preprocessed) of the main content of a page parsed by parse(). """
+  functions = _extractors[site_for(url)][1]
+  function = functions.get(engine) or _extractors["generic"][1][engine]
+  return function(document)
+
+
+class ExtractionError(Exception):
+  """ Page without text to summarize, status_code and detail of the HTTP error returned by the API. """
+
+  def __init__(self, status_code, detail):
+    super().__init__(detail)
+    self.status_code = status_code
+    self.detail = detail
+
+
+def page_text(html, url):
+  """ Normalized main text of a fetched page (see textnorm.py), or transcript of a YouTube video (html is None). """
+  if "youtube" in url:  # Retrieve the transcript if there is one
+    with span("extract"):
+      video_id = url.split("v=")[1]
+      try:
+        transcript = YouTubeTranscriptApi.get_transcript(video_id, languages=['en'])
+      except Exception:
+        raise ExtractionError(404, "No english transcript found for this video.")
+      paragraphs = " ".join([t['text'] for t in transcript])
+  else:
+    with span("parse"):
+      document = parse(html)
+    with span("extract"):
+      paragraphs = extract(document, url)
+    logger.debug("Text: %s", paragraphs)  # Whole article, only with LOG_LEVEL=DEBUG
+  with span("preprocess"):
+    return textnorm.normalize(paragraphs)
+
+
+def page_text_in_process(html, url):
+  """ page_text for a process pool, errors are returned as (status_code, detail). """
+  try:
+    return page_text(html, url), None
+  except ExtractionError as e:
+    return None, (e.status_code, e.detail)
+
+
+def class_selector(*classes):
+  return " and ".join(f"contains(concat(' ', normalize-space(@class), ' '), ' {name} ')" for name in classes)
+
+
+@register("generic", engine="bs4")
+def generic_bs4(soup):
+  return soup.get_text()
+
+
+@register("wikipedia", ["wikipedia.org"], engine="bs4")
+def wikipedia_bs4(soup):
+  target_div = soup.find('div', class_='mw-content-ltr mw-parser-output')
+  return " ".join([p.get_text() for p in target_div.find_all('p', recursive=False)])
+
+
+@register("wikipedia", ["wikipedia.org"])
+def wikipedia(document):
+  # Paragraphs directly under the article div (infoboxes, navboxes and references are not)
+  target_div = next(iter(document.xpath(f"//div[{class_selector('mw-content-ltr', 'mw-parser-output')}]")), None)
+  if target_div is None:
+    return generic(document)
+  return " ".join(p.text_content() for p in target_div.findall("p"))
+
+
+@register("generic")
+def generic(document):
+  """
+  Boilerplate removal : the paragraphs score their parent (and half their grandparent) by length and commas, less for
+  each ancestor that looks like boilerplate (navigation, headers, footers, forms, class/id of menus, banners,
+  comments...). The best scored block, penalized by its share of link text, is the main content. The boilerplate
+  elements inside it are then dropped, except those holding most of its text (wrappers such as "has-sidebar").
+  """
+  body = document.find("body")
+  root = body if body is not None else document
+  boilerplate = {}
+
+  def is_boilerplate(element):
+    if element not in boilerplate:
+      boilerplate[element] = isinstance(element.tag, str) and (element.tag in BOILERPLATE_TAGS or (
+        element.tag not in ("article", "main")
+        and BOILERPLATE_HINTS.search(f"{element.get('class', '')} {element.get('id', '')}") is not None))
+    return boilerplate[element]
+
+  scores = {}
+  for paragraph in root.iter("p", "pre", "blockquote"):
+    text = paragraph.text_content()
+    if len(text.strip()) < MIN_PARAGRAPH_LENGTH:
+      continue
+    parent = paragraph.getparent()
+    if parent is None:
+      continue
+    hints = sum(1 for element in itertools.chain([paragraph], paragraph.iterancestors()) if is_boilerplate(element))
+    score = (1 + text.count(",") + min(len(text) / 100, 3)) * BOILERPLATE_WEIGHT ** hints
+    scores[parent] = scores.get(parent, 0) + score
+    grandparent = parent.getparent()
+    if grandparent is not None:
+      scores[grandparent] = scores.get(grandparent, 0) + score / 2
+  if not scores:
+    return drop_boilerplate(root, is_boilerplate).text_content()
+
+  def link_density(element):
+    text_length = len(element.text_content()) or 1
+    return sum(len(link.text_content()) for link in element.iter("a")) / text_length
+
+  def nested(element):  # Inside another text block of `best`, already in its text
+    for ancestor in element.iterancestors():
+      if ancestor is best:
+        return False
+      if ancestor.tag in TEXT_BLOCKS:
+        return True
+    return False
+
+  best = max(scores, key=lambda element: scores[element] * (1 - link_density(element)))
+  drop_boilerplate(best, is_boilerplate)
+  blocks = [element.text_content() for element in best.iter(*TEXT_BLOCKS) if not nested(element)]
+  return " ".join(blocks) if blocks else best.text_content()
+
+
+def drop_boilerplate(block, is_boilerplate):
+  """ Drop the boilerplate elements inside `block`, except those holding more than half of its text. Returns block. """
+  wrapper_length = len(block.text_content()) * WRAPPER_SHARE
+  for element in [element for element in block.iterdescendants() if is_boilerplate(element)]:
+    if any(ancestor is block for ancestor in element.iterancestors()) and len(element.text_content()) <= wrapper_length:
+      element.drop_tree()
+  return block
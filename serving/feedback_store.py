@@ -0,0 +1,327 @@
+# Feedback storage.
+# Feedbacks are buffered in memory and written in batches to SQLite (WAL mode : one writer at a time, readers
+# never blocked, safe with several gunicorn workers). Article texts are stored once, keyed by their hash,
+# so the same page rated many times costs a single copy.
+# New rows are appended to the CSV read by the reporting tools (article, abstract, rating, version) after
+# each flush. The whole CSV can also be rebuilt, and an existing CSV imported (rows already in the store are skipped) :
+#
+# python feedback_store.py export --output /data/prod_data.csv
+# python feedback_store.py import --input /data/prod_data.csv
+
+import argparse
+import asyncio
+import csv
+import fcntl
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+from metrics import FEEDBACK_FLUSH_SECONDS, FEEDBACK_ROWS
+
+logger = logging.getLogger(__name__)
+
+FEEDBACK_DB_PATH = os.getenv("FEEDBACK_DB_PATH", "/data/feedback/feedback.sqlite")
+FEEDBACK_CSV_PATH = os.getenv("FEEDBACK_CSV_PATH", "/data/prod_data.csv")  # Empty = no CSV
+FEEDBACK_BATCH_SIZE = int(os.getenv("FEEDBACK_BATCH_SIZE", "64"))  # Buffered feedbacks flushed at once
+FEEDBACK_FLUSH_INTERVAL = float(os.getenv("FEEDBACK_FLUSH_INTERVAL", "1"))  # Seconds a feedback can stay buffered
+
+CSV_COLUMNS = ["article", "abstract", "rating", "version"]
+EXPORT_CHUNK_ROWS = 1000
+
+
+def article_hash(text):
+  return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def row_hash(article_hash, abstract, rating, version):
+  """ Hash of a feedback row, to recognize the rows of a CSV that are already in the store. """
+  values = [article_hash, abstract or "", "" if rating is None else str(int(rating)), version or ""]
+  return hashlib.sha256("\x00".join(values).encode("utf-8")).hexdigest()
+
+
+def parse_rating(rating):
+  """ Rating as an int (None if missing). Raises ValueError if it is not a whole number ("4", 4.0 : 4, "4.5" : error). """
+  if rating is None or rating == "":
+    return None
+  if isinstance(rating, bool) or not isinstance(rating, (int, float, str)):
+    raise ValueError(f"Invalid rating {rating!r}.")
+  try:
+    value = float(rating)
+  except ValueError:
+    raise ValueError(f"Invalid rating {rating!r}.") from None
+  if not value.is_integer():
+    raise ValueError(f"Invalid rating {rating!r}.")
+  return int(value)
+
+
+def clean_text(text):
+  return text.replace("\x00", "") if text is not None else None  # Null characters break the CSV readers
+
+
+class FeedbackStore:
+  """
+  add() only buffers the feedback, flush() writes the buffer (blocking, call it from a worker thread in async code).
+  start() flushes every FEEDBACK_FLUSH_INTERVAL seconds on the running event loop, stop() flushes what is left.
+  """
+
+  def __init__(self, path=FEEDBACK_DB_PATH, csv_path=FEEDBACK_CSV_PATH, batch_size=FEEDBACK_BATCH_SIZE,
+               flush_interval=FEEDBACK_FLUSH_INTERVAL):
+    self.path = path
+    self.csv_path = csv_path
+    self.batch_size = max(1, int(batch_size))
+    self.flush_interval = flush_interval
+    self._buffer = []
+    self._buffer_lock = threading.Lock()
+    self._db_lock = threading.Lock()
+    self._db_pid = None
+    self._connection = None
+    self._task = None
+    self._flush_now = None
+
+  @property
+  def _db(self):
+    """ SQLite connection of the current process, opened on first use (connections can't be shared with forked workers). """
+    if self._db_pid != os.getpid():
+      os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+      connection = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None, timeout=30)
+      connection.execute("PRAGMA journal_mode=WAL")
+      connection.execute("PRAGMA synchronous=NORMAL")  # WAL stays consistent, a power loss can drop the last commits
+      connection.executescript(
+        "CREATE TABLE IF NOT EXISTS articles (hash TEXT PRIMARY KEY, text TEXT NOT NULL);"
+        "CREATE TABLE IF NOT EXISTS feedback ("
+        "id INTEGER PRIMARY KEY AUTOINCREMENT, article_hash TEXT NOT NULL REFERENCES articles (hash),"
+        "abstract TEXT, rating INTEGER, version TEXT, created_at REAL NOT NULL, row_hash TEXT);"
+        "CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value INTEGER NOT NULL);"
+      )
+      if "row_hash" not in [row[1] for row in connection.execute("PRAGMA table_info(feedback)")]:
+        connection.execute("ALTER TABLE feedback ADD COLUMN row_hash TEXT")  # Store of a previous version
+      connection.execute("CREATE INDEX IF NOT EXISTS feedback_row_hash ON feedback (row_hash)")
+      self._connection, self._db_pid = connection, os.getpid()
+    return self._connection
+
+  def add(self, article, abstract, rating, version):
+    """
+    Buffer a feedback. Returns True when the buffer is full and should be flushed.
+    Raises ValueError for a feedback that can't be stored (rating that is not a whole number, texts that are not strings).
+    """
+    if not isinstance(article, str) or not all(value is None or isinstance(value, str) for value in (abstract, version)):
+      raise ValueError("article must be a string, abstract and version strings or null.")
+    row = (clean_text(article), clean_text(abstract), parse_rating(rating), version, time.time())
+    with self._buffer_lock:
+      self._buffer.append(row)
+      full = len(self._buffer) >= self.batch_size
+    if full and self._flush_now is not None:
+      self._flush_now.set()
+    return full
+
+  def flush(self):
+    """
+    Write the buffered feedbacks in one transaction, then append them to the CSV. Returns the number of rows.
+    The rows are buffered again if the database is busy or can't be written (retried by the next flush),
+    any other error is caused by the rows themselves : they are dropped, retrying would fail the same way.
+    """
+    with self._buffer_lock:
+      buffered, self._buffer = self._buffer, []
+    rows, values = [], []
+    for row in buffered:
+      article, abstract, rating, version, created_at = row
+      try:
+        key = article_hash(article)
+        values.append((key, abstract, rating, version, created_at, row_hash(key, abstract, rating, version)))
+        rows.append(row)
+      except Exception:
+        logger.exception(f"Feedback dropped, it can't be stored (abstract={abstract!r}, rating={rating!r}, version={version!r})")
+    if not rows:
+      return 0
+    started = time.perf_counter()
+    with self._db_lock:
+      db = None
+      try:
+        db = self._db
+        db.execute("BEGIN IMMEDIATE")
+        articles = {row_values[0]: row[0] for row, row_values in zip(rows, values)}
+        db.executemany("INSERT OR IGNORE INTO articles (hash, text) VALUES (?, ?)", articles.items())
+        db.executemany(
+          "INSERT INTO feedback (article_hash, abstract, rating, version, created_at, row_hash) VALUES (?, ?, ?, ?, ?, ?)",
+          values,
+        )
+        db.execute("COMMIT")
+      except Exception as e:
+        if db is not None and db.in_transaction:
+          db.execute("ROLLBACK")
+        if not isinstance(e, (sqlite3.OperationalError, OSError)):
+          logger.exception(f"{len(rows)} feedbacks dropped, they can't be stored")
+          return 0
+        with self._buffer_lock:
+          self._buffer[:0] = rows  # Kept for the next flush
+        raise
+      except BaseException:
+        if db is not None and db.in_transaction:
+          db.execute("ROLLBACK")
+        with self._buffer_lock:
+          self._buffer[:0] = rows
+        raise
+      if self.csv_path:
+        self._append_csv()
+    FEEDBACK_ROWS.inc(len(rows))
+    FEEDBACK_FLUSH_SECONDS.observe(time.perf_counter() - started)
+    return len(rows)
+
+  def export_csv(self, output_path):
+    """ Write every feedback to `output_path` in the prod_data.csv layout (replaced atomically). """
+    tmp_path = f"{output_path}.tmp"
+    with self._db_lock, open(tmp_path, "w", newline="", encoding="utf-8") as f:
+      last_id = self._write_rows(f, 0, header=True)
+      f.flush()
+      os.fsync(f.fileno())
+    os.replace(tmp_path, output_path)
+    return last_id
+
+  def import_csv(self, input_path):
+    """
+    Load an existing prod_data.csv. Its rows are already in the CSV, they are marked as exported.
+    Rows already in the store (appended by the store itself, or a previous import) are skipped : the n-th
+    occurrence of a row in the CSV is imported only if the store has fewer than n identical rows.
+    Returns the number of rows imported.
+    """
+    self.flush_without_csv()
+    self._fill_row_hashes()
+    stored, seen = {}, {}  # Per row hash : rows in the store before the import, occurrences read in the CSV
+    count = 0
+    with open(input_path, newline="", encoding="utf-8") as f:
+      for row in csv.DictReader(f):
+        rating = parse_rating(row.get("rating"))
+        article, abstract = clean_text(row["article"]), clean_text(row["abstract"])
+        key = row_hash(article_hash(article), abstract, rating, row["version"])
+        if key not in stored:
+          with self._db_lock:
+            stored[key] = self._db.execute("SELECT COUNT(*) FROM feedback WHERE row_hash = ?", (key,)).fetchone()[0]
+        seen[key] = seen.get(key, 0) + 1
+        if seen[key] <= stored[key]:
+          continue
+        self.add(article, abstract, rating, row["version"])
+        count += 1
+        if count % EXPORT_CHUNK_ROWS == 0:
+          self.flush_without_csv()
+    self.flush_without_csv()
+    with self._db_lock:
+      last_id = self._db.execute("SELECT COALESCE(MAX(id), 0) FROM feedback").fetchone()[0]
+      self._set_exported_id(last_id)
+    return count
+
+  def _fill_row_hashes(self):
+    """ Row hashes of the feedbacks written by a previous version of the store. """
+    with self._db_lock:
+      rows = self._db.execute(
+        "SELECT feedback.id, feedback.article_hash, feedback.abstract, feedback.rating, feedback.version "
+        "FROM feedback WHERE row_hash IS NULL"
+      ).fetchall()
+      self._db.execute("BEGIN IMMEDIATE")
+      self._db.executemany("UPDATE feedback SET row_hash = ? WHERE id = ?", [(row_hash(*row[1:]), row[0]) for row in rows])
+      self._db.execute("COMMIT")
+
+  def flush_without_csv(self):
+    csv_path, self.csv_path = self.csv_path, None
+    try:
+      return self.flush()
+    finally:
+      self.csv_path = csv_path
+
+  def stats(self):
+    with self._db_lock:
+      rows, articles = self._db.execute("SELECT (SELECT COUNT(*) FROM feedback), (SELECT COUNT(*) FROM articles)").fetchone()
+    return {"feedback": rows, "articles": articles, "buffered": len(self._buffer)}
+
+  async def start(self):
+    if self._task is None:
+      self._flush_now = asyncio.Event()
+      self._task = asyncio.get_running_loop().create_task(self._run())
+
+  async def stop(self):
+    if self._task is not None:
+      self._task.cancel()
+      try:
+        await self._task
+      except asyncio.CancelledError:
+        pass
+      self._task = None
+    await asyncio.to_thread(self.flush)
+
+  async def _run(self):
+    while True:
+      try:
+        await asyncio.wait_for(self._flush_now.wait(), self.flush_interval)
+      except asyncio.TimeoutError:
+        pass
+      self._flush_now.clear()
+      try:
+        await asyncio.to_thread(self.flush)
+      except Exception:
+        # Whatever the error, the loop keeps running : the rows are retried by the next flush
+        logger.exception("Feedback flush failed, retrying later")
+
+  def _append_csv(self):
+    """
+    Append the rows not exported yet to the CSV. The file lock serializes the workers, the exported id is
+    read and updated under it, so every row is appended once. Caller holds the database lock.
+    """
+    with open(self.csv_path, "a", newline="", encoding="utf-8") as f:
+      fcntl.flock(f, fcntl.LOCK_EX)
+      try:
+        exported_id = self._get_exported_id()
+        last_id = self._write_rows(f, exported_id, header=f.tell() == 0)
+        f.flush()
+        if last_id > exported_id:
+          self._set_exported_id(last_id)
+      finally:
+        fcntl.flock(f, fcntl.LOCK_UN)
+
+  def _write_rows(self, f, after_id, header=False):
+    """ Write the feedbacks with an id above `after_id` as CSV rows, returns the last id written. """
+    writer = csv.writer(f, quoting=csv.QUOTE_MINIMAL)
+    if header:
+      writer.writerow(CSV_COLUMNS)
+    last_id = after_id
+    cursor = self._db.execute(
+      "SELECT feedback.id, articles.text, feedback.abstract, feedback.rating, feedback.version "
+      "FROM feedback JOIN articles ON articles.hash = feedback.article_hash WHERE feedback.id > ? ORDER BY feedback.id",
+      (after_id,),
+    )
+    while True:
+      rows = cursor.fetchmany(EXPORT_CHUNK_ROWS)
+      if not rows:
+        return last_id
+      writer.writerows(row[1:] for row in rows)
+      last_id = rows[-1][0]
+
+  def _get_exported_id(self):
+    row = self._db.execute("SELECT value FROM meta WHERE key = 'csv_exported_id'").fetchone()
+    return row[0] if row is not None else 0
+
+  def _set_exported_id(self, value):
+    self._db.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('csv_exported_id', ?)", (value,))
+
+
+def main():
+  parser = argparse.ArgumentParser(description="Export the feedback store to CSV, or import a CSV into it.")
+  parser.add_argument("command", choices=["export", "import"])
+  parser.add_argument("--db", default=FEEDBACK_DB_PATH)
+  parser.add_argument("--output", default=FEEDBACK_CSV_PATH or "prod_data.csv", help="CSV written by export")
+  parser.add_argument("--input", default=FEEDBACK_CSV_PATH or "prod_data.csv", help="CSV read by import")
+  args = parser.parse_args()
+  logging.basicConfig(level=logging.INFO)
+
+  store = FeedbackStore(args.db, csv_path=None)
+  if args.command == "export":
+    store.export_csv(args.output)
+    logger.info(f"{store.stats()['feedback']} feedbacks exported to '{args.output}'.")
+  else:
+    count = store.import_csv(args.input)
+    logger.info(f"{count} feedbacks imported from '{args.input}' ({store.stats()}).")
+
+
+if __name__ == "__main__":
+  main()
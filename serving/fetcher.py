@@ -0,0 +1,88 @@
+# Async page fetching for the serving API.
+# One shared httpx client keeps per-host connection pools alive between requests, every download has
+# connect/read timeouts and a size cap, and concurrent fetches of the same URL share a single download.
+
+import asyncio
+import logging
+import os
+from collections import namedtuple
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+FETCH_CONNECT_TIMEOUT = float(os.getenv("FETCH_CONNECT_TIMEOUT", "5"))  # Seconds
+FETCH_READ_TIMEOUT = float(os.getenv("FETCH_READ_TIMEOUT", "15"))  # Seconds
+FETCH_MAX_BYTES = int(os.getenv("FETCH_MAX_BYTES", str(5 * 1024 * 1024)))
+FETCH_MAX_CONNECTIONS = int(os.getenv("FETCH_MAX_CONNECTIONS", "100"))
+FETCH_MAX_KEEPALIVE = int(os.getenv("FETCH_MAX_KEEPALIVE", "20"))  # Idle connections kept open, all hosts included
+
+USER_AGENT = "link-explorer/1.0"
+
+FetchResult = namedtuple("FetchResult", ["url", "status_code", "text", "headers"])
+
+
+class FetchError(Exception):
+  """ The page could not be downloaded (network error, timeout, too large). """
+
+
+class PageFetcher:
+
+  def __init__(self, connect_timeout=FETCH_CONNECT_TIMEOUT, read_timeout=FETCH_READ_TIMEOUT, max_bytes=FETCH_MAX_BYTES,
+               max_connections=FETCH_MAX_CONNECTIONS, max_keepalive=FETCH_MAX_KEEPALIVE):
+    self.timeout = httpx.Timeout(read_timeout, connect=connect_timeout)
+    self.limits = httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_keepalive)
+    self.max_bytes = max_bytes
+    self._client = None
+    self._inflight = {}  # url -> download task shared by concurrent callers
+
+  async def start(self):
+    if self._client is None:
+      self._client = httpx.AsyncClient(timeout=self.timeout, limits=self.limits, follow_redirects=True,
+                                       headers={"User-Agent": USER_AGENT})
+
+  async def close(self):
+    if self._client is not None:
+      await self._client.aclose()
+      self._client = None
+
+  async def fetch(self, url, headers=None):
+    """
+    Download `url`, joining the download already in progress for the same URL if there is one.
+    `headers` can hold conditional GET validators (If-None-Match, If-Modified-Since), a 304 is returned as is.
+    """
+    if self._client is None:
+      await self.start()
+    key = (url, tuple(sorted((headers or {}).items())))
+    task = self._inflight.get(key)
+    if task is None:
+      task = asyncio.ensure_future(self._download(url, headers))
+      self._inflight[key] = task
+      task.add_done_callback(lambda done: self._forget(key, done))
+    # A caller going away must not cancel the download for the others
+    return await asyncio.shield(task)
+
+  def _forget(self, key, task):
+    if self._inflight.get(key) is task:
+      del self._inflight[key]
+
+  async def _download(self, url, headers=None):
+    try:
+      async with self._client.stream("GET", url, headers=headers) as response:
+        declared_size = int(response.headers.get("content-length") or 0)
+        if declared_size > self.max_bytes:
+          raise FetchError(f"Page too large ({declared_size} bytes).")
+        chunks, size = [], 0
+        async for chunk in response.aiter_bytes():
+          size += len(chunk)
+          if size > self.max_bytes:
+            raise FetchError(f"Page too large (more than {self.max_bytes} bytes).")
+          chunks.append(chunk)
+        text = b"".join(chunks).decode(response.charset_encoding or "utf-8", errors="replace")
+        return FetchResult(str(response.url), response.status_code, text, response.headers)
+    except httpx.TimeoutException as e:
+      logger.warning(f"Timeout while fetching '{url}': {e}")
+      raise FetchError("Timeout while fetching the page.") from e
+    except httpx.HTTPError as e:
+      logger.warning(f"Error while fetching '{url}': {e}")
+      raise FetchError(f"Error while fetching the page: {e}") from e
@@ -0,0 +1,42 @@
+# Multi-process serving : gunicorn supervises SERVING_WORKERS uvicorn workers (restarted if they die).
+# The app is imported once in the master before forking, with the PRELOAD_VERSIONS models loaded, so the
+# workers share the read-only weight pages (copy-on-write) instead of holding one copy each.
+#
+# gunicorn -c gunicorn.conf.py api:app
+
+import gc
+import os
+
+bind = f"0.0.0.0:{os.getenv('PORT', '8080')}"
+workers = int(os.getenv("SERVING_WORKERS", "2"))
+worker_class = "uvicorn.workers.UvicornWorker"
+preload_app = True
+timeout = int(os.getenv("SERVING_TIMEOUT", "300"))  # A long YouTube summary must not get its worker killed
+graceful_timeout = 30
+
+# Intra-op threads of each worker, so that workers * threads doesn't oversubscribe the cores
+TORCH_THREADS = int(os.getenv("TORCH_THREADS", "0")) or max(1, (os.cpu_count() or 1) // workers)
+
+
+def when_ready(server):
+  # Objects allocated before the fork (the model weights) are left alone by the garbage collector,
+  # so it doesn't write to their pages and break the copy-on-write sharing
+  gc.freeze()
+  server.log.info(f"Starting {workers} workers with {TORCH_THREADS} torch threads each.")
+
+
+def post_fork(server, worker):
+  import torch
+
+  torch.set_num_threads(TORCH_THREADS)
+  try:
+    torch.set_num_interop_threads(1)
+  except RuntimeError:
+    pass  # Already set once inter-op parallelism started
+
+
+def child_exit(server, worker):
+  if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+    from prometheus_client import multiprocess
+
+    multiprocess.mark_process_dead(worker.pid)
@@ -0,0 +1,442 @@
+# Asynchronous summary jobs (POST /jobs, GET /jobs/{id}, DELETE /jobs/{id}).
+# A job answers right away with its id. The page is fetched and extracted first, then the job is queued by
+# estimated token count, so short pages don't wait behind long transcripts, and a pool of workers runs it.
+# Each client has a limit of running jobs, a finished job can be POSTed to a callback URL.
+# Jobs are kept in a JobStore (SQLite, or memory only) : GET /jobs/{id} works from every gunicorn worker.
+# A process owns its unfinished jobs through a lease it renews. When a process dies (restart, or a gunicorn worker
+# replaced), its leases expire and the jobs are claimed and run again by the live processes.
+
+import asyncio
+import itertools
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from collections import defaultdict, deque
+
+import httpx
+
+from budget import estimate_tokens
+from metrics import JOB_QUEUE_DEPTH, JOBS_FINISHED
+
+logger = logging.getLogger(__name__)
+
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "2"))  # Jobs running at once in a process
+JOB_CLIENT_CONCURRENCY = int(os.getenv("JOB_CLIENT_CONCURRENCY", "2"))  # Running jobs per client
+JOB_STORE_PATH = os.getenv("JOB_STORE_PATH", "/data/cache/jobs.sqlite")  # Empty = memory only
+JOB_RETENTION = float(os.getenv("JOB_RETENTION", str(24 * 3600)))  # Seconds a finished job is kept
+JOB_CALLBACK_TIMEOUT = float(os.getenv("JOB_CALLBACK_TIMEOUT", "10"))  # Seconds
+JOB_LEASE = float(os.getenv("JOB_LEASE", "60"))  # Seconds before the jobs of a process that stopped renewing are claimed
+JOB_PREPARE_CONCURRENCY = int(os.getenv("JOB_PREPARE_CONCURRENCY", "8"))  # Pages fetched and extracted at once
+
+FINAL_STATUSES = ("done", "failed", "cancelled")
+FINAL_PLACEHOLDERS = ", ".join("?" * len(FINAL_STATUSES))  # SQL : status IN ({FINAL_PLACEHOLDERS}), FINAL_STATUSES as parameters
+PRUNE_EVERY = 100  # Finished jobs between two clean-ups of the store
+
+
+class Job:
+  FIELDS = ["id", "client", "url", "version", "mode", "cache_control", "callback_url", "status", "priority",
+            "result", "error", "created_at", "updated_at"]
+
+  def __init__(self, url, version, mode="truncate", cache_control="default", client="anonymous", callback_url=None,
+               id=None, status="queued", priority=None, result=None, error=None, created_at=None, updated_at=None):
+    self.id = id or uuid.uuid4().hex
+    self.client = client
+    self.url = url
+    self.version = version
+    self.mode = mode
+    self.cache_control = cache_control
+    self.callback_url = callback_url
+    self.status = status  # queued, running, done, failed or cancelled
+    self.priority = priority  # Estimated token count, None until the page is extracted
+    self.result = result
+    self.error = error
+    self.created_at = created_at or time.time()
+    self.updated_at = updated_at or self.created_at
+
+  @property
+  def finished(self):
+    return self.status in FINAL_STATUSES
+
+  def to_dict(self):
+    return {field: getattr(self, field) for field in self.FIELDS}
+
+
+class MemoryJobStore:
+  """
+  Jobs of the current process, lost on restart.
+  Methods are blocking and thread-safe, call them from a worker thread in async code.
+  A finished job is never saved back as unfinished (a late "running" doesn't undo a cancellation).
+  """
+
+  def __init__(self, lease=JOB_LEASE):
+    self.lease = lease
+    self._jobs = {}  # id -> (job as a dict, owner, lease end)
+    self._lock = threading.RLock()  # Reentrant : the SQLite store falls back to these methods holding it
+
+  def save(self, job, owner=None):
+    with self._lock:
+      saved = self._jobs.get(job.id)
+      if saved is not None and saved[0]["status"] in FINAL_STATUSES:
+        return
+      self._jobs[job.id] = (job.to_dict(), owner, time.time() + self.lease)
+
+  def get(self, job_id):
+    with self._lock:
+      saved = self._jobs.get(job_id)
+    return Job(**saved[0]) if saved is not None else None
+
+  def cancel(self, job_id):
+    """ Mark a job cancelled unless it is finished, returns it (None if unknown). """
+    with self._lock:
+      saved = self._jobs.get(job_id)
+      if saved is not None and saved[0]["status"] not in FINAL_STATUSES:
+        saved[0].update(status="cancelled", updated_at=time.time())
+    return self.get(job_id)
+
+  def renew(self, owner):
+    """ Extend the lease of the unfinished jobs of `owner`. """
+    with self._lock:
+      for job_id, (data, job_owner, _) in self._jobs.items():
+        if job_owner == owner and data["status"] not in FINAL_STATUSES:
+          self._jobs[job_id] = (data, owner, time.time() + self.lease)
+
+  def claim_unfinished(self, owner):
+    """ Take the unfinished jobs whose lease expired (their process is gone), each job is claimed by a single process. """
+    with self._lock:
+      now = time.time()
+      claimed = [job_id for job_id, (data, job_owner, lease_until) in self._jobs.items()
+                 if data["status"] not in FINAL_STATUSES and (job_owner is None or lease_until < now)]
+      for job_id in claimed:
+        self._jobs[job_id] = (dict(self._jobs[job_id][0], status="queued"), owner, now + self.lease)
+      return [Job(**self._jobs[job_id][0]) for job_id in claimed]
+
+  def prune(self, before):
+    """ Drop the jobs finished before `before`. """
+    with self._lock:
+      for job_id in [job_id for job_id, (data, _, _) in self._jobs.items()
+                     if data["status"] in FINAL_STATUSES and data["updated_at"] < before]:
+        del self._jobs[job_id]
+
+
+class SQLiteJobStore(MemoryJobStore):
+  """ Jobs shared by the worker processes and kept across restarts. Falls back to memory if the file can't be opened. """
+
+  def __init__(self, path=JOB_STORE_PATH, lease=JOB_LEASE):
+    super().__init__(lease)
+    self.path = path
+    self._db_pid = None
+    self._connection = None
+
+  @property
+  def _db(self):
+    """ SQLite connection of the current process, opened on first use (connections can't be shared with forked workers). """
+    if self._db_pid != os.getpid():
+      self._db_pid = os.getpid()
+      self._connection = None
+      try:
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        self._connection = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None, timeout=10)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute(
+          "CREATE TABLE IF NOT EXISTS jobs ("
+          "id TEXT PRIMARY KEY, client TEXT, url TEXT, version TEXT, mode TEXT, cache_control TEXT, callback_url TEXT,"
+          "status TEXT NOT NULL, priority INTEGER, result TEXT, error TEXT, owner TEXT, lease_until REAL,"
+          "created_at REAL NOT NULL, updated_at REAL NOT NULL)"
+        )
+        if "lease_until" not in [row[1] for row in self._connection.execute("PRAGMA table_info(jobs)")]:
+          self._connection.execute("ALTER TABLE jobs ADD COLUMN lease_until REAL")  # Store of a previous version
+        self._connection.execute("CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, owner)")
+      except (sqlite3.Error, OSError) as e:
+        logger.error(f"Job store unavailable at '{self.path}', jobs are kept in memory only: {e}")
+        self._connection = None
+    return self._connection
+
+  def save(self, job, owner=None):
+    with self._lock:
+      if self._db is None:
+        return super().save(job, owner)
+      data = job.to_dict()
+      data.update(result=json.dumps(job.result) if job.result is not None else None, owner=owner,
+                  lease_until=time.time() + self.lease)
+      columns = Job.FIELDS + ["owner", "lease_until"]
+      self._db.execute(
+        f"INSERT INTO jobs ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))}) "
+        f"ON CONFLICT (id) DO UPDATE SET {', '.join(f'{column} = excluded.{column}' for column in columns[1:])} "
+        f"WHERE jobs.status NOT IN ({FINAL_PLACEHOLDERS})",
+        [data[column] for column in columns] + list(FINAL_STATUSES),
+      )
+
+  def get(self, job_id):
+    with self._lock:
+      if self._db is None:
+        return super().get(job_id)
+      row = self._db.execute(f"SELECT {', '.join(Job.FIELDS)} FROM jobs WHERE id = ?", (job_id,)).fetchone()
+    return self._job(row) if row is not None else None
+
+  def cancel(self, job_id):
+    with self._lock:
+      if self._db is None:
+        return super().cancel(job_id)
+      self._db.execute(
+        f"UPDATE jobs SET status = 'cancelled', updated_at = ? WHERE id = ? AND status NOT IN ({FINAL_PLACEHOLDERS})",
+        (time.time(), job_id, *FINAL_STATUSES),
+      )
+    return self.get(job_id)
+
+  def renew(self, owner):
+    with self._lock:
+      if self._db is None:
+        return super().renew(owner)
+      self._db.execute(
+        f"UPDATE jobs SET lease_until = ? WHERE owner = ? AND status NOT IN ({FINAL_PLACEHOLDERS})",
+        (time.time() + self.lease, owner, *FINAL_STATUSES),
+      )
+
+  def claim_unfinished(self, owner):
+    with self._lock:
+      if self._db is None:
+        return super().claim_unfinished(owner)
+      now = time.time()
+      # A single transaction : concurrent workers never claim the same job, and only the jobs claimed now are returned
+      self._db.execute("BEGIN IMMEDIATE")
+      try:
+        rows = self._db.execute(
+          f"SELECT {', '.join(Job.FIELDS)} FROM jobs WHERE status NOT IN ({FINAL_PLACEHOLDERS}) "
+          f"AND (owner IS NULL OR lease_until IS NULL OR lease_until < ?)",
+          (*FINAL_STATUSES, now),
+        ).fetchall()
+        self._db.executemany(
+          "UPDATE jobs SET status = 'queued', owner = ?, lease_until = ? WHERE id = ?",
+          [(owner, now + self.lease, row[0]) for row in rows],
+        )
+        self._db.execute("COMMIT")
+      except BaseException:
+        self._db.execute("ROLLBACK")
+        raise
+    jobs = [self._job(row) for row in rows]
+    for job in jobs:
+      job.status = "queued"
+    return jobs
+
+  def prune(self, before):
+    with self._lock:
+      if self._db is None:
+        return super().prune(before)
+      self._db.execute(f"DELETE FROM jobs WHERE status IN ({FINAL_PLACEHOLDERS}) AND updated_at < ?", (*FINAL_STATUSES, before))
+
+  @staticmethod
+  def _job(row):
+    data = dict(zip(Job.FIELDS, row))
+    data["result"] = json.loads(data["result"]) if data["result"] is not None else None
+    return Job(**data)
+
+
+def make_job_store(path=JOB_STORE_PATH):
+  return SQLiteJobStore(path) if path else MemoryJobStore()
+
+
+class JobQueue:
+  """
+  Run jobs with a pool of workers, shortest first.
+  `prepare(job)` is a coroutine returning the text to summarize (fetch + extraction),
+  `runner(job, text)` is a coroutine returning the result of the job.
+  """
+
+  def __init__(self, prepare, runner, store, workers=JOB_WORKERS, client_concurrency=JOB_CLIENT_CONCURRENCY,
+               retention=JOB_RETENTION, callback_timeout=JOB_CALLBACK_TIMEOUT, prepare_concurrency=JOB_PREPARE_CONCURRENCY):
+    self.prepare = prepare
+    self.runner = runner
+    self.store = store
+    self.workers = max(1, int(workers))
+    self.client_concurrency = max(1, int(client_concurrency))
+    self.retention = retention
+    self.callback_timeout = callback_timeout
+    self.prepare_concurrency = max(1, int(prepare_concurrency))
+    self.owner = uuid.uuid4().hex  # Identifies this process in the store
+    self.queue = None
+    self._prepare_slots = None  # Semaphore bounding the jobs fetched and extracted at once
+    self._jobs = {}  # id -> Job, unfinished jobs of this process
+    self._tasks = {}  # id -> task preparing or running the job
+    self._running = defaultdict(int)  # client -> running jobs
+    self._deferred = defaultdict(deque)  # client -> queue entries waiting for a free slot of the client
+    self._sequence = itertools.count()  # FIFO order between jobs of the same priority
+    self._finished = 0
+    self._workers = []
+    self._heartbeat = None
+    self._client = None
+
+  async def start(self):
+    """
+    Start the workers on the running event loop. The lease of the jobs of this process is renewed in background,
+    and the jobs whose lease expired (left by a previous run or a dead worker) are taken over.
+    """
+    if self._workers:
+      return
+    self.queue = asyncio.PriorityQueue()
+    self._prepare_slots = asyncio.Semaphore(self.prepare_concurrency)
+    self._client = httpx.AsyncClient(timeout=self.callback_timeout)
+    self._workers = [asyncio.get_running_loop().create_task(self._work()) for _ in range(self.workers)]
+    await asyncio.to_thread(self.store.prune, time.time() - self.retention)
+    recovered = await self._claim()
+    self._heartbeat = asyncio.get_running_loop().create_task(self._renew_leases())
+    logger.info(f"Job queue started ({self.workers} workers, {recovered} jobs recovered).")
+
+  async def stop(self):
+    """ Stop the workers. Unfinished jobs stay in the store and are claimed once their lease expires. """
+    tasks = self._workers + list(self._tasks.values()) + ([self._heartbeat] if self._heartbeat else [])
+    for task in tasks:
+      task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    self._workers, self._tasks, self._heartbeat = [], {}, None
+    if self._client is not None:
+      await self._client.aclose()
+      self._client = None
+    JOB_QUEUE_DEPTH.set(0)
+
+  async def submit(self, job):
+    """ Save and schedule a new job, returns at once. """
+    await asyncio.to_thread(self.store.save, job, self.owner)
+    self._schedule(job)
+    return job
+
+  async def get(self, job_id):
+    job = self._jobs.get(job_id)
+    return job if job is not None else await asyncio.to_thread(self.store.get, job_id)
+
+  async def cancel(self, job_id):
+    """
+    Cancel a queued or running job, returns it (None if unknown).
+    A job running in another worker process is only cancelled if it hasn't started yet.
+    """
+    job = self._jobs.get(job_id)
+    if job is None:
+      return await asyncio.to_thread(self.store.cancel, job_id)
+    job.status = "cancelled"
+    task = self._tasks.get(job_id)
+    if task is not None:
+      task.cancel()  # The preparing or running task finishes the job
+    else:
+      await self._finish(job)  # Queued, the worker will skip it
+    return job
+
+  async def _claim(self):
+    """ Schedule the unfinished jobs whose lease expired, returns their number. """
+    claimed = [job for job in await asyncio.to_thread(self.store.claim_unfinished, self.owner) if job.id not in self._jobs]
+    for job in claimed:
+      self._schedule(job)
+    return len(claimed)
+
+  async def _renew_leases(self):
+    while True:
+      await asyncio.sleep(self.store.lease / 3)
+      try:
+        await asyncio.to_thread(self.store.renew, self.owner)
+        recovered = await self._claim()
+        if recovered:
+          logger.info(f"{recovered} jobs of a stopped process recovered.")
+      except Exception as e:
+        logger.error(f"Job lease renewal failed: {e}")
+
+  def _schedule(self, job):
+    self._jobs[job.id] = job
+    task = asyncio.get_running_loop().create_task(self._prepare(job))
+    self._tasks[job.id] = task
+
+  async def _prepare(self, job):
+    """ Extract the page and queue the job by estimated token count. """
+    try:
+      async with self._prepare_slots:
+        text = await self.prepare(job)
+    except asyncio.CancelledError:
+      self._tasks.pop(job.id, None)
+      if job.status == "cancelled":
+        await self._finish(job)
+      raise
+    except Exception as e:
+      self._tasks.pop(job.id, None)
+      job.status, job.error = "failed", getattr(e, "detail", None) or str(e) or type(e).__name__
+      await self._finish(job)
+      return
+    self._tasks.pop(job.id, None)
+    job.priority = estimate_tokens(text)
+    self.queue.put_nowait((job.priority, next(self._sequence), job.id, text))
+    JOB_QUEUE_DEPTH.set(self.queue.qsize())
+
+  async def _work(self):
+    while True:
+      entry = await self.queue.get()
+      JOB_QUEUE_DEPTH.set(self.queue.qsize())
+      job = self._jobs.get(entry[2])
+      if job is None or job.finished:
+        continue
+      if self._running[job.client] >= self.client_concurrency:
+        self._deferred[job.client].append(entry)
+        continue
+      # The job may have been cancelled through another worker process
+      saved = await asyncio.to_thread(self.store.get, job.id)
+      if job.finished:
+        continue  # Cancelled in this process while the store was read, already finished
+      if saved is not None and saved.status == "cancelled":
+        job.status = "cancelled"
+        await self._finish(job)
+        continue
+      await self._run(job, entry[3])
+
+  async def _run(self, job, text):
+    self._running[job.client] += 1
+    job.status, job.updated_at = "running", time.time()
+    # The task is registered before anything is awaited, a cancellation always goes through it
+    task = asyncio.ensure_future(self._execute(job, text))
+    self._tasks[job.id] = task
+    try:
+      job.result, job.status = await task, "done"
+    except asyncio.CancelledError:
+      if job.status != "cancelled":
+        raise  # The queue is stopping, the job is recovered on the next start
+    except Exception as e:
+      logger.error(f"Job {job.id} failed: {e}")
+      job.status, job.error = "failed", getattr(e, "detail", None) or str(e) or type(e).__name__
+    finally:
+      self._tasks.pop(job.id, None)
+      self._running[job.client] -= 1
+      # A job of the same client was waiting for this slot, the entries of the jobs cancelled meanwhile are dropped
+      deferred = self._deferred[job.client]
+      while deferred:
+        entry = deferred.popleft()
+        waiting = self._jobs.get(entry[2])
+        if waiting is not None and not waiting.finished:
+          self.queue.put_nowait(entry)
+          break
+      if not deferred:
+        del self._deferred[job.client]
+      if not self._running[job.client]:
+        del self._running[job.client]
+    await self._finish(job)
+
+  async def _execute(self, job, text):
+    await asyncio.to_thread(self.store.save, job, self.owner)
+    return await self.runner(job, text)
+
+  async def _finish(self, job):
+    if self._jobs.pop(job.id, None) is None:
+      return  # Already finished
+    job.updated_at = time.time()
+    await asyncio.to_thread(self.store.save, job, self.owner)
+    JOBS_FINISHED.labels(job.status).inc()
+    self._finished += 1
+    if self._finished % PRUNE_EVERY == 0:
+      await asyncio.to_thread(self.store.prune, time.time() - self.retention)
+    if job.callback_url:
+      await self._notify(job)
+
+  async def _notify(self, job):
+    """ POST the finished job to its callback URL (errors are only logged). """
+    try:
+      response = await self._client.post(job.callback_url, json=job.to_dict())
+      response.raise_for_status()
+    except httpx.HTTPError as e:
+      logger.warning(f"Callback of job {job.id} to '{job.callback_url}' failed: {e}")
@@ -0,0 +1,244 @@
+# Load test and latency benchmark of the serving API.
+# The FastAPI app runs in-process against a local stand-in origin serving the canned pages of fixtures/pages,
+# and YouTube transcripts come from fixtures/transcript.json instead of the YouTube API.
+# Results are written as JSON (configuration + per-version summary) and CSV (one row per request), with the
+# time spent in each stage (fetch, parse, extract, preprocess, select, queue, tokenize, generate, decode) taken from the Server-Timing header.
+#
+# python load_test.py --concurrency 8 --requests 200 --versions v1=3,v3=1 --sources wikipedia=2,generic=1,youtube=1 --output results/run1
+# python load_test.py ... --output results/run2 --baseline results/run1.json
+
+import argparse
+import asyncio
+import csv
+import json
+import os
+import random
+import socket
+import statistics
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import httpx
+import uvicorn
+
+import api
+import extractors
+from tracing import parse_server_timing
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+SOURCES = ["wikipedia", "generic", "youtube"]
+STAGES = ["fetch", "parse", "extract", "preprocess", "select", "queue", "model_load", "tokenize", "generate", "decode"]
+
+
+def parse_mix(value, allowed):
+  """ "v1=3,v3=1" -> {"v1": 3.0, "v3": 1.0} """
+  mix = {}
+  for item in filter(None, (part.strip() for part in value.split(","))):
+    name, _, weight = item.partition("=")
+    if name not in allowed:
+      raise argparse.ArgumentTypeError(f"'{name}' is not one of {allowed}")
+    mix[name] = float(weight or 1)
+  return mix
+
+
+def free_port():
+  with socket.socket() as s:
+    s.bind(("127.0.0.1", 0))
+    return s.getsockname()[1]
+
+
+def start_origin(delay=0.0):
+  """ Stand-in HTTP server returning the canned pages of fixtures/pages. """
+  pages = {}
+  pages_dir = os.path.join(FIXTURES_DIR, "pages")
+  for file_name in sorted(os.listdir(pages_dir)):
+    with open(os.path.join(pages_dir, file_name), "rb") as f:
+      pages[file_name] = f.read()
+
+  class OriginHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+      body = pages.get(self.path.split("?")[0].lstrip("/"))
+      if delay:
+        time.sleep(delay)
+      if body is None:
+        self.send_error(404)
+        return
+      self.send_response(200)
+      self.send_header("Content-Type", "text/html; charset=utf-8")
+      self.send_header("Content-Length", str(len(body)))
+      self.end_headers()
+      self.wfile.write(body)
+
+    def log_message(self, *args):
+      pass
+
+  server = ThreadingHTTPServer(("127.0.0.1", free_port()), OriginHandler)
+  threading.Thread(target=server.serve_forever, daemon=True).start()
+  return server, sorted(pages)
+
+
+def stub_transcripts(delay=0.0):
+  """ Replace the YouTube API used by the extractor with the canned transcript. """
+  with open(os.path.join(FIXTURES_DIR, "transcript.json")) as f:
+    transcript = json.load(f)
+
+  class StubTranscriptApi:
+    @staticmethod
+    def get_transcript(video_id, languages=None):
+      if delay:
+        time.sleep(delay)
+      return transcript
+
+  extractors.YouTubeTranscriptApi = StubTranscriptApi
+
+
+def start_app():
+  """ Run the FastAPI app with uvicorn in a background thread. """
+  port = free_port()
+  server = uvicorn.Server(uvicorn.Config(api.app, host="127.0.0.1", port=port, log_level="warning"))
+  server.install_signal_handlers = lambda: None  # Not the main thread
+  threading.Thread(target=server.run, daemon=True).start()
+  while not server.started:
+    time.sleep(0.1)
+  return server, f"http://127.0.0.1:{port}"
+
+
+def build_plan(n, versions, sources, origin_url, page_names, unique_urls, seed):
+  """ List of (version, source, url) requests following the version and source mixes. """
+  rng = random.Random(seed)
+  pages_by_source = {source: [name for name in page_names if name.startswith(source)] for source in SOURCES}
+  plan = []
+  for i in range(n):
+    version = rng.choices(list(versions), weights=list(versions.values()))[0]
+    source = rng.choices(list(sources), weights=list(sources.values()))[0]
+    # A unique query string defeats the extraction cache, so every request fetches and parses its page
+    suffix = str(i) if unique_urls else "0"
+    if source == "youtube":
+      url = f"{origin_url}/youtube/watch?v=bench{suffix}"
+    else:
+      url = f"{origin_url}/{rng.choice(pages_by_source[source])}?n={suffix}"
+    plan.append((version, source, url))
+  return plan
+
+
+async def run_requests(app_url, plan, concurrency, mode, cache_control, timeout):
+  semaphore = asyncio.Semaphore(concurrency)
+  async with httpx.AsyncClient(timeout=timeout) as client:
+
+    async def one(i, version, source, url):
+      async with semaphore:
+        started = time.perf_counter()
+        try:
+          response = await client.post(f"{app_url}/summary", params={"url": url, "version": version, "mode": mode, "cache_control": cache_control})
+          status, timings = response.status_code, parse_server_timing(response.headers.get("server-timing"))
+          error = None if status == 200 else response.text[:200]
+        except httpx.HTTPError as e:
+          status, timings, error = 0, {}, str(e) or type(e).__name__
+        row = {"id": i, "version": version, "source": source, "status": status, "latency": time.perf_counter() - started, "error": error}
+        row.update({stage: timings.get(stage, 0.0) for stage in STAGES})
+        return row
+
+    started = time.perf_counter()
+    rows = await asyncio.gather(*(one(i, *request) for i, request in enumerate(plan)))
+    return rows, time.perf_counter() - started
+
+
+def percentile(values, q):
+  """ Nearest-rank percentile. """
+  ordered = sorted(values)
+  return ordered[max(0, min(len(ordered) - 1, round(q / 100 * len(ordered)) - 1))]
+
+
+def summarize(rows, wall_time):
+  summary = {}
+  groups = {"all": rows}
+  for row in rows:
+    groups.setdefault(row["version"], []).append(row)
+  for name, group in sorted(groups.items()):
+    ok = [row for row in group if row["status"] == 200]
+    latencies = [row["latency"] for row in ok]
+    summary[name] = {
+      "requests": len(group),
+      "errors": len(group) - len(ok),
+      "throughput_rps": len(ok) / wall_time if wall_time else 0.0,
+      "latency": {
+        "mean": statistics.mean(latencies),
+        "p50": percentile(latencies, 50),
+        "p95": percentile(latencies, 95),
+        "p99": percentile(latencies, 99),
+      } if latencies else None,
+      "stages_mean": {stage: statistics.mean(row[stage] for row in ok) for stage in STAGES} if ok else None,
+    }
+  return summary
+
+
+def print_summary(summary, baseline=None):
+  for name, stats in summary.items():
+    line = f"{name:>4}: {stats['requests']} requests, {stats['errors']} errors, {stats['throughput_rps']:.2f} req/s"
+    if stats["latency"]:
+      latency = stats["latency"]
+      line += f", p50={latency['p50']:.2f}s p95={latency['p95']:.2f}s p99={latency['p99']:.2f}s"
+      previous = (baseline or {}).get(name) or {}
+      if previous.get("latency"):
+        line += f" (p95 {latency['p95'] - previous['latency']['p95']:+.2f}s vs baseline)"
+      line += " | " + " ".join(f"{stage}={seconds:.3f}s" for stage, seconds in stats["stages_mean"].items())
+    print(line)
+
+
+def main():
+  parser = argparse.ArgumentParser(description="Load test of the serving API against canned pages.")
+  parser.add_argument("--requests", type=int, default=50, help="Number of measured requests")
+  parser.add_argument("--concurrency", type=int, default=4)
+  parser.add_argument("--versions", type=lambda v: parse_mix(v, api.VERSIONS), default="v1=1", help="Version mix, e.g. v1=3,v3=1")
+  parser.add_argument("--sources", type=lambda v: parse_mix(v, SOURCES), default="wikipedia=1,generic=1,youtube=1", help="Page mix")
+  parser.add_argument("--mode", default="truncate", choices=api.MODES)
+  parser.add_argument("--cache", action="store_true", help="Let caches serve repeated pages (disabled by default)")
+  parser.add_argument("--warmup", type=int, default=1, help="Unmeasured requests per version (model loading)")
+  parser.add_argument("--origin-delay", type=float, default=0.0, help="Simulated origin latency, in seconds")
+  parser.add_argument("--transcript-delay", type=float, default=0.0, help="Simulated YouTube API latency, in seconds")
+  parser.add_argument("--timeout", type=float, default=600.0)
+  parser.add_argument("--seed", type=int, default=0)
+  parser.add_argument("--output", default=None, help="Path prefix of the .json and .csv results")
+  parser.add_argument("--baseline", default=None, help="JSON results of a previous run to compare with")
+  args = parser.parse_args()
+  versions, sources = args.versions, args.sources
+
+  origin, page_names = start_origin(args.origin_delay)
+  origin_url = f"http://127.0.0.1:{origin.server_address[1]}"
+  stub_transcripts(args.transcript_delay)
+  app_server, app_url = start_app()
+  cache_control = "default" if args.cache else "no-store"
+
+  try:
+    warmup_page = next(name for name in page_names if name.startswith("wikipedia"))
+    warmup = [(version, "wikipedia", f"{origin_url}/{warmup_page}?warmup") for version in versions for _ in range(args.warmup)]
+    asyncio.run(run_requests(app_url, warmup, 1, args.mode, cache_control, args.timeout))
+
+    plan = build_plan(args.requests, versions, sources, origin_url, page_names, not args.cache, args.seed)
+    rows, wall_time = asyncio.run(run_requests(app_url, plan, args.concurrency, args.mode, cache_control, args.timeout))
+  finally:
+    app_server.should_exit = True
+    origin.shutdown()
+
+  summary = summarize(rows, wall_time)
+  baseline = None
+  if args.baseline:
+    with open(args.baseline) as f:
+      baseline = json.load(f)["summary"]
+  print_summary(summary, baseline)
+
+  if args.output:
+    os.makedirs(os.path.dirname(args.output) or ".", exist_ok=True)
+    config = {key: value for key, value in vars(args).items() if key not in ("output", "baseline")}
+    config.update(versions=versions, sources=sources, wall_time=wall_time)
+    with open(f"{args.output}.json", "w") as f:
+      json.dump({"config": config, "summary": summary}, f, indent=2)
+    with open(f"{args.output}.csv", "w", newline="") as f:
+      writer = csv.DictWriter(f, fieldnames=list(rows[0].keys()))
+      writer.writeheader()
+      writer.writerows(rows)
+
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,164 @@
+# Prometheus metrics shared by the serving API.
+# Everything is registered on the default registry and exposed by api.py at /metrics.
+# With several workers (gunicorn.conf.py), set PROMETHEUS_MULTIPROC_DIR so /metrics aggregates all of them.
+
+import os
+
+from prometheus_client import CollectorRegistry, Counter, Gauge, Histogram, make_asgi_app, multiprocess
+
+
+def make_metrics_app():
+  """ ASGI app serving the metrics of this process, or of all workers in multiprocess mode. """
+  if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+    registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(registry)
+    return make_asgi_app(registry=registry)
+  return make_asgi_app()
+
+
+BATCH_QUEUE_DEPTH = Gauge(
+  "summary_batch_queue_depth",
+  "Number of summary requests waiting in the batching queue.",
+  ["version"],
+)
+
+BATCH_SIZE = Histogram(
+  "summary_batch_size",
+  "Number of requests sent to a single generate call.",
+  ["version"],
+  buckets=(1, 2, 3, 4, 6, 8, 12, 16, 24, 32),
+)
+
+BATCH_WAIT_SECONDS = Histogram(
+  "summary_batch_wait_seconds",
+  "Time spent by a request in the batching queue before inference starts.",
+  ["version"],
+)
+
+BATCH_INFERENCE_SECONDS = Histogram(
+  "summary_batch_inference_seconds",
+  "Duration of one batched generate call.",
+  ["version"],
+  buckets=(0.5, 1, 2.5, 5, 10, 20, 40, 60, 120, 240),
+)
+
+MODEL_LOADS = Counter(
+  "model_loads_total",
+  "Number of times a model version was loaded in memory.",
+  ["version"],
+)
+
+MODEL_LOAD_SECONDS = Histogram(
+  "model_load_seconds",
+  "Time to load a model version.",
+  ["version"],
+  buckets=(1, 2.5, 5, 10, 20, 40, 80, 160, 320),
+)
+
+MODEL_EVICTIONS = Counter(
+  "model_evictions_total",
+  "Number of times a model version was evicted from memory.",
+  ["version"],
+)
+
+MODELS_LOADED = Gauge(
+  "models_loaded",
+  "Number of model versions currently in memory.",
+)
+
+MODELS_MEMORY_BYTES = Gauge(
+  "models_memory_bytes",
+  "Estimated memory used by the loaded model weights.",
+)
+
+SUMMARY_CACHE_REQUESTS = Counter(
+  "summary_cache_requests_total",
+  "Summary cache lookups, by tier (memory, disk, all) and result (hit, miss).",
+  ["tier", "result"],
+)
+
+SUMMARY_CACHE_EVICTIONS = Counter(
+  "summary_cache_evictions_total",
+  "Summary cache entries evicted by TTL or size limit.",
+  ["tier"],
+)
+
+EXTRACTION_CACHE_REQUESTS = Counter(
+  "extraction_cache_requests_total",
+  "Extracted text lookups : hit (no network), revalidated (304), miss (downloaded and parsed).",
+  ["result"],
+)
+
+SUMMARY_TTFT_SECONDS = Histogram(
+  "summary_time_to_first_token_seconds",
+  "Time between a /summary/stream request and its first streamed token.",
+  ["version"],
+  buckets=(0.1, 0.25, 0.5, 1, 2, 4, 8, 16, 32, 64),
+)
+
+STAGE_SECONDS = Histogram(
+  "request_stage_seconds",
+  "Time spent in each stage of a request (fetch, parse, extract, preprocess, tokenize, generate, decode, save_feedback, ...).",
+  ["stage", "version", "source"],
+  buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 40, 80),
+)
+
+INPUT_TOKENS = Histogram(
+  "summary_input_tokens",
+  "Number of tokens given to the model per text (after truncation).",
+  ["version"],
+  buckets=(16, 32, 64, 128, 256, 384, 512, 768, 1024, 2048, 4096),
+)
+
+OUTPUT_TOKENS = Histogram(
+  "summary_output_tokens",
+  "Number of tokens generated per summary.",
+  ["version"],
+  buckets=(8, 16, 32, 64, 100, 150, 200, 300, 400, 500),
+)
+
+SUMMARY_INPUTS = Counter(
+  "summary_inputs_total",
+  "Texts given to the model, by whether they were truncated to the model window (truncation rate = truncated / all).",
+  ["version", "truncated"],
+)
+
+JOB_QUEUE_DEPTH = Gauge(
+  "summary_job_queue_depth",
+  "Number of extracted summary jobs waiting for a worker.",
+)
+
+JOBS_FINISHED = Counter(
+  "summary_jobs_finished_total",
+  "Summary jobs finished, by final status (done, failed, cancelled).",
+  ["status"],
+)
+
+FEEDBACK_ROWS = Counter(
+  "feedback_rows_total",
+  "Feedbacks written to the feedback store.",
+)
+
+FEEDBACK_FLUSH_SECONDS = Histogram(
+  "feedback_flush_seconds",
+  "Time to write a batch of buffered feedbacks (SQLite transaction + CSV append).",
+)
+
+
+def observe_trace(trace, labels):
+  """ Export the stage timings of a finished request. """
+  version, source = labels.get("version", "none"), labels.get("source", "none")
+  for stage, seconds in trace.items():
+    STAGE_SECONDS.labels(stage, version, source).observe(seconds)
+
+
+def observe_tokens(version, input_lengths, output_lengths, max_input_length=None):
+  """
+  Token counts of a batch. input_lengths are counted before truncation to max_input_length, None when the inputs
+  are not truncated nor counted (v1 pipeline). An input truncated is longer than the window, not just as long.
+  """
+  for output_length in output_lengths:
+    OUTPUT_TOKENS.labels(version).observe(output_length)
+  for input_length in input_lengths or []:
+    INPUT_TOKENS.labels(version).observe(min(input_length, max_input_length))
+    SUMMARY_INPUTS.labels(version, str(input_length > max_input_length).lower()).inc()
@@ -0,0 +1,111 @@
+# Lazy model registry for the serving API.
+# A version is loaded the first time it is requested, and only the most recently used versions
+# are kept in memory (bounded by a count and a memory budget). Least recently used versions are evicted.
+
+import gc
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from metrics import MODEL_LOADS, MODEL_LOAD_SECONDS, MODEL_EVICTIONS, MODELS_LOADED, MODELS_MEMORY_BYTES
+
+logger = logging.getLogger(__name__)
+
+MODEL_CACHE_SIZE = int(os.getenv("MODEL_CACHE_SIZE", "2"))  # Max versions kept in memory
+MODEL_MEMORY_BUDGET_MB = float(os.getenv("MODEL_MEMORY_BUDGET_MB", "0"))  # 0 = no memory budget
+
+
+class ModelRegistry:
+  """
+  Load models on demand and keep the N most recently used ones.
+  - `loader(version)` returns whatever the inference code needs for that version (pipeline, (model, tokenizer), ...)
+  - `size_of(entry)` returns the memory used by a loaded entry, in bytes
+  """
+
+  def __init__(self, loader, size_of, max_loaded=MODEL_CACHE_SIZE, memory_budget_mb=MODEL_MEMORY_BUDGET_MB):
+    self.loader = loader
+    self.size_of = size_of
+    self.max_loaded = max(1, int(max_loaded))
+    self.memory_budget = int(memory_budget_mb * 1024 * 1024)
+    self._entries = OrderedDict()  # version -> (entry, size in bytes), oldest first
+    self._lock = threading.Lock()
+    self._load_locks = {}
+
+  def get(self, version):
+    """ Return the loaded entry for `version`, loading it (blocking) if needed. """
+    with self._lock:
+      if version in self._entries:
+        self._entries.move_to_end(version)
+        return self._entries[version][0]
+      load_lock = self._load_locks.setdefault(version, threading.Lock())
+
+    # Only one thread loads a given version, other versions can load in parallel
+    with load_lock:
+      with self._lock:
+        if version in self._entries:
+          self._entries.move_to_end(version)
+          return self._entries[version][0]
+
+      logger.info(f"Loading model version '{version}'...")
+      started = time.perf_counter()
+      entry = self.loader(version)
+      size = self.size_of(entry)
+      MODEL_LOADS.labels(version).inc()
+      MODEL_LOAD_SECONDS.labels(version).observe(time.perf_counter() - started)
+      logger.info(f"Model version '{version}' loaded in {time.perf_counter() - started:.1f}s ({size / 1024 / 1024:.0f} MB).")
+
+      with self._lock:
+        self._entries[version] = (entry, size)
+        self._evict()
+        self._update_gauges()
+      return entry
+
+  def prewarm(self, version):
+    """ Load `version` in a background thread so the first request doesn't pay the load cost. """
+    def _load():
+      try:
+        self.get(version)
+      except Exception as e:
+        logger.error(f"Failed to prewarm model version '{version}': {e}")
+
+    thread = threading.Thread(target=_load, name=f"prewarm-{version}", daemon=True)
+    thread.start()
+    return thread
+
+  def evict(self, version):
+    """ Drop `version` from memory if it is loaded. """
+    with self._lock:
+      removed = self._entries.pop(version, None)
+      self._update_gauges()
+    if removed is not None:
+      MODEL_EVICTIONS.labels(version).inc()
+      gc.collect()
+
+  def stats(self):
+    with self._lock:
+      return {
+        "loaded": list(self._entries.keys()),
+        "memory_mb": round(self._memory_used() / 1024 / 1024, 1),
+        "max_loaded": self.max_loaded,
+        "memory_budget_mb": round(self.memory_budget / 1024 / 1024, 1),
+      }
+
+  def _memory_used(self):
+    return sum(size for _, size in self._entries.values())
+
+  def _evict(self):
+    """ Evict least recently used versions (always keeping the newest one). Caller holds the lock. """
+    evicted = False
+    while len(self._entries) > 1 and (len(self._entries) > self.max_loaded or (self.memory_budget and self._memory_used() > self.memory_budget)):
+      version, _ = self._entries.popitem(last=False)
+      MODEL_EVICTIONS.labels(version).inc()
+      logger.info(f"Evicted model version '{version}'.")
+      evicted = True
+    if evicted:
+      gc.collect()
+
+  def _update_gauges(self):
+    MODELS_LOADED.set(len(self._entries))
+    MODELS_MEMORY_BYTES.set(self._memory_used())
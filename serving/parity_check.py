@@ -0,0 +1,117 @@
+# Compare an inference backend (onnx, onnx-int8) with PyTorch on a fixed sample of new_ref_data.csv.
+# Reports ROUGE-L between the two outputs, the share of identical summaries and the latency of each backend.
+#
+# python parity_check.py --backend onnx-int8 --versions v1 v3 v5 --samples 20 --output parity.json
+
+import argparse
+import json
+import statistics
+import time
+
+import pandas as pd
+
+import api
+
+
+def rouge_l(reference, candidate):
+  """ ROUGE-L F1 between two texts, on lowercased whitespace tokens. """
+  ref, cand = reference.lower().split(), candidate.lower().split()
+  if not ref or not cand:
+    return float(ref == cand)
+  # Longest common subsequence, one row at a time
+  previous = [0] * (len(cand) + 1)
+  for ref_token in ref:
+    current = [0]
+    for j, cand_token in enumerate(cand):
+      current.append(previous[j] + 1 if ref_token == cand_token else max(previous[j + 1], current[j]))
+    previous = current
+  lcs = previous[-1]
+  if lcs == 0:
+    return 0.0
+  precision, recall = lcs / len(cand), lcs / len(ref)
+  return 2 * precision * recall / (precision + recall)
+
+
+def summarize(entry, version, text):
+  """ Summarize one text as the serving API does (timed). """
+  started = time.perf_counter()
+  if version == "v1":
+    summary = entry(text, max_length=api.MAX_LENGTH, min_length=api.MIN_LENGTH, do_sample=False)[0]["summary_text"]
+  elif version == "v2":
+    summary = api.get_summary(text, model=entry[0], tokenizer=entry[1])
+  else:
+    summary = api.generate_summary(text, model=entry[0], tokenizer=entry[1])
+  return summary, time.perf_counter() - started
+
+
+def load(version, backend):
+  if version == "v1":
+    return api.get_summarizer(api.MODEL_NAMES[version], backend=backend)
+  return api.get_model_tokenizer(model_name=api.MODEL_NAMES[version], backend=backend)
+
+
+def latency_stats(latencies):
+  ordered = sorted(latencies)
+  return {
+    "mean": statistics.mean(ordered),
+    "p50": ordered[len(ordered) // 2],
+    "p95": ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))],
+  }
+
+
+def check_version(version, backend, texts):
+  reference_entry, candidate_entry = load(version, "torch"), load(version, backend)
+  # Warm-up, the first call includes one-time initializations
+  summarize(reference_entry, version, texts[0])
+  summarize(candidate_entry, version, texts[0])
+
+  scores, exact, reference_latencies, candidate_latencies = [], 0, [], []
+  for text in texts:
+    reference, reference_latency = summarize(reference_entry, version, text)
+    candidate, candidate_latency = summarize(candidate_entry, version, text)
+    scores.append(rouge_l(reference, candidate))
+    exact += reference.strip() == candidate.strip()
+    reference_latencies.append(reference_latency)
+    candidate_latencies.append(candidate_latency)
+
+  reference_stats, candidate_stats = latency_stats(reference_latencies), latency_stats(candidate_latencies)
+  return {
+    "version": version,
+    "backend": backend,
+    "samples": len(texts),
+    "rouge_l": statistics.mean(scores),
+    "exact_match": exact / len(texts),
+    "torch_latency": reference_stats,
+    f"{backend}_latency": candidate_stats,
+    "speedup": reference_stats["mean"] / candidate_stats["mean"],
+  }
+
+
+def main():
+  parser = argparse.ArgumentParser(description="Compare an inference backend with PyTorch (ROUGE-L, exact match, latency).")
+  parser.add_argument("--backend", default="onnx-int8", choices=["onnx", "onnx-int8"])
+  parser.add_argument("--versions", nargs="+", default=api.VERSIONS)
+  parser.add_argument("--data", default="/data/new_ref_data.csv")
+  parser.add_argument("--samples", type=int, default=20)
+  parser.add_argument("--seed", type=int, default=0)
+  parser.add_argument("--output", default=None, help="JSON file for the results")
+  args = parser.parse_args()
+
+  data = pd.read_csv(args.data, usecols=["article"]).dropna()
+  texts = [api.preprocess(text) for text in data.sample(n=min(args.samples, len(data)), random_state=args.seed)["article"]]
+
+  results = []
+  for version in args.versions:
+    result = check_version(version, args.backend, texts)
+    results.append(result)
+    print(f"{version} {args.backend}: ROUGE-L={result['rouge_l']:.3f} exact={result['exact_match']:.0%} "
+          f"torch={result['torch_latency']['mean']:.2f}s {args.backend}={result[f'{args.backend}_latency']['mean']:.2f}s "
+          f"speedup=x{result['speedup']:.2f}")
+
+  if args.output:
+    with open(args.output, "w") as f:
+      json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,68 @@
+# Token-by-token summary streaming.
+# generate runs on the inference thread pool with a streamer that hands every decoded piece of text
+# over to the event loop, where it is yielded as a Server-Sent Event.
+
+import asyncio
+import json
+
+import torch
+from transformers import StoppingCriteria, StoppingCriteriaList, TextStreamer
+
+
+class QueueStreamer(TextStreamer):
+  """ Streamer pushing decoded text to an asyncio.Queue, None marks the end of generation. """
+
+  def __init__(self, tokenizer, loop, queue):
+    # The first put() of an encoder-decoder generate is the decoder start token
+    super().__init__(tokenizer, skip_prompt=True, skip_special_tokens=True)
+    self.loop = loop
+    self.queue = queue
+
+  def on_finalized_text(self, text, stream_end=False):
+    if text:
+      self.loop.call_soon_threadsafe(self.queue.put_nowait, text)
+    if stream_end:
+      self.loop.call_soon_threadsafe(self.queue.put_nowait, None)
+
+
+class CancelGeneration(StoppingCriteria):
+  """ Stops generate once the client went away. """
+
+  def __init__(self):
+    self.cancelled = False
+
+  def __call__(self, input_ids, scores, **kwargs):
+    return torch.full((input_ids.shape[0],), self.cancelled, dtype=torch.bool, device=input_ids.device)
+
+
+async def stream_generate(model, tokenizer, inputs, generate_kwargs, executor=None):
+  """ Run model.generate on `executor` and yield the decoded text as it is produced. """
+  loop = asyncio.get_running_loop()
+  queue = asyncio.Queue()
+  streamer = QueueStreamer(tokenizer, loop, queue)
+  cancel = CancelGeneration()
+
+  def run():
+    try:
+      model.generate(**inputs, **generate_kwargs, streamer=streamer, stopping_criteria=StoppingCriteriaList([cancel]))
+    except Exception as e:
+      loop.call_soon_threadsafe(queue.put_nowait, e)
+
+  generation = loop.run_in_executor(executor, run)
+  try:
+    while True:
+      item = await queue.get()
+      if item is None:
+        break
+      if isinstance(item, Exception):
+        raise item
+      yield item
+  finally:
+    cancel.cancelled = True
+    await generation
+
+
+def sse_event(data, event=None):
+  """ Format one Server-Sent Event. """
+  message = f"event: {event}\n" if event else ""
+  return message + f"data: {json.dumps(data, ensure_ascii=False)}\n\n"
@@ -0,0 +1,129 @@
+# Content-addressed summary cache.
+# Summaries are keyed by the hash of the extracted text, the model version and the generation parameters.
+# An in-process LRU sits in front of a persistent SQLite store, both with a TTL and a size limit.
+
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from metrics import SUMMARY_CACHE_REQUESTS, SUMMARY_CACHE_EVICTIONS
+
+logger = logging.getLogger(__name__)
+
+SUMMARY_CACHE_PATH = os.getenv("SUMMARY_CACHE_PATH", "/data/cache/summary_cache.sqlite")  # Empty = memory only
+SUMMARY_CACHE_TTL = float(os.getenv("SUMMARY_CACHE_TTL", str(7 * 24 * 3600)))  # Seconds
+SUMMARY_CACHE_MEMORY_ITEMS = int(os.getenv("SUMMARY_CACHE_MEMORY_ITEMS", "1024"))
+SUMMARY_CACHE_DISK_ITEMS = int(os.getenv("SUMMARY_CACHE_DISK_ITEMS", "100000"))
+
+PRUNE_EVERY = 100  # Writes between two clean-ups of the disk store
+
+
+def make_key(text, version, **params):
+  """ Cache key of a summary : hash of the text + version + generation parameters. """
+  text_hash = hashlib.sha256(text.encode("utf-8")).hexdigest()
+  params_part = ",".join(f"{name}={value}" for name, value in sorted(params.items()))
+  return f"{text_hash}:{version}:{params_part}"
+
+
+class SummaryCache:
+  """
+  Two-tier cache : memory LRU, then SQLite.
+  Methods are blocking (disk access) and thread-safe, call them from a worker thread in async code.
+  """
+
+  def __init__(self, path=SUMMARY_CACHE_PATH, ttl=SUMMARY_CACHE_TTL, memory_items=SUMMARY_CACHE_MEMORY_ITEMS, disk_items=SUMMARY_CACHE_DISK_ITEMS):
+    self.ttl = ttl
+    self.memory_items = memory_items
+    self.disk_items = disk_items
+    self._memory = OrderedDict()  # key -> (summary, expires_at)
+    self._lock = threading.Lock()
+    self._writes = 0
+    self.path = path
+    self._db_pid = None
+    self._connection = None
+
+  @property
+  def _db(self):
+    """ SQLite connection of the current process, opened on first use (connections can't be shared with forked workers). """
+    if self.path and self._db_pid != os.getpid():
+      self._db_pid = os.getpid()
+      self._connection = None
+      try:
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        self._connection = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None, timeout=10)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute(
+          "CREATE TABLE IF NOT EXISTS summaries ("
+          "key TEXT PRIMARY KEY, summary TEXT NOT NULL, created_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+        )
+        self._connection.execute("CREATE INDEX IF NOT EXISTS summaries_accessed_at ON summaries (accessed_at)")
+      except (sqlite3.Error, OSError) as e:
+        logger.error(f"Summary cache disk store unavailable at '{self.path}', using memory only: {e}")
+        self._connection = None
+    return self._connection
+
+  def get(self, key):
+    """ Return the cached summary or None. """
+    now = time.time()
+    with self._lock:
+      cached = self._memory.get(key)
+      if cached is not None:
+        summary, expires_at = cached
+        if expires_at > now:
+          self._memory.move_to_end(key)
+          SUMMARY_CACHE_REQUESTS.labels("memory", "hit").inc()
+          return summary
+        del self._memory[key]
+
+      if self._db is not None:
+        row = self._db.execute("SELECT summary, created_at FROM summaries WHERE key = ?", (key,)).fetchone()
+        if row is not None and row[1] + self.ttl > now:
+          self._db.execute("UPDATE summaries SET accessed_at = ? WHERE key = ?", (now, key))
+          self._remember(key, row[0], row[1] + self.ttl)
+          SUMMARY_CACHE_REQUESTS.labels("disk", "hit").inc()
+          return row[0]
+        if row is not None:
+          self._db.execute("DELETE FROM summaries WHERE key = ?", (key,))
+
+    SUMMARY_CACHE_REQUESTS.labels("all", "miss").inc()
+    return None
+
+  def set(self, key, summary):
+    now = time.time()
+    with self._lock:
+      self._remember(key, summary, now + self.ttl)
+      if self._db is not None:
+        self._db.execute(
+          "INSERT OR REPLACE INTO summaries (key, summary, created_at, accessed_at) VALUES (?, ?, ?, ?)",
+          (key, summary, now, now),
+        )
+        self._writes += 1
+        if self._writes % PRUNE_EVERY == 0:
+          self._prune(now)
+
+  def stats(self):
+    with self._lock:
+      disk_items = self._db.execute("SELECT COUNT(*) FROM summaries").fetchone()[0] if self._db is not None else 0
+      return {"memory_items": len(self._memory), "disk_items": disk_items, "ttl": self.ttl}
+
+  def _remember(self, key, summary, expires_at):
+    """ Insert in the memory LRU. Caller holds the lock. """
+    self._memory[key] = (summary, expires_at)
+    self._memory.move_to_end(key)
+    while len(self._memory) > self.memory_items:
+      self._memory.popitem(last=False)
+      SUMMARY_CACHE_EVICTIONS.labels("memory").inc()
+
+  def _prune(self, now):
+    """ Drop expired rows, then the least recently used ones above the size limit. Caller holds the lock. """
+    expired = self._db.execute("DELETE FROM summaries WHERE created_at < ?", (now - self.ttl,)).rowcount
+    excess = self._db.execute("SELECT COUNT(*) FROM summaries").fetchone()[0] - self.disk_items
+    if excess > 0:
+      self._db.execute(
+        "DELETE FROM summaries WHERE key IN (SELECT key FROM summaries ORDER BY accessed_at LIMIT ?)", (excess,)
+      )
+    SUMMARY_CACHE_EVICTIONS.labels("disk").inc(max(expired, 0) + max(excess, 0))
@@ -0,0 +1,42 @@
+# Main content extraction of the saved pages of fixtures/pages (also the corpus of extraction_benchmark.py).
+#
+# python -m pytest test_extractors.py
+
+import os
+
+import pytest
+
+import extractors
+
+PAGES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures", "pages")
+
+
+def extract_page(file_name, engine="lxml"):
+  with open(os.path.join(PAGES_DIR, file_name), encoding="utf-8") as f:
+    html = f.read()
+  return " ".join(extractors.extract(extractors.parse(html, engine), f"http://127.0.0.1/{file_name}", engine).split())
+
+
+# Page, text of its main content, boilerplate text that must not be kept
+@pytest.mark.parametrize("file_name, content, boilerplate", [
+  ("generic_blog.html", "the waiting is where the bread is made", "Thanks, the schedule section"),
+  # Wrappers of the main content whose class or id holds a boilerplate word
+  ("generic_has_sidebar.html", "waterlogged cloves rot long before they root", "Join our allotment society"),
+  ("generic_header_offset.html", "The Vasco da Gama Bridge", "reproduction forbidden"),
+  ("generic_comments_enabled.html", "most new services rely on public support", "Took the Nightjet"),
+])
+def test_generic_main_content(file_name, content, boilerplate):
+  text = extract_page(file_name)
+  assert content in text
+  assert boilerplate not in text
+  assert content in extract_page(file_name, "bs4")
+
+
+def test_wikipedia_paragraphs():
+  text = extract_page("wikipedia_bicycle.html")
+  assert text.startswith("A bicycle, also called a pedal cycle")
+  assert text == extract_page("wikipedia_bicycle.html", "bs4")
+
+
+def test_empty_page():
+  assert extractors.extract(extractors.parse(""), "http://127.0.0.1/page.html").strip() == ""
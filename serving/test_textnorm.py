@@ -0,0 +1,44 @@
+# textnorm.normalize must give the same text as the previous preprocess() + clean_input_data() of api.py.
+#
+# python -m pytest test_textnorm.py
+
+import random
+import re
+
+import pytest
+
+from textnorm import normalize
+
+
+def reference(text):
+  """ Previous implementation (api.preprocess then api.clean_input_data). """
+  text = text.replace("\n", " ").replace("\t", " ")
+  text = " ".join(text.split())
+  text = text.replace('"', "'")
+  text = re.sub(r'\[\d+\]', '', text)
+  text = re.sub(r'\[.*?\]', '', text)
+  return text.replace("\x00", "")
+
+
+# Characters the two implementations could treat differently : unicode spaces and digits, quotes, brackets, nulls
+ALPHABET = list("ab1 \n\t\r\"'[]") + ["\x00", "\x0b", "\x1c", "\x85", "\xa0", " ", "　", "٣", "１", "é"]
+
+
+@pytest.mark.parametrize("text", [
+  "",
+  "  A bicycle\n\tis a vehicle.[1] It has \"two\" wheels[edit] ",
+  "[[1] nested] text",
+  "a \x00 b",
+  "[1\x00] citation with a null",
+  "unclosed [bracket",
+])
+def test_normalize_examples(text):
+  assert normalize(text) == reference(text)
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_normalize_random_texts(seed):
+  rng = random.Random(seed)
+  for _ in range(20000):
+    text = "".join(rng.choice(ALPHABET) for _ in range(rng.randint(0, 60)))
+    assert normalize(text) == reference(text), repr(text)
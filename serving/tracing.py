@@ -0,0 +1,70 @@
+# Per-request stage timings (fetch, parse, extract, preprocess, tokenize, generate, decode, ...).
+# A request starts a trace (a dict stored in a context variable), every `span` adds its duration to it,
+# and api.py returns the trace in the Server-Timing response header.
+# asyncio.to_thread copies the context, so spans in worker threads land in the request's trace. Batched
+# inference serves several requests at once : it keeps its own timings, merged into each request's trace.
+
+import contextvars
+import time
+from contextlib import contextmanager
+
+_trace = contextvars.ContextVar("trace", default=None)
+_labels = contextvars.ContextVar("trace_labels", default=None)
+
+
+def start_trace():
+  """ Start the trace of a request, returns its (timings, labels) dicts. """
+  trace, labels = {}, {}
+  _trace.set(trace)
+  _labels.set(labels)
+  return trace, labels
+
+
+def current_trace():
+  return _trace.get()
+
+
+def set_labels(**labels):
+  """ Labels of the request (version, source, ...) used when its timings are exported. """
+  current = _labels.get()
+  if current is not None:
+    current.update(labels)
+
+
+def record(name, seconds):
+  trace = _trace.get()
+  if trace is not None:
+    trace[name] = trace.get(name, 0.0) + seconds
+
+
+def merge(timings):
+  for name, seconds in timings.items():
+    record(name, seconds)
+
+
+@contextmanager
+def span(name, timings=None):
+  """ Time the block into `timings` if given, into the current trace otherwise. """
+  started = time.perf_counter()
+  try:
+    yield
+  finally:
+    elapsed = time.perf_counter() - started
+    if timings is not None:
+      timings[name] = timings.get(name, 0.0) + elapsed
+    else:
+      record(name, elapsed)
+
+
+def server_timing_header(trace):
+  """ {"fetch": 0.12} -> "fetch;dur=120.0" (milliseconds) """
+  return ", ".join(f"{name};dur={seconds * 1000:.1f}" for name, seconds in trace.items())
+
+
+def parse_server_timing(header):
+  """ Inverse of server_timing_header, durations in seconds. """
+  timings = {}
+  for item in filter(None, (part.strip() for part in (header or "").split(","))):
+    name, _, duration = item.partition(";dur=")
+    timings[name] = float(duration) / 1000 if duration else 0.0
+  return timings
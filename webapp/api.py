@@ -1,5 +1,6 @@
 import streamlit as st
 import requests
+import json
 import logging
 from streamlit_star_rating import st_star_rating
 
@@ -37,6 +38,9 @@ if 'last_link' not in st.session_state:
 if 'feedback_sent' not in st.session_state:
     st.session_state['feedback_sent'] = False
 
+if 'summary_id' not in st.session_state:
+    st.session_state['summary_id'] = None
+
 if 'original_text' not in st.session_state:
     st.session_state['original_text'] = None
 
@@ -52,28 +56,50 @@ def update_model():
 
 
 def predict_url_content(url):
-    api_url = "http://serving-api:8080/summary"
+    # A preview of the summary is streamed (Server-Sent Events) and displayed while it is generated,
+    # then replaced by the summary of /summary (the "done" event), the one that is rated
+    api_url = "http://serving-api:8080/summary/stream"
     params = {'url': url, 'version': st.session_state['chosen_model']}
+    placeholder = st.empty()
+    partial_summary = ""
+    summary_received = False
+    error_received = False
     try:
-        response = requests.post(api_url, params=params)
-        response.raise_for_status()
-        result = response.json()
-        summary = result.get('summary', None)
-        original = result.get('original', None)
-        
-        if summary:
-            st.session_state['last_summary'] = summary
-            st.session_state['original_text'] = original
-        else:
+        with requests.post(api_url, params=params, stream=True) as response:
+            if response.status_code == 404:
+                # Read while the response is still open (no english transcript, ...)
+                st.error(f"{response.json().get('detail', 'Unknown error')}")
+                return
+            response.raise_for_status()
+            response.encoding = "utf-8"
+            event = None
+            for line in response.iter_lines(decode_unicode=True):
+                if line.startswith("event:"):
+                    event = line[len("event:"):].strip()
+                elif line.startswith("data:"):
+                    data = json.loads(line[len("data:"):])
+                    if event == "done" and data.get('summary'):
+                        summary_received = True
+                        st.session_state['last_summary'] = data.get('summary', None)
+                        st.session_state['original_text'] = data.get('original', None)
+                        st.session_state['summary_id'] = data.get('summary_id', None)
+                    elif event == "error":
+                        error_received = True
+                        st.error(f"Erreur lors de la génération du résumé : {data.get('detail', 'Unknown error')}")
+                    else:
+                        partial_summary += data.get('token', "")
+                        placeholder.success(partial_summary)
+                else:
+                    event = None  # Blank line, end of the event
+
+        if not summary_received and not error_received:
             st.error("L'API n'a pas renvoyé de résumé valide.")
     except requests.exceptions.HTTPError as http_err:
-        if response.status_code == 404:
-            error_message = response.json().get("detail", "Unknown error")
-            st.error(f"{error_message}")
-        else:
-            st.error(f"Erreur HTTP : {http_err}")
+        st.error(f"Erreur HTTP : {http_err}")
     except requests.exceptions.RequestException as e:
         st.error(f"Erreur lors de la connexion à l'API : {e}")
+    finally:
+        placeholder.empty()  # The full summary is displayed below once generated
 
 def send_feedback(url, summary, rating):
     api_url = "http://serving-api:8080/feedback"
@@ -81,7 +107,8 @@ def send_feedback(url, summary, rating):
         'url': url,
         'summary': summary,
         'rating': rating,
-        'version': st.session_state['chosen_model']
+        'version': st.session_state['chosen_model'],
+        'summary_id': st.session_state['summary_id']  # Lets the API reuse the summarized text
     }
     try:
         response = requests.post(api_url, json=data)